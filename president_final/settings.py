@@ -39,8 +39,38 @@ INFOCLINICA_HOST = os.getenv('INFOCLINICA_HOST', 'demo.infoclinica.ru')
 INFOCLINICA_CERT = os.getenv('INFOCLINICA_CERT', '')
 INFOCLINICA_KEY = os.getenv('INFOCLINICA_KEY', '')
 
+# Пул HTTP-соединений к Инфоклинике (один на процесс)
+INFOCLINICA_POOL_SIZE = int(os.getenv('INFOCLINICA_POOL_SIZE', '10'))
+INFOCLINICA_CONNECT_TIMEOUT = float(os.getenv('INFOCLINICA_CONNECT_TIMEOUT', '5'))
+INFOCLINICA_READ_TIMEOUT = float(os.getenv('INFOCLINICA_READ_TIMEOUT', '30'))
+
+# Параллельные запросы к Инфоклинике: число одновременных запросов и лимит запросов в секунду на хост (0 - без лимита)
+INFOCLINICA_MAX_CONCURRENCY = int(os.getenv('INFOCLINICA_MAX_CONCURRENCY', '8'))
+INFOCLINICA_RATE_LIMIT = float(os.getenv('INFOCLINICA_RATE_LIMIT', '20'))
+
+# Планировщик синхронизации (reminder/scheduler.py): периоды в секундах, время отправки обзвона в ACS - 'HH:MM'
+SCHEDULER_QUEUE_INTERVAL = int(os.getenv('SCHEDULER_QUEUE_INTERVAL', '600'))
+SCHEDULER_ACS_POLL_INTERVAL = int(os.getenv('SCHEDULER_ACS_POLL_INTERVAL', '300'))
+SCHEDULER_ACS_PUSH_TIME = os.getenv('SCHEDULER_ACS_PUSH_TIME', '09:00')
+
+# Отправка обзвона в ACS: число одновременных запросов add_orders и размер пачки записей очереди
+ACS_MAX_WORKERS = int(os.getenv('ACS_MAX_WORKERS', '8'))
+ACS_ORDERS_CHUNK_SIZE = int(os.getenv('ACS_ORDERS_CHUNK_SIZE', '100'))
+
+# Прогрев кэша расписаний перед обзвоном: сколько прогретые записи хранятся (окно обзвона), секунд
+SCHEDULE_WARM_RETENTION = int(os.getenv('SCHEDULE_WARM_RETENTION', str(60 * 60 * 6)))
+
 OPENAI_API_KEY = os.getenv('OPEN_AI_API_KEY')
 
+# Клиент OpenAI (один на процесс): размер пула keep-alive соединений, таймауты в секундах, число повторов
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '20'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '30'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+
+# Голосовой бот: минимальная уверенность правил разбора запроса, ниже которой запрос уходит в LLM (0..1)
+VOICEBOT_NLU_CONFIDENCE_THRESHOLD = float(os.getenv('VOICEBOT_NLU_CONFIDENCE_THRESHOLD', '0.8'))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -121,6 +151,15 @@ REDIS_DB = 0
 REDIS_PASSWORD = ''
 REDIS_CONTEXT_EXPIRY = 900
 
+# Кэш расписаний общий для всех воркеров, поэтому храним его в Redis, а не в памяти процесса
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        'KEY_PREFIX': 'president',
+    }
+}
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
@@ -9,8 +9,10 @@ from collections import defaultdict
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
+from django.utils.timezone import now
+
 from reminder.models import Appointment, Call
-from reminder.properties.utils import ACS_BASE_URL
+from reminder.properties.utils import ACS_BASE_URL, ACS_POLL_BATCH_SIZE
 
 from reminder.properties.utils import get_latest_api_key
 
@@ -60,6 +62,10 @@ def process_audio_data(audio_data_list):
         if order_key:
             audio_data_by_key[order_key].append(audio_data)
 
+    # Resolve all Call records of the page with one query
+    calls = get_calls_by_order_keys(audio_data_by_key.keys())
+    calls_to_update = []
+
     # Process grouped records and select the latest for each
     for order_key, audio_records in audio_data_by_key.items():
         # Select the record with the latest date
@@ -68,17 +74,39 @@ def process_audio_data(audio_data_list):
         audio_link = last_audio_data.get('link')
 
         if order_key and audio_link:
-            # Find the Call record by order key
-            call = Call.objects.filter(order_key=order_key).first()
+            call = calls.get(order_key)
 
             if call:
                 # Update the audio link
-                call.audio_link = audio_link
-                call.save()
+                if call.audio_link != audio_link:
+                    call.audio_link = audio_link
+                    calls_to_update.append(call)
                 print(f"Updated audio link for call with order key: {order_key}")
             else:
                 print(f"Call with order key {order_key} not found.")
 
+    if calls_to_update:
+        updated_at = now()
+        for call in calls_to_update:
+            call.updated_at = updated_at
+        Call.objects.bulk_update(calls_to_update, ['audio_link', 'updated_at'])
+
+
+def get_calls_by_order_keys(order_keys):
+    """
+    Resolves Call records for a page of order keys with a single query.
+
+    Args:
+        order_keys: Iterable of order keys
+
+    Returns:
+        Dict {order_key: Call}; for duplicated keys the newest call wins, as with filter().first()
+    """
+    calls = {}
+    for call in Call.objects.filter(order_key__in=list(order_keys)).select_related('appointment'):
+        calls.setdefault(call.order_key, call)
+    return calls
+
 
 def get_audio_data():
     """
@@ -87,17 +115,10 @@ def get_audio_data():
     Returns:
         Tuple (audio_data, error) where audio_data is the combined API responses and error is any error message
     """
-    offset = 0
     all_audio_data = []
 
-    while True:
-        keys_array = get_keys_batch(batch_size=5, offset=offset)
-        if not keys_array:
-            break
-
+    for keys_array in iter_keys_batches():
         keys_str = ','.join(keys_array)
-        if not keys_str:
-            break
 
         audio_data_list, error = fetch_audio_data(keys_str)
         if error:
@@ -106,29 +127,51 @@ def get_audio_data():
         process_audio_data(audio_data_list)
         all_audio_data.extend(audio_data_list)
 
-        offset += 5
-
     return all_audio_data, None
 
 
-"""Below code to get key to last 5 contacts"""
+"""Below code to get keys of unprocessed contacts, newest first"""
 
 
-def get_keys_batch(batch_size=5, offset=0):
+def get_keys_batch(batch_size=ACS_POLL_BATCH_SIZE, before_id=None):
     """
     Gets a batch of order keys from Call records that have not been processed.
+    Pages by keyset on id (id < before_id) instead of OFFSET, so every page costs the same.
 
     Args:
         batch_size: Number of keys to fetch
-        offset: Offset to start from
+        before_id: Id of the last call of the previous page (None for the first page)
 
     Returns:
-        List of order keys
+        Tuple (keys, last_id) - list of order keys and the id to pass as before_id for the next page
     """
     # Filter only calls that have is_added=False
-    keys = Call.objects.filter(is_added=False).order_by('-id')[offset:offset + batch_size].values_list('order_key',
-                                                                                                       flat=True)
-    return list(keys)
+    calls = Call.objects.filter(is_added=False)
+    if before_id is not None:
+        calls = calls.filter(id__lt=before_id)
+
+    rows = list(calls.order_by('-id').values_list('id', 'order_key')[:batch_size])
+    if not rows:
+        return [], None
+
+    return [order_key for _, order_key in rows if order_key], rows[-1][0]
+
+
+def iter_keys_batches(batch_size=ACS_POLL_BATCH_SIZE):
+    """
+    Yields batches of order keys of unprocessed calls, newest first, until all calls are paged through.
+
+    Args:
+        batch_size: Number of keys per batch (keys are sent to ACS comma-separated in one request)
+    """
+    before_id = None
+
+    while True:
+        keys, before_id = get_keys_batch(batch_size=batch_size, before_id=before_id)
+        if before_id is None:
+            break
+        if keys:
+            yield keys
 
 
 if __name__ == '__main__':
@@ -5,18 +5,26 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
-from reminder.acs_requests.fetch_audio_data import get_keys_batch
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
+
+from reminder.acs_requests.fetch_audio_data import get_calls_by_order_keys, iter_keys_batches
 from reminder.models import Appointment, Call
 from reminder.properties.utils import ACS_BASE_URL
 from reminder.properties.utils import get_latest_api_key
 
+# The first BPM action of an order never changes, so it is memoized per order_key
+BPM_ACTION_CACHE_TIMEOUT = 60 * 60 * 6
+
 
-def fetch_status_data(keys_str):
+def fetch_status_data(keys_str, api_key=None):
     """
     Fetches status data from the ACS API for the given order keys.
 
     Args:
         keys_str: Comma-separated string of order keys
+        api_key: ACS API key (read from the database if not given)
 
     Returns:
         Tuple (data, error) where data is the API response and error is any error message
@@ -24,7 +32,7 @@ def fetch_status_data(keys_str):
     if not keys_str:
         return None, 'No keys found in the database.'
 
-    api_key = get_latest_api_key()
+    api_key = api_key or get_latest_api_key()
     if api_key:
         url = f'{ACS_BASE_URL}/api/v2/orders/public/{api_key}/get_status?keys={keys_str}'
 
@@ -46,50 +54,126 @@ def fetch_bpm_actions_data(order_key):
     Returns:
         First BPM action or None if there's an error
     """
-    api_key = get_latest_api_key()
-    if api_key:
-        url = f'{ACS_BASE_URL}/api/v2/orders/public/{api_key}/get_bpm_actions?keys={order_key}'
+    return fetch_first_bpm_actions([order_key]).get(order_key)
+
+
+def get_bpm_action_cache_key(order_key):
+    return f"bpm_first_action_{order_key}"
+
+
+def fetch_first_bpm_actions(order_keys, api_key=None):
+    """
+    Fetches the first BPM action for a page of order keys.
+    Memoized actions are taken from the cache; the rest are requested from get_bpm_actions
+    in one request (the endpoint accepts comma-separated keys).
+
+    Args:
+        order_keys: Order keys to fetch BPM actions for
+        api_key: ACS API key (read from the database if not given)
 
+    Returns:
+        Dict {order_key: first BPM action}; keys without actions or with errors are missing
+    """
+    order_keys = list(dict.fromkeys(order_keys))
+    if not order_keys:
+        return {}
+
+    try:
+        cached = cache.get_many([get_bpm_action_cache_key(order_key) for order_key in order_keys])
+    except Exception as e:
+        print(f"Error reading BPM actions cache: {str(e)}")
+        cached = {}
+
+    first_actions = {}
+    missing_keys = []
+    for order_key in order_keys:
+        action = cached.get(get_bpm_action_cache_key(order_key))
+        if action is not None:
+            first_actions[order_key] = action
+        else:
+            missing_keys.append(order_key)
+
+    if not missing_keys:
+        return first_actions
+
+    api_key = api_key or get_latest_api_key()
+    if not api_key:
+        return first_actions
+
+    url = f'{ACS_BASE_URL}/api/v2/orders/public/{api_key}/get_bpm_actions?keys={",".join(missing_keys)}'
+
+    try:
+        response = requests.get(url)
+        response.raise_for_status()
+        bpm_data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching BPM actions for order_keys {missing_keys}: {str(e)}")
+        return first_actions
+
+    fetched = {}
+    if bpm_data and isinstance(bpm_data, dict):
+        for order_key in missing_keys:
+            actions = bpm_data.get(order_key)
+            if actions and isinstance(actions, list):
+                fetched[order_key] = actions[0]  # Take the first element
+
+    if fetched:
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            bpm_data = response.json()
-            if bpm_data and isinstance(bpm_data, dict):
-                first_action = bpm_data.get(order_key, [])[0]  # Take the first element
-                return first_action
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching BPM actions for order_key {order_key}: {str(e)}")
-    return None
+            cache.set_many(
+                {get_bpm_action_cache_key(order_key): action for order_key, action in fetched.items()},
+                timeout=BPM_ACTION_CACHE_TIMEOUT
+            )
+        except Exception as e:
+            print(f"Error writing BPM actions cache: {str(e)}")
+
+    first_actions.update(fetched)
+    return first_actions
 
 
-def should_process_order(order_key):
+def should_process_order(order_key, first_actions=None):
     """
     Determines if an order should be processed based on its BPM actions.
 
     Args:
         order_key: Order key to check
+        first_actions: Result of fetch_first_bpm_actions for the page (fetched for this key if not given)
 
     Returns:
         True if the order should be processed, False otherwise
     """
-    first_action = fetch_bpm_actions_data(order_key)
+    if first_actions is None:
+        first_actions = fetch_first_bpm_actions([order_key])
+
+    first_action = first_actions.get(order_key)
     if first_action and first_action.get('type') == 'segment':
         return True  # If type is "segment", process the order
     return False  # Otherwise skip it
 
 
-def process_status_data(status_data_list):
+def process_status_data(status_data_list, api_key=None):
     """
     Processes status data from the API and updates Call records with status IDs.
 
     Args:
         status_data_list: Status data from the API
+        api_key: ACS API key (read from the database if not given)
     """
     if isinstance(status_data_list, dict):
+        # BPM actions of the whole page are fetched in one request
+        first_actions = fetch_first_bpm_actions(
+            [order_key for order_key, details in status_data_list.items() if isinstance(details, dict)],
+            api_key=api_key
+        )
+
+        # Resolve all Call records of the page with one query, write changes with bulk_update
+        calls = get_calls_by_order_keys(status_data_list.keys())
+        calls_to_update = {}
+        appointments_to_update = {}
+
         for order_key, details in status_data_list.items():
             if isinstance(details, dict):
                 # Check if this order should be processed
-                if not should_process_order(order_key):
+                if not should_process_order(order_key, first_actions):
                     print(f"Skipping order_key: {order_key} because the first action type is not 'segment'.")
                     continue  # Skip this order
 
@@ -97,23 +181,33 @@ def process_status_data(status_data_list):
                     if isinstance(status_info, dict) and 'status_id' in status_info:
                         status_id = status_info['status_id']
 
-                        # Find the Call record by order key
-                        call = Call.objects.filter(order_key=order_key).first()
+                        call = calls.get(order_key)
 
                         if call:
                             call.status_id = status_id
-                            call.save()
+                            calls_to_update[call.pk] = call
                             print(f"Updated status for order_key: {order_key} to status_id: {status_id}")
 
                             # Optionally update the associated appointment's status
                             if call.appointment:
                                 call.appointment.status = status_id
-                                call.appointment.save()
+                                appointments_to_update[call.appointment.pk] = call.appointment
                                 print(f"Updated appointment {call.appointment.appointment_id} status to: {status_id}")
                         else:
                             print(f"Call with order key {order_key} not found.")
             else:
                 print(f"Unexpected format for details: {details}")
+
+        updated_at = now()
+        with transaction.atomic():
+            if calls_to_update:
+                for call in calls_to_update.values():
+                    call.updated_at = updated_at
+                Call.objects.bulk_update(list(calls_to_update.values()), ['status_id', 'updated_at'])
+            if appointments_to_update:
+                for appointment in appointments_to_update.values():
+                    appointment.updated_at = updated_at
+                Appointment.objects.bulk_update(list(appointments_to_update.values()), ['status', 'updated_at'])
     else:
         raise ValueError("Unexpected format for status_data_list")
 
@@ -125,27 +219,21 @@ def get_status_data():
     Returns:
         Tuple (status_data, error) where status_data is the combined API responses and error is any error message
     """
-    offset = 0
     all_status_data = []
 
-    while True:
-        keys_array = get_keys_batch(batch_size=5, offset=offset)
-        if not keys_array:
-            break
+    # The API key is read once per polling run
+    api_key = get_latest_api_key()
 
+    for keys_array in iter_keys_batches():
         keys_str = ','.join(keys_array)
-        if not keys_str:
-            break
 
-        status_data_list, error = fetch_status_data(keys_str)
+        status_data_list, error = fetch_status_data(keys_str, api_key=api_key)
         if error:
             return [], error
 
-        process_status_data(status_data_list)
+        process_status_data(status_data_list, api_key=api_key)
         all_status_data.extend(status_data_list)
 
-        offset += 5
-
     return all_status_data, None
 
 
@@ -7,301 +7,427 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
 import requests
-import json
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
 from django.utils.timezone import now
 from reminder.properties.utils import ACS_BASE_URL, get_latest_api_key, get_formatted_date_info
 from reminder.models import Appointment, Call, QueueInfo, Patient, Doctor
+from reminder.infoclinica_requests.reference_cache import get_doctor
 
 
-def process_queue_to_acs():
+def first_appointment_per_patient(queryset, order_by):
+    """
+    Возвращает {patient_id: прием} - первый прием каждого пациента в порядке order_by.
+    Выбирается одним запросом с оконной функцией ROW_NUMBER() по пациенту.
+    """
+    ranked = queryset.select_related('doctor', 'clinic', 'department').annotate(
+        row_number=Window(RowNumber(), partition_by=F('patient_id'), order_by=order_by)
+    ).filter(row_number=1)
+    return {appointment.patient_id: appointment for appointment in ranked}
+
+
+def prefetch_order_context(queue_entries):
+    """
+    Заранее выбирает данные, нужные build_queue_order, для всей пачки записей очереди:
+    последний прием с врачом и ближайший будущий прием каждого пациента - по одному запросу.
+    Врачи и клиники берутся из справочного кэша и select_related очереди.
+
+    Возвращает:
+    dict: {'recent_appointments': {patient_id: прием}, 'upcoming_appointments': {patient_id: прием}}
+    """
+    patient_ids = {queue_entry.patient_id for queue_entry in queue_entries if queue_entry.patient_id}
+    if not patient_ids:
+        return {'recent_appointments': {}, 'upcoming_appointments': {}}
+
+    active_appointments = Appointment.objects.filter(patient_id__in=patient_ids, is_active=True)
+
+    return {
+        'recent_appointments': first_appointment_per_patient(
+            active_appointments.filter(doctor__isnull=False), [F('start_time').desc(), F('pk').desc()]
+        ),
+        'upcoming_appointments': first_appointment_per_patient(
+            active_appointments.filter(start_time__gt=now()), [F('start_time').asc(), F('pk').asc()]
+        ),
+    }
+
+
+def build_queue_order(queue_entry, context=None):
+    """
+    Собирает заказ add_orders для записи очереди.
+    context - результат prefetch_order_context для пачки (если не передан, выбирается для одной записи).
+
+    Возвращает:
+    dict: {'queue_entry', 'patient', 'appointment', 'phone', 'json_data'} или None, если запись нельзя отправить
+    """
+    patient = queue_entry.patient
+    if not patient:
+        print(f"⚠ Очередь {queue_entry.queue_id} не имеет пациента, пропускаем.")
+        return None
+
+    if context is None:
+        context = prefetch_order_context([queue_entry])
+
+    if not patient.phone_mobile:
+        print(f"⚠ Пациент {patient.patient_code} не имеет номера телефона, пропускаем.")
+        return None
+
+    queue_reason_code = (
+            queue_entry.internal_reason_code or
+            getattr(patient, 'last_queue_reason_code', None) or
+            "00PP0consulta"
+    )
+
+    print(f"✅ Используем причину: {queue_reason_code}")
+
+    # Обработка номера телефона
+    phone = ''.join(filter(str.isdigit, patient.phone_mobile))
+    if phone.startswith('8'):
+        phone = '7' + phone[1:]
+    elif not phone.startswith('7'):
+        phone = '7' + phone
+
+    # Базовые данные приема
+    doctor_name = "Не назначен"
+    clinic_name = ""
+    clinic_address = ""
+    department_name = ""
+    appointment_date = "Не назначено"
+    appointment_time = "Не назначено"
+    appointment_id = None
+    doctor_code = None
+    specialization_id = None
+    cabinet_number = None
+    service_id = None
+    weekday = ""
+    weekday_kz = ""
+    date = ""
+    date_kz = ""
+    relation = None
+    appointment = None
+    reception_time_for_api = ""
+
+    # 1. Сначала проверяем, есть ли информация о враче в самой записи очереди
+    if queue_entry.doctor_code and queue_entry.doctor_name:
+        doctor_code = queue_entry.doctor_code
+        doctor_name = queue_entry.doctor_name
+        print(f"✅ Использую информацию о враче из записи очереди: {doctor_name}")
+
+        # Пробуем получить дополнительную информацию о враче из модели Doctor
+        try:
+            doctor = get_doctor(doctor_code)
+            if doctor and doctor.specialization_id:
+                specialization_id = doctor.specialization_id
+                print(f"✅ Добавлена информация о специализации из модели Doctor")
+        except Exception as e:
+            print(f"⚠ Не удалось получить дополнительную информацию о враче: {e}")
+
+    # 2. Если в queue_entry нет информации о враче, пробуем найти подходящего врача для данного пациента
+    else:
+        try:
+            # Можно попробовать найти последнего врача, с которым взаимодействовал пациент
+            recent_appointment = context['recent_appointments'].get(patient.pk)
+
+            if recent_appointment and recent_appointment.doctor:
+                doctor_name = str(recent_appointment.doctor.full_name)
+                doctor_code = recent_appointment.doctor.doctor_code
+                specialization_id = recent_appointment.doctor.specialization_id
+                print(f"✅ Использую информацию о враче из предыдущего приема: {doctor_name}")
+        except Exception as e:
+            print(f"⚠ Не удалось найти информацию о предыдущем враче: {e}")
+
+    # 3. Получаем информацию о клинике
+    if queue_entry.target_branch:
+        clinic_name = str(queue_entry.target_branch.name)
+        clinic_address = str(queue_entry.target_branch.address or "")
+        print(f"✅ Использую информацию о клинике из target_branch: {clinic_name}")
+
+    # 4. Получаем информацию об отделении, если она есть в queue_entry
+    if queue_entry.department_name:
+        department_name = str(queue_entry.department_name)
+        print(f"✅ Использую информацию об отделении из записи очереди: {department_name}")
+
+    # 5. Если у пациента есть активная запись на прием, используем ее данные для дополнительной информации
+    try:
+        # Поиск связанного приема
+        appointment = context['upcoming_appointments'].get(patient.pk)
+
+        if appointment:
+            print("✅ Найдена активная запись на прием, добавляю информацию")
+
+            # Если у нас еще нет информации о враче, берем из приема
+            if doctor_name == "Не назначен" and appointment.doctor:
+                doctor_name = str(appointment.doctor.full_name)
+                doctor_code = appointment.doctor.doctor_code
+                specialization_id = appointment.doctor.specialization_id
+
+            # Если у нас еще нет информации о клинике, берем из приема
+            if not clinic_name and appointment.clinic:
+                clinic_name = str(appointment.clinic.name)
+                clinic_address = str(appointment.clinic.address or "")
+
+            # Если у нас еще нет информации об отделении, берем из приема
+            if not department_name and appointment.department:
+                department_name = str(appointment.department.name)
+
+            # Преобразование времени приема в нужный формат
+            reception_start_time = appointment.start_time
+            date_object = reception_start_time
+
+            # Определяем отношение к текущему дню (сегодня/завтра)
+            today = datetime.now().date()
+            tomorrow = today + timedelta(days=1)
+            reception_date = reception_start_time.date()
+
+            if reception_date == today:
+                relation = "today"
+            elif reception_date == tomorrow:
+                relation = "tomorrow"
+
+            # Форматирование даты и времени
+            appointment_date = reception_start_time.strftime("%d.%m.%Y")
+            appointment_time = reception_start_time.strftime("%H:%M")
+            appointment_id = appointment.appointment_id
+            reception_time_for_api = reception_start_time.strftime('%Y-%m-%d %H:%M')
+
+            # Получаем дополнительные данные
+            cabinet_number = appointment.cabinet_number
+            service_id = appointment.service_id
+
+            # Получаем информацию о дне недели
+            weekday_index = reception_date.weekday()
+            weekday_map_ru = {
+                0: "Понедельник", 1: "Вторник", 2: "Среду", 3: "Четверг",
+                4: "Пятницу", 5: "Субботу", 6: "Воскресенье"
+            }
+            weekday_map_kz = {
+                0: "Дүйсенбі", 1: "Сейсенбі", 2: "Сәрсенбі", 3: "Бейсенбі",
+                4: "Жұма", 5: "Сенбі", 6: "Жексенбі"
+            }
+            weekday = weekday_map_ru.get(weekday_index, "")
+            weekday_kz = weekday_map_kz.get(weekday_index, "")
+
+            # Форматируем дату
+            reception_day_data = get_formatted_date_info(
+                reception_start_time) if 'get_formatted_date_info' in globals() else {"date": "", "date_kz": ""}
+            date = reception_day_data.get("date", "")
+            date_kz = reception_day_data.get("date_kz", "")
+
+    except Exception as e:
+        print(f"⚠ Ошибка при получении данных о приеме: {e}")
+
+    # Формирование данных в нужном формате
+    json_data = {
+        "phone": phone,
+        "full_name": str(patient.get_full_name() or ""),
+        "info": {
+            "time": appointment_time,
+            "reception_id": appointment_id,
+            "patient_code": patient.patient_code,
+            "day": "сегодня" if relation == "today" else "завтра" if relation == "tomorrow" else "",
+            "day_kz": "бүгін" if relation == "today" else "ертең" if relation == "tomorrow" else "",
+            "weekday": weekday,
+            "weekday_kz": weekday_kz,
+            "specialist_code": doctor_code,
+            "specialization_id": specialization_id,
+            "specialist_name": doctor_name,
+            "clinic_id": queue_entry.target_branch.clinic_id if queue_entry.target_branch else None,
+            "past_reception_start_time": reception_time_for_api,
+            "original_time": appointment_time,
+            "original_date": date,
+            "original_date_kz": date_kz,
+            "gp": str(queue_reason_code or ""),
+        }
+    }
+
+    return {
+        'queue_entry': queue_entry,
+        'patient': patient,
+        'appointment': appointment,
+        'phone': phone,
+        'json_data': json_data,
+    }
+
+
+def extract_order_key(result_data, phone):
+    """
+    Извлекает order_key из ответа add_orders (форматы: {'data': {phone: {'order'}}}, {'order'}, [{'order'}]).
+    """
+    if isinstance(result_data, dict):
+        if 'data' in result_data and phone in result_data.get('data', {}):
+            phone_data = result_data.get('data', {}).get(phone, {})
+            if isinstance(phone_data, dict) and 'order' in phone_data:
+                return phone_data.get('order')
+        elif 'order' in result_data:
+            return result_data.get('order')
+    elif isinstance(result_data, list):
+        for item in result_data:
+            if isinstance(item, dict) and 'order' in item:
+                return item.get('order')
+    return None
+
+
+def submit_order(session, url, order):
+    """
+    Отправляет один заказ в ACS и возвращает order_key (или None при ошибке).
+    Выполняется в пуле потоков, к БД не обращается.
+    """
+    patient_code = order['patient'].patient_code
+    phone = order['phone']
+
+    try:
+        response = session.post(url, json=order['json_data'])
+
+        if response.status_code != 200:
+            print(f"❌ Ошибка при отправке в ACS для пациента {patient_code}: "
+                  f"{response.status_code} - {response.text[:200]}")
+            return None
+
+        order_key = extract_order_key(response.json(), phone)
+        if not order_key:
+            print(f"❌ Нет order_key в ответе для телефона {phone}")
+        return order_key
+
+    except Exception as e:
+        print(f"❌ Ошибка запроса ACS для пациента {patient_code}: {e}")
+        return None
+
+
+def save_queue_calls(submitted):
+    """
+    Сохраняет звонки по отправленным заказам пакетно: существующие звонки выбираются одним запросом,
+    новые создаются одним bulk_create, изменившиеся order_key обновляются одним bulk_update.
+    Звонок ищется по записи на прием, а без нее - по очереди и пациенту, в том числе среди звонков с записью
+    (как раньше в get_or_create): если у записи очереди пропал прием, второй звонок не создается.
+
+    Параметры:
+    submitted (list): Пары (заказ из build_queue_order, order_key)
+
+    Возвращает:
+    dict: {'created', 'updated'}
+    """
+    appointment_ids = {order['appointment'].pk for order, _ in submitted if order['appointment']}
+    queue_ids = {order['queue_entry'].queue_id for order, _ in submitted if not order['appointment']}
+
+    calls = {}
+    existing_calls = Call.objects.filter(call_type="queue").filter(
+        Q(appointment_id__in=appointment_ids) | Q(queue_id__in=queue_ids)
+    ).order_by('created_at')
+    for call in existing_calls:
+        if call.appointment_id:
+            calls.setdefault(('appointment', call.appointment_id), call)
+        calls.setdefault(('queue', call.queue_id, call.patient_code), call)
+
+    to_create = []
+    to_update = {}
+    for order, order_key in submitted:
+        queue_entry = order['queue_entry']
+        patient = order['patient']
+        appointment = order['appointment']
+
+        if appointment:
+            key = ('appointment', appointment.pk)
+        else:
+            key = ('queue', queue_entry.queue_id, patient.patient_code)
+
+        call = calls.get(key)
+        if call is None:
+            call = Call(
+                appointment=appointment,
+                call_type="queue",
+                order_key=order_key,
+                queue_id=queue_entry.queue_id,
+                patient_code=patient.patient_code
+            )
+            calls[key] = call
+            to_create.append(call)
+            print(f"✅ Создан звонок для {patient.get_full_name()} очередь {queue_entry.queue_id}")
+        elif call.order_key != order_key:
+            call.order_key = order_key
+            if call.pk:
+                to_update[call.pk] = call
+            print(f"🔄 Обновлен order_key для {patient.get_full_name()}")
+
+    with transaction.atomic():
+        if to_create:
+            Call.objects.bulk_create(to_create)
+        if to_update:
+            updated_at = now()
+            for call in to_update.values():
+                call.updated_at = updated_at
+            Call.objects.bulk_update(list(to_update.values()), ['order_key', 'updated_at'])
+
+    return {'created': len(to_create), 'updated': len(to_update)}
+
+
+def process_queue_to_acs(max_workers=None, chunk_size=None):
     """
     Обрабатывает активные записи в очереди и отправляет их в ACS систему.
     Использует метод отправки с нужной структурой полей.
+
+    Записи обрабатываются пачками по chunk_size: заказы пачки собираются заранее, отправляются
+    параллельно (до max_workers запросов одновременно, по одному соединению keep-alive на поток),
+    затем звонки пачки сохраняются пакетно. По умолчанию - ACS_ORDERS_CHUNK_SIZE и ACS_MAX_WORKERS из настроек.
     """
+    max_workers = max_workers or settings.ACS_MAX_WORKERS
+    chunk_size = chunk_size or settings.ACS_ORDERS_CHUNK_SIZE
+
     api_key = get_latest_api_key()
     if not api_key:
         print("Не удалось получить API ключ ACS")
         return False
 
-    active_queue_entries = QueueInfo.objects.all().select_related('patient', 'target_branch').order_by('-created_at')
-    print(f"Найдено {active_queue_entries.count()} активных записей в очереди")
+    active_queue_entries = list(
+        QueueInfo.objects.all().select_related('patient', 'target_branch').order_by('-created_at')
+    )
+    print(f"Найдено {len(active_queue_entries)} активных записей в очереди")
+
+    url = f"{ACS_BASE_URL}/api/v2/bpm/public/bp/{api_key}/add_orders"
 
     success_count = 0
     error_count = 0
 
-    for queue_entry in active_queue_entries:
-        patient = queue_entry.patient
-        if not patient:
-            print(f"⚠ Очередь {queue_entry.queue_id} не имеет пациента, пропускаем.")
-            error_count += 1
-            continue
-
-        if not patient.phone_mobile:
-            print(f"⚠ Пациент {patient.patient_code} не имеет номера телефона, пропускаем.")
-            error_count += 1
-            continue
-
-        queue_reason_code = (
-                queue_entry.internal_reason_code or
-                getattr(patient, 'last_queue_reason_code', None) or
-                "00PP0consulta"
-        )
-
-        print(f"✅ Используем причину: {queue_reason_code}")
-
-        # Обработка номера телефона
-        phone = ''.join(filter(str.isdigit, patient.phone_mobile))
-        if phone.startswith('8'):
-            phone = '7' + phone[1:]
-        elif not phone.startswith('7'):
-            phone = '7' + phone
-
-        # Базовые данные приема
-        doctor_name = "Не назначен"
-        clinic_name = ""
-        clinic_address = ""
-        department_name = ""
-        appointment_date = "Не назначено"
-        appointment_time = "Не назначено"
-        appointment_id = None
-        doctor_code = None
-        specialization_id = None
-        cabinet_number = None
-        service_id = None
-        weekday = ""
-        weekday_kz = ""
-        date = ""
-        date_kz = ""
-        relation = None
-
-        # 1. Сначала проверяем, есть ли информация о враче в самой записи очереди
-        if queue_entry.doctor_code and queue_entry.doctor_name:
-            doctor_code = queue_entry.doctor_code
-            doctor_name = queue_entry.doctor_name
-            print(f"✅ Использую информацию о враче из записи очереди: {doctor_name}")
-
-            # Пробуем получить дополнительную информацию о враче из модели Doctor
-            try:
-                doctor = Doctor.objects.filter(doctor_code=doctor_code).first()
-                if doctor and doctor.specialization_id:
-                    specialization_id = doctor.specialization_id
-                    print(f"✅ Добавлена информация о специализации из модели Doctor")
-            except Exception as e:
-                print(f"⚠ Не удалось получить дополнительную информацию о враче: {e}")
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        session.headers.update({'Content-Type': 'application/json'})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
 
-        # 2. Если в queue_entry нет информации о враче, пробуем найти подходящего врача для данного пациента
-        else:
-            try:
-                # Можно попробовать найти последнего врача, с которым взаимодействовал пациент
-                recent_appointment = Appointment.objects.filter(
-                    patient=patient,
-                    doctor__isnull=False,
-                    is_active=True
-                ).order_by('-start_time').first()
-
-                if recent_appointment and recent_appointment.doctor:
-                    doctor_name = str(recent_appointment.doctor.full_name)
-                    doctor_code = recent_appointment.doctor.doctor_code
-                    specialization_id = recent_appointment.doctor.specialization_id
-                    print(f"✅ Использую информацию о враче из предыдущего приема: {doctor_name}")
-            except Exception as e:
-                print(f"⚠ Не удалось найти информацию о предыдущем враче: {e}")
-
-        # 3. Получаем информацию о клинике
-        if queue_entry.target_branch:
-            clinic_name = str(queue_entry.target_branch.name)
-            clinic_address = str(queue_entry.target_branch.address or "")
-            print(f"✅ Использую информацию о клинике из target_branch: {clinic_name}")
+        for start in range(0, len(active_queue_entries), chunk_size):
+            chunk = active_queue_entries[start:start + chunk_size]
 
-        # 4. Получаем информацию об отделении, если она есть в queue_entry
-        if queue_entry.department_name:
-            department_name = str(queue_entry.department_name)
-            print(f"✅ Использую информацию об отделении из записи очереди: {department_name}")
+            # Данные для заказов всей пачки выбираются заранее, заказы собираются в памяти
+            context = prefetch_order_context(chunk)
 
-        # 5. Если у пациента есть активная запись на прием, используем ее данные для дополнительной информации
-        try:
-            # Поиск связанного приема
-            appointment = Appointment.objects.filter(
-                patient=patient,
-                is_active=True,
-                start_time__gt=now()
-            ).order_by('start_time').first()
-
-            if appointment:
-                print("✅ Найдена активная запись на прием, добавляю информацию")
-
-                # Если у нас еще нет информации о враче, берем из приема
-                if doctor_name == "Не назначен" and appointment.doctor:
-                    doctor_name = str(appointment.doctor.full_name)
-                    doctor_code = appointment.doctor.doctor_code
-                    specialization_id = appointment.doctor.specialization_id
-
-                # Если у нас еще нет информации о клинике, берем из приема
-                if not clinic_name and appointment.clinic:
-                    clinic_name = str(appointment.clinic.name)
-                    clinic_address = str(appointment.clinic.address or "")
-
-                # Если у нас еще нет информации об отделении, берем из приема
-                if not department_name and appointment.department:
-                    department_name = str(appointment.department.name)
-
-                # Преобразование времени приема в нужный формат
-                reception_start_time = appointment.start_time
-                date_object = reception_start_time
-
-                # Определяем отношение к текущему дню (сегодня/завтра)
-                today = datetime.now().date()
-                tomorrow = today + timedelta(days=1)
-                reception_date = reception_start_time.date()
-
-                if reception_date == today:
-                    relation = "today"
-                elif reception_date == tomorrow:
-                    relation = "tomorrow"
-
-                # Форматирование даты и времени
-                appointment_date = reception_start_time.strftime("%d.%m.%Y")
-                appointment_time = reception_start_time.strftime("%H:%M")
-                appointment_id = appointment.appointment_id
-                reception_time_for_api = reception_start_time.strftime('%Y-%m-%d %H:%M')
-
-                # Получаем дополнительные данные
-                cabinet_number = appointment.cabinet_number
-                service_id = appointment.service_id
-
-                # Получаем информацию о дне недели
-                weekday_index = reception_date.weekday()
-                weekday_map_ru = {
-                    0: "Понедельник", 1: "Вторник", 2: "Среду", 3: "Четверг",
-                    4: "Пятницу", 5: "Субботу", 6: "Воскресенье"
-                }
-                weekday_map_kz = {
-                    0: "Дүйсенбі", 1: "Сейсенбі", 2: "Сәрсенбі", 3: "Бейсенбі",
-                    4: "Жұма", 5: "Сенбі", 6: "Жексенбі"
-                }
-                weekday = weekday_map_ru.get(weekday_index, "")
-                weekday_kz = weekday_map_kz.get(weekday_index, "")
-
-                # Форматируем дату
-                reception_day_data = get_formatted_date_info(
-                    reception_start_time) if 'get_formatted_date_info' in globals() else {"date": "", "date_kz": ""}
-                date = reception_day_data.get("date", "")
-                date_kz = reception_day_data.get("date_kz", "")
+            orders = []
+            for queue_entry in chunk:
+                order = build_queue_order(queue_entry, context)
+                if order is None:
+                    error_count += 1
+                    continue
+                orders.append(order)
 
-        except Exception as e:
-            print(f"⚠ Ошибка при получении данных о приеме: {e}")
-
-        # Формирование данных в нужном формате
-        json_data = {
-            "phone": phone,
-            "full_name": str(patient.get_full_name() or ""),
-            "info": {
-                "time": appointment_time,
-                "reception_id": appointment_id,
-                "patient_code": patient.patient_code,
-                "day": "сегодня" if relation == "today" else "завтра" if relation == "tomorrow" else "",
-                "day_kz": "бүгін" if relation == "today" else "ертең" if relation == "tomorrow" else "",
-                "weekday": weekday,
-                "weekday_kz": weekday_kz,
-                "specialist_code": doctor_code,
-                "specialization_id": specialization_id,
-                "specialist_name": doctor_name,
-                "clinic_id": queue_entry.target_branch.clinic_id if queue_entry.target_branch else None,
-                "past_reception_start_time": reception_time_for_api if 'reception_time_for_api' in locals() else "",
-                "original_time": appointment_time,
-                "original_date": date,
-                "original_date_kz": date_kz,
-                "gp": str(queue_reason_code or ""),
-            }
-        }
+            if not orders:
+                continue
 
-        print("Отправка данных в формате JSON:")
-        print(json.dumps(json_data, indent=2, ensure_ascii=False))
+            print(f"🔄 Отправка {len(orders)} заказов в ACS (записи {start + 1}-{start + len(chunk)})")
+            order_keys = list(executor.map(lambda order: submit_order(session, url, order), orders))
 
-        url = f"{ACS_BASE_URL}/api/v2/bpm/public/bp/{api_key}/add_orders"
+            submitted = [(order, order_key) for order, order_key in zip(orders, order_keys) if order_key]
+            error_count += len(orders) - len(submitted)
 
-        try:
-            print(f"Отправка заказа в ACS для пациента {patient.patient_code} с причиной {queue_reason_code}")
-            # Отправляем как плоскую JSON структуру
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(url, json=json_data, headers=headers)
-
-            print(f"Ответ сервера: {response.status_code}")
-            if response.text:
-                print(f"Текст ответа: {response.text[:200]}...")  # Печатаем первые 200 символов
-
-            if response.status_code == 200:
-                # Обработка успешного ответа и сохранение данных в БД
-                try:
-                    result_data = response.json()
-                    print(f"Структура ответа: {type(result_data).__name__}")
-
-                    # Извлечение order_key в зависимости от формата ответа
-                    order_key = None
-
-                    # Проверка формата ответа и корректное извлечение order_key
-                    if isinstance(result_data, dict):
-                        if 'data' in result_data and phone in result_data.get('data', {}):
-                            phone_data = result_data.get('data', {}).get(phone, {})
-                            if isinstance(phone_data, dict) and 'order' in phone_data:
-                                order_key = phone_data.get('order')
-                        elif 'order' in result_data:
-                            order_key = result_data.get('order')
-                    elif isinstance(result_data, list):
-                        for item in result_data:
-                            if isinstance(item, dict) and 'order' in item:
-                                order_key = item.get('order')
-                                break
-
-                    print(f"Извлеченный order_key: {order_key}")
-
-                    if order_key:
-                        # Сохранение данных в БД
-                        try:
-                            # Создание или обновление записи звонка
-                            if appointment:
-                                call, created = Call.objects.get_or_create(
-                                    appointment=appointment,
-                                    call_type="queue",
-                                    defaults={
-                                        "order_key": order_key,
-                                        "queue_id": queue_entry.queue_id,
-                                        "patient_code": patient.patient_code
-                                    }
-                                )
-                            else:
-                                call, created = Call.objects.get_or_create(
-                                    queue_id=queue_entry.queue_id,
-                                    patient_code=patient.patient_code,
-                                    call_type="queue",
-                                    defaults={"order_key": order_key}
-                                )
-
-                            if created:
-                                print(f"✅ Создан звонок для {patient.get_full_name()} очередь {queue_entry.queue_id}")
-                                success_count += 1
-                            else:
-                                if call.order_key != order_key:
-                                    call.order_key = order_key
-                                    call.save(update_fields=['order_key'])
-                                    print(f"🔄 Обновлен order_key для {patient.get_full_name()}")
-                                success_count += 1
-                        except Exception as e:
-                            print(f"❌ Ошибка при создании записи звонка: {e}")
-                            error_count += 1
-                    else:
-                        print(f"❌ Нет order_key в ответе для телефона {phone}")
-                        error_count += 1
-                except Exception as e:
-                    print(f"❌ Ошибка при разборе ответа: {e}")
-                    error_count += 1
-            else:
-                print(f"❌ Ошибка при отправке в ACS: {response.status_code} - {response.text}")
-                error_count += 1
+            if not submitted:
+                continue
 
-        except Exception as e:
-            print(f"❌ Ошибка запроса ACS для пациента {patient.patient_code}: {e}")
-            error_count += 1
+            try:
+                save_stats = save_queue_calls(submitted)
+                success_count += len(submitted)
+                print(f"✅ Звонки сохранены: создано {save_stats['created']}, обновлено {save_stats['updated']}")
+            except Exception as e:
+                print(f"❌ Ошибка при сохранении звонков: {e}")
+                error_count += len(submitted)
 
     print(f"Обработка завершена. Успешно: {success_count}, Ошибок: {error_count}")
     return success_count > 0
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+
+import httpx
+from django.conf import settings
+
+from reminder.infoclinica_requests.transport import build_ssl_context
+from reminder.infoclinica_requests.utils import generate_msh_10
+
+logger = logging.getLogger(__name__)
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def get_ssl_context():
+    """
+    Возвращает SSL-контекст с клиентским сертификатом, общий для всех асинхронных клиентов процесса.
+    """
+    global _ssl_context
+
+    if _ssl_context is None:
+        with _ssl_context_lock:
+            if _ssl_context is None:
+                _ssl_context = build_ssl_context()
+
+    return _ssl_context
+
+
+def build_schedule_xml(target_branch_id, doctor_code, bdate, fdate):
+    """
+    Формирует XML-запрос WEB_SCHEDULE (свободные интервалы врача за период BDATE..FDATE).
+    Даты передаются в формате YYYYMMDD.
+    """
+    return f'''
+    <WEB_SCHEDULE xmlns="http://sdsys.ru/">
+      <MSH>
+        <MSH.3></MSH.3>
+        <MSH.7>
+          <TS.1>{datetime.now().strftime('%Y%m%d%H%M')}</TS.1>
+        </MSH.7>
+        <MSH.9>
+          <MSG.1>WEB</MSG.1>
+          <MSG.2>SCHEDULE</MSG.2>
+        </MSH.9>
+        <MSH.10>{generate_msh_10()}</MSH.10>
+        <MSH.18>UTF-8</MSH.18>
+        <MSH.99>{target_branch_id}</MSH.99>
+      </MSH>
+      <SCHEDULE_IN>
+        <INDOCTLIST>{doctor_code}</INDOCTLIST>
+        <BDATE>{bdate}</BDATE>
+        <FDATE>{fdate}</FDATE>
+        <EXTINTERV>30</EXTINTERV>
+        <SCHLIST/>
+      </SCHEDULE_IN>
+    </WEB_SCHEDULE>
+    '''
+
+
+def build_doct_schedule_free_xml(clinic_id, bdate, fdate, doctor_code=None, department_id=None, online_mode=0):
+    """
+    Формирует XML-запрос WEB_DOCT_SCHEDULE_FREE. Если указан doctor_code, фильтр по отделению не передается.
+    """
+    filial_element = f"<FILIALLIST>{clinic_id}</FILIALLIST>" if clinic_id else "<FILIALLIST></FILIALLIST>"
+
+    if doctor_code:
+        doctor_filter = f"<DOCTLIST>{doctor_code}</DOCTLIST>"
+        department_filter = ""
+    elif department_id:
+        doctor_filter = ""
+        department_filter = f"<CASHLIST>{department_id}</CASHLIST>"
+    else:
+        doctor_filter = ""
+        department_filter = ""
+
+    return f'''
+    <WEB_DOCT_SCHEDULE_FREE xmlns="http://sdsys.ru/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+      <MSH>
+        <MSH.7>
+          <TS.1>{datetime.now().strftime("%Y%m%d%H%M%S")}</TS.1>
+        </MSH.7>
+        <MSH.9>
+          <MSG.1>WEB</MSG.1>
+          <MSG.2>DOCT_SCHEDULE_FREE</MSG.2>
+        </MSH.9>
+        <MSH.10>{generate_msh_10()}</MSH.10>
+        <MSH.18>UTF-8</MSH.18>
+        <MSH.99>{clinic_id if clinic_id else ""}</MSH.99>
+      </MSH>
+      <DOCT_SCHEDULE_FREE_IN>
+        {filial_element}{department_filter}{doctor_filter}
+        <SCHEDIDENTLIST></SCHEDIDENTLIST>
+        <BDATE>{bdate}</BDATE>
+        <FDATE>{fdate}</FDATE>
+        <ONLINEMODE>{online_mode}</ONLINEMODE>
+      </DOCT_SCHEDULE_FREE_IN>
+    </WEB_DOCT_SCHEDULE_FREE>
+    '''
+
+
+def build_client_info_xml(patient_code, target_branch_id=1):
+    """
+    Формирует XML-запрос WEB_CLIENT_INFO (данные пациента PCODE).
+    """
+    return f'''
+    <WEB_CLIENT_INFO xmlns="http://sdsys.ru/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="http://sdsys.ru/">
+      <MSH>
+        <MSH.7>
+          <TS.1>{datetime.now().strftime("%Y%m%d%H%M%S")}</TS.1>
+        </MSH.7>
+        <MSH.9>
+          <MSG.1>WEB</MSG.1>
+          <MSG.2>CLIENT_INFO</MSG.2>
+        </MSH.9>
+        <MSH.10>{generate_msh_10()}</MSH.10>
+        <MSH.18>UTF-8</MSH.18>
+        <MSH.99>{target_branch_id}</MSH.99>
+      </MSH>
+      <CLIENT_INFO_IN>
+        <PCODE>{patient_code}</PCODE>
+      </CLIENT_INFO_IN>
+    </WEB_CLIENT_INFO>
+    '''
+
+
+class AsyncRateLimiter:
+    """
+    Ограничивает частоту запросов к хосту: не больше rate запросов в секунду (0 или None - без ограничения).
+    Запросы равномерно распределяются по времени, параллельные корутины ждут своей очереди.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncInfoClinicaClient:
+    """
+    Асинхронный клиент Инфоклиники (httpx + mTLS).
+    Используется как async context manager, чтобы несколько запросов шли параллельно через один пул:
+
+        async with AsyncInfoClinicaClient() as client:
+            responses = await asyncio.gather(*(client.client_info(code) for code in patient_codes))
+
+    Методы возвращают httpx.Response (status_code, text), как и синхронный post_xml.
+    """
+
+    def __init__(self, timeout=None, rate_limit=None):
+        connect_timeout = settings.INFOCLINICA_CONNECT_TIMEOUT
+        read_timeout = settings.INFOCLINICA_READ_TIMEOUT
+        pool_size = settings.INFOCLINICA_POOL_SIZE
+
+        self.client = httpx.AsyncClient(
+            verify=get_ssl_context(),
+            headers={
+                'X-Forwarded-Host': f'{settings.INFOCLINICA_HOST}',
+                'Content-Type': 'text/xml',
+            },
+            timeout=timeout or httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        # Клиент работает с одним хостом Инфоклиники, поэтому лимит частоты общий на клиент
+        self.rate_limiter = AsyncRateLimiter(
+            settings.INFOCLINICA_RATE_LIMIT if rate_limit is None else rate_limit
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def post_xml(self, xml_request):
+        """
+        Отправляет XML-запрос в Инфоклинику с учетом лимита частоты запросов.
+        """
+        await self.rate_limiter.wait()
+        return await self.client.post(
+            settings.INFOCLINICA_BASE_URL,
+            content=xml_request.encode('utf-8') if isinstance(xml_request, str) else xml_request,
+        )
+
+    async def client_info(self, patient_code, target_branch_id=1):
+        """
+        WEB_CLIENT_INFO: данные пациента.
+        """
+        xml_request = build_client_info_xml(patient_code, target_branch_id)
+        logger.info(f"🔄 Асинхронный запрос CLIENT_INFO: PCODE {patient_code}")
+        return await self.post_xml(xml_request)
@@ -13,7 +13,10 @@ from reminder.infoclinica_requests.utils import generate_msh_10
 from django.utils.dateparse import parse_date
 from django.db import transaction
 
-import requests
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.xml_stream import iter_records
+from reminder.infoclinica_requests.xml_schemas import extract_fields
+from reminder.infoclinica_requests.reference_cache import get_clinic, invalidate_reference_cache
 import logging
 import xml.etree.ElementTree as ET
 import pytz
@@ -24,15 +27,6 @@ logger = logging.getLogger()
 
 # Загрузка переменных окружения
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def get_departement_list():
@@ -84,19 +78,13 @@ def get_departement_list():
                 f"\n\n---------------\nОтправка запроса CLIENT_INFO для PCODE {clinic_id}: \n{xml_request}\n---------------\n")
 
             # Отправляем запрос
-            response = requests.post(
-                url=infoclinica_api_url,
-                headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-                data=xml_request,
-                cert=(cert_file_path, key_file_path),
-                verify=True
-            )
+            response = post_xml(xml_request)
 
             if response.status_code == 200:
                 logger.info(
                     f"\n\n---------------\nОтвет от CLIENT_INFO для PCODE {clinic_id}: {response.text}\n---------------\n")
                 print_departments(response.text)
-                save_departments_to_db(response.text)
+                save_departments_to_db(response.content)
 
             else:
                 logger.error(f"❌ Ошибка {response.status_code} парсинге филиалов")
@@ -126,25 +114,13 @@ def print_departments(xml_response):
         print(f"{'=' * 80}")
 
         for dept in departments:
-            dept_id = dept.find("ns:DEPNUM", namespace).text
-            dept_name = dept.find("ns:DEPNAME", namespace).text if dept.find("ns:DEPNAME",
-                                                                             namespace) is not None else "Неизвестно"
-
-            # Группа отделений
-            group_elem = dept.find("ns:DEPGRPNAME", namespace)
-            group_name = group_elem.text if group_elem is not None else "Не указана"
-
-            # Видимость на сайте
-            viewinweb_elem = dept.find("ns:VIEWINWEB_OUT", namespace)
-            viewinweb = "Да" if viewinweb_elem is not None and viewinweb_elem.text == "1" else "Нет"
-
-            # Медиа ID
-            media_elem = dept.find("ns:MEDIAID", namespace)
-            media_id = media_elem.text if media_elem is not None else "Нет"
-
-            # Избранное
-            favorite_elem = dept.find("ns:ISFAVORITE", namespace)
-            is_favorite = "Да" if favorite_elem is not None and favorite_elem.text == "1" else "Нет"
+            dept_data = extract_fields('GETDEPARTMENTLIST', dept)
+            dept_id = dept_data.get('department_id')
+            dept_name = dept_data.get('name', "Неизвестно")
+            group_name = dept_data.get('group_name', "Не указана")
+            viewinweb = "Да" if dept_data.get('view_in_web') else "Нет"
+            media_id = dept_data.get('media_id', "Нет")
+            is_favorite = "Да" if dept_data.get('is_favorite') else "Нет"
 
             print(f"\n{'-' * 80}")
             print(f"Отделение ID: {dept_id} | {dept_name}")
@@ -167,75 +143,34 @@ def save_departments_to_db(xml_response, clinic_id=None):
     xml_response - XML-ответ от сервера
     clinic_id - ID клиники (филиала), к которой относятся отделения (может быть None)
     """
-    import xml.etree.ElementTree as ET
     from django.db import transaction
-    from reminder.models import Department, Clinic
+    from reminder.models import Department
 
     try:
-        root = ET.fromstring(xml_response)
-        namespace = {'ns': 'http://sdsys.ru/'}
-
-        # Проверяем успешность запроса
-        msa_element = root.find(".//ns:MSA/ns:MSA.1", namespace)
-        if msa_element is None or msa_element.text != "AA":
-            print("❗ Неуспешный ответ от сервера.")
-            return 0, 0
-
-        # Ищем все отделения в ответе
-        departments = root.findall(".//ns:GET_DEPARTMENT_LIST_OUT/ns:GETDEPARTMENTLIST", namespace)
-        if not departments:
-            print("❗ Нет данных об отделениях в ответе")
-            return 0, 0
-
         # Получаем объект клиники, если указан ID
         clinic = None
         if clinic_id:
-            try:
-                clinic = Clinic.objects.get(clinic_id=clinic_id)
-            except Clinic.DoesNotExist:
+            clinic = get_clinic(clinic_id)
+            if clinic is None:
                 print(f"⚠️ Клиника с ID {clinic_id} не найдена в базе данных")
 
+        header = {}
         created_count = 0
         updated_count = 0
 
-        # Сохраняем в базу данных
+        # Сохраняем в базу данных, разбирая отделения (GETDEPARTMENTLIST) потоково
         with transaction.atomic():
-            for dept in departments:
-                # Получаем основные данные
-                dept_id = int(dept.find("ns:DEPNUM", namespace).text)
-                dept_name_elem = dept.find("ns:DEPNAME", namespace)
-                dept_name = dept_name_elem.text if dept_name_elem is not None else "Неизвестное отделение"
-
-                # Собираем все необязательные поля
-                dept_data = {
-                    'name': dept_name,
-                    'clinic': clinic,  # Связь с клиникой
-                }
-
-                # Группа отделений
-                group_elem = dept.find("ns:DEPGRPNAME", namespace)
-                if group_elem is not None:
-                    dept_data['group_name'] = group_elem.text
-
-                # Видимость на сайте
-                viewinweb_elem = dept.find("ns:VIEWINWEB_OUT", namespace)
-                if viewinweb_elem is not None:
-                    dept_data['view_in_web'] = viewinweb_elem.text == "1"
-
-                # Медиа ID
-                media_elem = dept.find("ns:MEDIAID", namespace)
-                if media_elem is not None:
-                    dept_data['media_id'] = media_elem.text
-
-                # Избранное
-                favorite_elem = dept.find("ns:ISFAVORITE", namespace)
-                if favorite_elem is not None:
-                    dept_data['is_favorite'] = favorite_elem.text == "1"
-
-                # Комментарий
-                comment_elem = dept.find("ns:COMMENT", namespace)
-                if comment_elem is not None:
-                    dept_data['comment'] = comment_elem.text
+            for dept in iter_records(xml_response, 'GETDEPARTMENTLIST', header=header):
+                # Статус ответа (MSA) приходит до списка отделений
+                if header.get('MSA.1') != "AA":
+                    break
+
+                # Получаем основные и необязательные поля по схеме GETDEPARTMENTLIST
+                dept_data = extract_fields('GETDEPARTMENTLIST', dept)
+                dept_id = dept_data.pop('department_id')
+                dept_data.setdefault('name', "Неизвестное отделение")
+                dept_data['clinic'] = clinic  # Связь с клиникой
+                dept_name = dept_data['name']
 
                 # Создаем или обновляем запись в БД
                 department, created = Department.objects.update_or_create(
@@ -250,6 +185,18 @@ def save_departments_to_db(xml_response, clinic_id=None):
                     updated_count += 1
                     print(f"🔄 Обновлено отделение: {dept_id} - {dept_name}")
 
+        # Проверяем успешность запроса
+        if header.get('MSA.1') != "AA":
+            print("❗ Неуспешный ответ от сервера.")
+            return 0, 0
+
+        if not created_count and not updated_count:
+            print("❗ Нет данных об отделениях в ответе")
+            return 0, 0
+
+        # Отделения изменились - процессы перечитают справочник из БД
+        invalidate_reference_cache('department', 'doctor')
+
         clinic_info = f" для клиники {clinic.name} (ID: {clinic_id})" if clinic else ""
         print(f"💾 Итого{clinic_info}: создано {created_count}, обновлено {updated_count} отделений")
         return created_count, updated_count
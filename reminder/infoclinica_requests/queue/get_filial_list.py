@@ -13,7 +13,9 @@ from reminder.infoclinica_requests.utils import generate_msh_10
 from django.utils.dateparse import parse_date
 from django.db import transaction
 
-import requests
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.xml_schemas import extract_fields
+from reminder.infoclinica_requests.reference_cache import invalidate_reference_cache
 import logging
 import xml.etree.ElementTree as ET
 import pytz
@@ -24,15 +26,6 @@ logger = logging.getLogger()
 
 # Загрузка переменных окружения
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def get_filial_list():
@@ -86,13 +79,7 @@ def get_filial_list():
                 f"\n\n---------------\nОтправка запроса CLIENT_INFO для PCODE {patient_code}: \n{xml_request}\n---------------\n")
 
             # Отправляем запрос
-            response = requests.post(
-                url=infoclinica_api_url,
-                headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-                data=xml_request,
-                cert=(cert_file_path, key_file_path),
-                verify=True
-            )
+            response = post_xml(xml_request)
 
             if response.status_code == 200:
                 logger.info(
@@ -127,29 +114,14 @@ def print_filials(xml_response):
         print(f"{'=' * 80}")
 
         for filial in filials:
-            filial_id = filial.find("ns:FILIAL", namespace).text
-            filial_name = filial.find("ns:FNAME", namespace).text if filial.find("ns:FNAME",
-                                                                                 namespace) is not None else "Неизвестно"
-
-            # Адрес
-            address_elem = filial.find("ns:FADDR", namespace)
-            address = address_elem.text if address_elem is not None else "Адрес не указан"
-
-            # Телефон
-            phone_elem = filial.find("ns:FPHONE", namespace)
-            phone = phone_elem.text if phone_elem is not None else "Телефон не указан"
-
-            # Видимость на сайте
-            viewinweb_elem = filial.find("ns:VIEWINWEB_OUT", namespace)
-            viewinweb = "Да" if viewinweb_elem is not None and viewinweb_elem.text == "1" else "Нет"
-
-            # Часовой пояс
-            timezone_elem = filial.find("ns:TIMEZONE", namespace)
-            timezone = f"UTC+{timezone_elem.text}" if timezone_elem is not None else "Не указан"
-
-            # Время работы
-            hours_elem = filial.find("ns:WORKHOURS", namespace)
-            work_hours = hours_elem.text if hours_elem is not None else "Не указано"
+            filial_data = extract_fields('GETFILIALLIST', filial)
+            filial_id = filial_data.get('clinic_id')
+            filial_name = filial_data.get('name', "Неизвестно")
+            address = filial_data.get('address', "Адрес не указан")
+            phone = filial_data.get('phone', "Телефон не указан")
+            viewinweb = "Да" if filial_data.get('view_in_web') else "Нет"
+            timezone = f"UTC+{filial_data['timezone']}" if 'timezone' in filial_data else "Не указан"
+            work_hours = filial_data.get('work_hours', "Не указано")
 
             print(f"\n{'-' * 80}")
             print(f"Филиал ID: {filial_id} | {filial_name}")
@@ -195,22 +167,15 @@ def save_filials_to_db(xml_response):
         # Сохраняем в базу данных
         with transaction.atomic():
             for filial in filials:
-                filial_id = int(filial.find("ns:FILIAL", namespace).text)
-                filial_name = filial.find("ns:FNAME", namespace).text if filial.find("ns:FNAME",
-                                                                                     namespace) is not None else "Неизвестно"
+                filial_data = extract_fields('GETFILIALLIST', filial)
+                filial_id = filial_data['clinic_id']
+                filial_name = filial_data.get('name', "Неизвестно")
 
                 # Необязательные поля, собираем их если они есть
-                address_elem = filial.find("ns:FADDR", namespace)
-                address = address_elem.text if address_elem is not None else ""
-
-                phone_elem = filial.find("ns:FPHONE", namespace)
-                phone = phone_elem.text if phone_elem is not None else ""
-
-                email_elem = filial.find("ns:FMAIL", namespace)
-                email = email_elem.text if email_elem is not None else None
-
-                timezone_elem = filial.find("ns:TIMEZONE", namespace)
-                timezone = int(timezone_elem.text) if timezone_elem is not None else 3  # По умолчанию Москва (UTC+3)
+                address = filial_data.get('address', "")
+                phone = filial_data.get('phone', "")
+                email = filial_data.get('email')
+                timezone = filial_data.get('timezone', 3)  # По умолчанию Москва (UTC+3)
 
                 # Пытаемся найти существующий филиал или создать новый
                 clinic, created = Clinic.objects.update_or_create(
@@ -229,6 +194,9 @@ def save_filials_to_db(xml_response):
                 else:
                     updated_count += 1
 
+        # Филиалы изменились - процессы перечитают справочник из БД
+        invalidate_reference_cache('clinic', 'department', 'doctor')
+
         print(f"✅ Сохранено в базу данных: создано {created_count}, обновлено {updated_count} филиалов")
         return created_count, updated_count
 
@@ -9,12 +9,14 @@ from dotenv import load_dotenv
 from datetime import datetime
 from reminder.models import *
 from reminder.infoclinica_requests.utils import generate_msh_10
-from django.utils.dateparse import parse_date
 from django.db import transaction
 
-import requests
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.xml_stream import iter_records
+from reminder.infoclinica_requests.xml_schemas import extract_fields
+from reminder.infoclinica_requests.queue.queue_sync import sync_queue_records
+from reminder.infoclinica_requests.queue.client_info import client_info
 import logging
-import xml.etree.ElementTree as ET
 import pytz
 from datetime import datetime, timedelta
 
@@ -23,20 +25,14 @@ logger = logging.getLogger()
 
 # Загрузка переменных окружения
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
 
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
 
-
-def get_queue():
+def get_queue(incremental=True, raise_errors=False):
     """
     Отправляет запрос на получение очереди и вызывает функцию парсинга.
+    В инкрементальном режиме неизменившиеся записи очереди пропускаются,
+    а CLIENT_INFO запрашивается только для новых или изменившихся пациентов.
+    raise_errors - пробрасывать ошибки запроса и разбора (планировщик по ним не запускает зависящие задачи).
     """
     try:
         # Генерируем метку времени
@@ -73,277 +69,66 @@ def get_queue():
         logger.info(f"\n\n---------------\nОтправка запроса: {xml_request}\n---------------\n")
 
         # Выполняем запрос
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-            data=xml_request,
-            cert=(cert_file_path, key_file_path),
-            verify=True
-        )
+        response = post_xml(xml_request)
 
         if response.status_code == 200:
             logger.info(f"\n\n---------------\nОтвет от get_queue: {response.text}\n---------------\n")
-            parse_and_save_queue_info(response.text)
+            sync_result = parse_and_save_queue_info(response.content, incremental=incremental,
+                                                    raise_errors=raise_errors)
+
+            if incremental and sync_result and sync_result['changed_patients']:
+                logger.info(f"🔄 Запрос CLIENT_INFO для {len(sync_result['changed_patients'])} "
+                            f"новых или изменившихся пациентов")
+                client_info(patient_codes=sync_result['changed_patients'])
         else:
             logger.error(f"Ошибка {response.status_code}: {response.text}")
+            if raise_errors:
+                raise RuntimeError(f"QUEUE_LIST вернул HTTP {response.status_code}")
 
     except Exception as e:
         logger.error(f"Ошибка при выполнении запроса get_queue: {e}")
+        if raise_errors:
+            raise
 
 
-def parse_and_save_queue_info(xml_response):
+def parse_and_save_queue_info(xml_response, incremental=False, raise_errors=False):
     """
     Парсит XML-ответ от API Инфоклиника и сохраняет данные в БД.
-    Обновлено для корректного сохранения информации о целевой клинике (TOFILIAL)
-    и сохранения причины очереди для пациента.
+    Целевая клиника (TOFILIAL) сохраняется в очереди, причина очереди - у пациента.
+    Ответ (str/bytes) разбирается потоково по записям QUEUE_INFO, а сохраняется пакетно (sync_queue_records).
+    incremental - пропускать записи, не изменившиеся с прошлой синхронизации.
+    raise_errors - пробрасывать ошибку разбора/сохранения вместо возврата None.
+
+    Возвращает:
+    dict | None: Статистика синхронизации {'created', 'updated', 'unchanged', 'details'}
     """
     try:
-        root = ET.fromstring(xml_response)
-        namespace = {'ns': 'http://sdsys.ru/'}
-
-        queue_list = root.find(".//ns:QUEUE_LIST", namespace)
-        if queue_list is None:
-            logger.warning("❗ Нет данных в QUEUE_LIST (возможно, проблема с namespace)")
-            return
-
-        for queue_info in queue_list.findall("ns:QUEUE_INFO", namespace):
-            try:
-                queue_id = int(queue_info.find("ns:QUEUEID", namespace).text)
-                patient_code = int(queue_info.find("ns:PCODE", namespace).text)
-
-                contact_bdate = queue_info.find("ns:CONTACTBDATE", namespace)
-                contact_bdate = parse_date(contact_bdate.text) if contact_bdate is not None else None
-
-                contact_fdate = queue_info.find("ns:CONTACTFDATE", namespace)
-                contact_fdate = parse_date(contact_fdate.text) if contact_fdate is not None else None
-
-                # Обработка причины (ADDID)
-                add_id_element = queue_info.find("ns:ADDID", namespace)
-                add_id = int(add_id_element.text) if add_id_element is not None else None
-                add_name_element = queue_info.find("ns:ADDNAME", namespace)
-                add_name = add_name_element.text if add_name_element is not None else None
-
-                # Получаем или создаем объект QueueReason
-                reason = None
-                internal_code = None
-                internal_name = None
-                if add_id is not None:
-                    reason, created = QueueReason.objects.get_or_create(
-                        reason_id=add_id,
-                        defaults={"reason_name": add_name or f"Причина {add_id}"}
-                    )
-
-                    # Если название причины изменилось, обновляем его
-                    if not created and add_name and reason.reason_name != add_name:
-                        reason.reason_name = add_name
-                        reason.save()
-                        logger.info(f"🔄 Обновлено название причины: {add_id} → {add_name}")
-
-                    # Пытаемся найти соответствующий внутренний код
-                    try:
-                        mapping = QueueReasonMapping.objects.get(reason=reason)
-                        internal_code = mapping.internal_code
-                        internal_name = mapping.internal_name
-                        logger.info(
-                            f"✅ Найдено сопоставление для причины {reason.reason_name}: {internal_code} ({internal_name})")
-                    except QueueReasonMapping.DoesNotExist:
-                        logger.warning(f"⚠ Не найдено сопоставление для причины {reason.reason_name} (ID: {add_id})")
-                        # Используем значение по умолчанию
-                        internal_code = "00PP0consulta"  # Консультация по умолчанию
-                        internal_name = "Консультация (по умолчанию)"
-                        logger.info(f"ℹ️ Установлено значение по умолчанию: {internal_code}")
-
-                # Обработка целевого филиала (TOFILIAL)
-                target_branch = None
-                target_branch_id_element = queue_info.find("ns:TOFILIAL", namespace)
-                if target_branch_id_element is not None and target_branch_id_element.text:
-                    target_branch_id = int(target_branch_id_element.text)
-                    target_branch_name_element = queue_info.find("ns:TOFILIALNAME", namespace)
-                    target_branch_name = target_branch_name_element.text.strip() if target_branch_name_element is not None else ""
-
-                    # Ищем или создаем целевой филиал
-                    target_branch, created = Clinic.objects.get_or_create(
-                        clinic_id=target_branch_id,
-                        defaults={
-                            "name": target_branch_name,
-                            "address": "",
-                            "phone": "",
-                            "timezone": 0
-                        }
-                    )
-
-                    # Обновляем название, если оно изменилось
-                    if not created and target_branch.name != target_branch_name and target_branch_name:
-                        target_branch.name = target_branch_name
-                        target_branch.save()
-                        logger.info(f"🔄 Обновлено название целевого филиала: {target_branch_id} → {target_branch_name}")
-                    elif created:
-                        logger.info(f"✅ Создан новый целевой филиал: {target_branch_id} - {target_branch_name}")
-
-                    logger.info(f"ВАЖНО: Сохранён TOFILIAL с ID {target_branch_id} для пациента {patient_code}")
-
-                if target_branch is None:
-                    logger.warning(
-                        f"⚠ КРИТИЧЕСКАЯ ОШИБКА: TOFILIAL не указан для пациента {patient_code}. Операции невозможны.")
-
-                current_state = queue_info.find("ns:CURRENTSTATE", namespace)
-                current_state = int(current_state.text) if current_state is not None else None
-
-                action_bdate = queue_info.find("ns:ACTIONBDATE", namespace)
-                action_bdate = parse_date(action_bdate.text) if action_bdate is not None else None
-
-                action_fdate = queue_info.find("ns:ACTIONFDATE", namespace)
-                action_fdate = parse_date(action_fdate.text) if action_fdate is not None else None
-
-                # Обработка информации о докторе
-                doctor = None
-                doctor_code_element = queue_info.find("ns:DCODE", namespace)
-                doctor_name_element = queue_info.find("ns:DNAME", namespace)
-
-                # Объявляем переменные depnum_element и depname_element в начале блока
-                depnum_element = queue_info.find("ns:DEPNUM", namespace)
-                depname_element = queue_info.find("ns:DEPNAME", namespace)
-
-                if doctor_code_element is not None and doctor_code_element.text:
-                    doctor_code = int(doctor_code_element.text)
-                    doctor_name = doctor_name_element.text if doctor_name_element is not None else "Неизвестный доктор"
-
-                    # Найти или создать доктора
-                    doctor, created = Doctor.objects.get_or_create(
-                        doctor_code=doctor_code,
-                        defaults={
-                            "full_name": doctor_name,
-                            "clinic": target_branch  # ВАЖНО: привязываем к целевой клинике
-                        }
-                    )
-
-                    if not created and doctor.full_name != doctor_name:
-                        # Обновляем имя, если оно изменилось
-                        doctor.full_name = doctor_name
-                        # Также обновляем клинику, если она другая
-                        if doctor.clinic != target_branch and target_branch is not None:
-                            doctor.clinic = target_branch
-                        doctor.save()
-                        logger.info(f"🔄 Обновлено имя доктора: {doctor_code} → {doctor_name}")
-                    elif created:
-                        logger.info(f"✅ Создан новый доктор: {doctor_code} - {doctor_name}")
-
-                    # Обработка специализации/отделения доктора
-                    if depnum_element is not None and depnum_element.text:
-                        dep_id = int(depnum_element.text)
-                        dep_name = depname_element.text if depname_element is not None else "Неизвестное отделение"
-
-                        # Найти или создать отделение
-                        department, dept_created = Department.objects.get_or_create(
-                            department_id=dep_id,
-                            defaults={
-                                "name": dep_name,
-                                "clinic": target_branch  # ВАЖНО: привязываем к целевой клинике
-                            }
-                        )
-
-                        if not dept_created and department.name != dep_name:
-                            department.name = dep_name
-                            # Также обновляем клинику, если она другая
-                            if department.clinic != target_branch and target_branch is not None:
-                                department.clinic = target_branch
-                            department.save()
-                            logger.info(f"🔄 Обновлено название отделения: {dep_id} → {dep_name}")
-                        elif dept_created:
-                            logger.info(f"✅ Создано новое отделение: {dep_id} - {dep_name}")
-
-                        # Связываем доктора с отделением
-                        if doctor.department != department:
-                            doctor.department = department
-                            doctor.save()
-                            logger.info(f"🔄 Обновлено отделение доктора {doctor_name}: {department.name}")
-
-                with transaction.atomic():
-                    # Создаем или обновляем пациента
-                    try:
-                        patient = Patient.objects.get(patient_code=patient_code)
-                    except Patient.DoesNotExist:
-                        # Если пациент не существует, создаем минимальный объект
-                        patient = Patient.objects.create(
-                            patient_code=patient_code,
-                            full_name=f"Пациент {patient_code}"  # Временное имя, будет обновлено позже
-                        )
-                        logger.info(f"✅ Создан новый пациент с кодом {patient_code}")
-
-                    # ВАЖНО: Сохраняем причину очереди в объекте пациента
-                    if internal_code:
-                        patient.last_queue_reason_code = internal_code
-                        patient.last_queue_reason_name = internal_name
-                        patient.save(update_fields=['last_queue_reason_code', 'last_queue_reason_name'])
-                        logger.info(f"🔄 Обновлена причина очереди для пациента {patient.patient_code}: {internal_code}")
-
-                    # Проверяем, есть ли существующие записи для этого пациента и клиники
-                    existing_appointments = Appointment.objects.filter(
-                        patient=patient,
-                        is_active=True,
-                        clinic=target_branch if target_branch else None
-                    )
-
-                    # Если существует активная запись, обновляем её клинику
-                    for appointment in existing_appointments:
-                        # Обновляем клинику, если она отличается от целевой
-                        if appointment.clinic != target_branch and target_branch is not None:
-                            appointment.clinic = target_branch
-                            appointment.save()
-                            logger.info(
-                                f"🔄 Обновлена клиника в записи {appointment.appointment_id} на {target_branch.name}")
-
-                    # Создаем или обновляем запись в очереди
-                    queue_data = {
-                        "patient": patient,
-                        "contact_start_date": contact_bdate,
-                        "contact_end_date": contact_fdate,
-                        "reason": reason,
-                        "internal_reason_code": internal_code,
-                        "internal_reason_name": internal_name,
-                        "branch": None,  # Игнорируем исходный филиал
-                        "target_branch": target_branch,  # КРИТИЧЕСКИ ВАЖНО: Целевой филиал используется для MSH.99
-                        "current_state": current_state,
-                        "desired_start_date": action_bdate,
-                        "desired_end_date": action_fdate,
-                    }
-
-                    # Добавляем информацию о докторе и отделении если они есть
-                    if doctor_code_element is not None and doctor_code_element.text:
-                        queue_data["doctor_code"] = int(doctor_code_element.text)
-                        queue_data["doctor_name"] = doctor_name
+        records = []
 
-                    if depnum_element is not None and depnum_element.text:
-                        queue_data["department_number"] = int(depnum_element.text)
-                        queue_data[
-                            "department_name"] = depname_element.text if depname_element is not None else "Неизвестное отделение"
+        for record in iter_records(xml_response, 'QUEUE_INFO'):
+            queue_info = extract_fields('QUEUE_INFO', record)
+            if 'queue_id' not in queue_info or 'patient_code' not in queue_info:
+                logger.error(f"⚠ Ошибка обработки записи очереди: нет QUEUEID или PCODE ({record})")
+                continue
 
-                    queue_entry, created = QueueInfo.objects.update_or_create(
-                        queue_id=queue_id,
-                        defaults=queue_data
-                    )
+            if 'target_branch_id' not in queue_info:
+                logger.warning(
+                    f"⚠ КРИТИЧЕСКАЯ ОШИБКА: TOFILIAL не указан для пациента {queue_info['patient_code']}. "
+                    f"Операции невозможны.")
 
-                    if created:
-                        logger.info(f"✅ Добавлена новая очередь: {queue_id} для пациента {patient.patient_code}")
-                    else:
-                        logger.info(f"🔄 Обновлена очередь: {queue_id} для пациента {patient.patient_code}")
+            records.append(queue_info)
 
-                    # Выводим информацию о причине и филиалах с подробностями
-                    logger.info(f"📋 Запись в очереди: {queue_id}")
-                    logger.info(f"  Пациент: {patient.full_name} (ID: {patient.patient_code})")
-                    logger.info(f"  Причина: {reason.reason_name if reason else 'Не указана'}")
-                    logger.info(f"  Внутренний код: {internal_code if internal_code else 'Не определен'}")
-                    logger.info(
-                        f"  TOFILIAL: {target_branch.name} (ID: {target_branch.clinic_id}) - будет использован в MSH.99" if target_branch else "⚠ TOFILIAL ОТСУТСТВУЕТ!")
-                    logger.info(
-                        f"  Доктор: {doctor.full_name if doctor else 'Не назначен'} (ID: {doctor.doctor_code if doctor else 'Н/Д'})")
-                    logger.info(f"  Состояние: {current_state}")
+        if not records:
+            logger.warning("❗ Нет записей QUEUE_INFO в ответе QUEUE_LIST")
+            return None
 
-            except Exception as inner_error:
-                logger.error(f"⚠ Ошибка обработки записи очереди: {inner_error}")
+        return sync_queue_records(records, incremental=incremental)
 
     except Exception as e:
         logger.error(f"⚠ Ошибка при обработке XML: {e}")
+        if raise_errors:
+            raise
+        return None
 
 
 # Запускаем процесс
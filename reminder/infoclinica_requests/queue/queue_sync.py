@@ -0,0 +1,394 @@
+import hashlib
+import json
+import logging
+
+from django.db import transaction
+
+from reminder.models import (
+    Clinic, Department, Doctor, Patient, QueueContactInfo, QueueInfo, QueueReason, QueueReasonMapping
+)
+from reminder.infoclinica_requests.reference_cache import invalidate_reference_cache
+
+logger = logging.getLogger(__name__)
+
+# Внутренняя причина, если для причины Инфоклиники нет сопоставления
+DEFAULT_INTERNAL_REASON = ("00PP0consulta", "Консультация (по умолчанию)")
+
+# Поля очереди, которые сохраняются, только если пришли в ответе (иначе остается прежнее значение)
+OPTIONAL_QUEUE_FIELDS = [
+    'current_state_name', 'default_next_state', 'default_next_state_name',
+    'doctor_code', 'doctor_name', 'department_number', 'department_name',
+]
+
+
+def record_hash(record):
+    """
+    Хэш содержимого записи Инфоклиники (словарь extract_fields) для определения изменений.
+    """
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _snapshot(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+def bulk_upsert(model, key_field, desired, existing, update_fields):
+    """
+    Записывает желаемое состояние строк одним INSERT ... ON CONFLICT (key_field) DO UPDATE.
+    desired - {ключ: {attname: значение}}, existing - {ключ: экземпляр из БД}.
+    Неизменившиеся строки не пишутся.
+
+    Возвращает:
+    dict: {'created', 'updated', 'unchanged'}
+    """
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0}
+    to_write = []
+
+    for key, values in desired.items():
+        instance = existing.get(key)
+        if instance is None:
+            stats['created'] += 1
+        elif all(getattr(instance, field) == values[field] for field in update_fields):
+            stats['unchanged'] += 1
+            continue
+        else:
+            stats['updated'] += 1
+        to_write.append(model(**{key_field: key}, **values))
+
+    if to_write:
+        field_names = [model._meta.get_field(field).name for field in update_fields]
+        if any(field.name == 'updated_at' for field in model._meta.fields):
+            field_names.append('updated_at')
+
+        model.objects.bulk_create(
+            to_write,
+            update_conflicts=True,
+            unique_fields=[key_field],
+            update_fields=field_names
+        )
+
+    return stats
+
+
+def fetch_by_key(model, key_field, keys):
+    if not keys:
+        return {}
+    return {getattr(obj, key_field): obj for obj in model.objects.filter(**{f"{key_field}__in": list(keys)})}
+
+
+def _sync_reasons(records):
+    """
+    Причины очереди (ADDID). Возвращает статистику и {reason_id: (internal_code, internal_name)}.
+    """
+    names = {}
+    for record in records:
+        reason_id = record.get('reason_id')
+        if reason_id is None:
+            continue
+        if record.get('reason_name'):
+            names[reason_id] = record['reason_name']
+        else:
+            names.setdefault(reason_id, None)
+
+    existing = fetch_by_key(QueueReason, 'reason_id', names)
+
+    # Пустое ADDNAME не затирает сохраненное название
+    desired = {
+        reason_id: {'reason_name': name or (existing[reason_id].reason_name if reason_id in existing
+                                            else f"Причина {reason_id}")}
+        for reason_id, name in names.items()
+    }
+
+    stats = bulk_upsert(QueueReason, 'reason_id', desired, existing, ['reason_name'])
+
+    internal_reasons = {}
+    if desired:
+        mappings = QueueReasonMapping.objects.filter(reason__reason_id__in=list(desired)).values_list(
+            'reason__reason_id', 'internal_code', 'internal_name'
+        ).order_by('id')
+        for reason_id, internal_code, internal_name in mappings:
+            internal_reasons.setdefault(reason_id, (internal_code, internal_name))
+
+    for reason_id in desired:
+        if reason_id not in internal_reasons:
+            logger.warning(f"⚠ Не найдено сопоставление для причины {reason_id}, используется значение по умолчанию")
+            internal_reasons[reason_id] = DEFAULT_INTERNAL_REASON
+
+    return stats, internal_reasons
+
+
+def _sync_clinics(records, source_branch):
+    """
+    Целевые филиалы (TOFILIAL) и, если source_branch, филиалы звонка (FILIAL).
+    Возвращает статистику и {clinic_id: pk}.
+    """
+    desired = {}
+    pairs = [('target_branch_id', 'target_branch_name')]
+    if source_branch:
+        pairs.insert(0, ('branch_id', 'branch_name'))
+
+    for record in records:
+        for id_field, name_field in pairs:
+            clinic_id = record.get(id_field)
+            if clinic_id is None:
+                continue
+            name = record.get(name_field) or (desired.get(clinic_id) or {}).get('name') or ""
+            desired[clinic_id] = {'name': name, 'address': "", 'phone': "", 'timezone': 0}
+
+    existing = fetch_by_key(Clinic, 'clinic_id', desired)
+    for clinic_id, values in desired.items():
+        # Пустое название не затирает сохраненное
+        if clinic_id in existing and not values['name']:
+            values['name'] = existing[clinic_id].name
+
+    stats = bulk_upsert(Clinic, 'clinic_id', desired, existing, ['name'])
+    if stats['created']:
+        existing = fetch_by_key(Clinic, 'clinic_id', desired)
+
+    return stats, {clinic_id: clinic.pk for clinic_id, clinic in existing.items()}
+
+
+def _sync_departments(records, clinic_pks):
+    """
+    Отделения врачей из очереди. Возвращает статистику и {department_id: pk}.
+    """
+    keys = {record['department_number'] for record in records
+            if record.get('doctor_code') and record.get('department_number')}
+    existing = fetch_by_key(Department, 'department_id', keys)
+
+    desired = {}
+    for record in records:
+        department_id = record.get('department_number')
+        if not record.get('doctor_code') or not department_id:
+            continue
+
+        name = record.get('department_name', "Неизвестное отделение")
+        clinic_pk = clinic_pks.get(record.get('target_branch_id'))
+        current = desired.get(department_id)
+        if current is None and department_id in existing:
+            current = _snapshot(existing[department_id], ['name', 'clinic_id'])
+
+        if current is None:
+            desired[department_id] = {'name': name, 'clinic_id': clinic_pk}
+        elif current['name'] != name:
+            # При смене названия отделение переносится в целевой филиал
+            desired[department_id] = {'name': name, 'clinic_id': clinic_pk or current['clinic_id']}
+        else:
+            desired[department_id] = current
+
+    stats = bulk_upsert(Department, 'department_id', desired, existing, ['name', 'clinic_id'])
+    if stats['created']:
+        existing = fetch_by_key(Department, 'department_id', desired)
+
+    return stats, {department_id: department.pk for department_id, department in existing.items()}
+
+
+def _sync_doctors(records, clinic_pks, department_pks):
+    keys = {record['doctor_code'] for record in records if record.get('doctor_code')}
+    existing = fetch_by_key(Doctor, 'doctor_code', keys)
+
+    desired = {}
+    for record in records:
+        doctor_code = record.get('doctor_code')
+        if not doctor_code:
+            continue
+
+        name = record.get('doctor_name', "Неизвестный доктор")
+        clinic_pk = clinic_pks.get(record.get('target_branch_id'))
+        department_pk = department_pks.get(record.get('department_number'))
+        current = desired.get(doctor_code)
+        if current is None and doctor_code in existing:
+            current = _snapshot(existing[doctor_code], ['full_name', 'clinic_id', 'department_id'])
+
+        if current is None:
+            values = {'full_name': name, 'clinic_id': clinic_pk, 'department_id': department_pk}
+        else:
+            values = dict(current)
+            if current['full_name'] != name:
+                values['full_name'] = name
+                values['clinic_id'] = clinic_pk or current['clinic_id']
+            if department_pk:
+                values['department_id'] = department_pk
+
+        desired[doctor_code] = values
+
+    return bulk_upsert(Doctor, 'doctor_code', desired, existing, ['full_name', 'clinic_id', 'department_id'])
+
+
+def _sync_patients(records, internal_reasons):
+    """
+    Пациенты очереди и последняя причина очереди. Возвращает статистику и {patient_code: pk}.
+    """
+    keys = {record['patient_code'] for record in records}
+    existing = fetch_by_key(Patient, 'patient_code', keys)
+    reason_fields = ['last_queue_reason_code', 'last_queue_reason_name']
+
+    desired = {}
+    for record in records:
+        patient_code = record['patient_code']
+        current = desired.get(patient_code)
+        if current is None:
+            current = _snapshot(existing[patient_code], reason_fields) if patient_code in existing else {
+                'last_queue_reason_code': None, 'last_queue_reason_name': None
+            }
+
+        internal_reason = internal_reasons.get(record.get('reason_id'))
+        if internal_reason:
+            current = {'last_queue_reason_code': internal_reason[0], 'last_queue_reason_name': internal_reason[1]}
+
+        desired[patient_code] = current
+
+    for patient_code, values in desired.items():
+        if patient_code not in existing:
+            # Временное имя, будет обновлено из CLIENT_INFO
+            values['full_name'] = f"Пациент {patient_code}"
+
+    stats = bulk_upsert(Patient, 'patient_code', desired, existing, reason_fields)
+    if stats['created']:
+        existing = fetch_by_key(Patient, 'patient_code', keys)
+
+    return stats, {patient_code: patient.pk for patient_code, patient in existing.items()}
+
+
+def _sync_queue_entries(records, patient_pks, internal_reasons, source_branch):
+    keys = {record['queue_id'] for record in records}
+    existing = fetch_by_key(QueueInfo, 'queue_id', keys)
+
+    desired = {}
+    for record in records:
+        queue_id = record['queue_id']
+        internal_code, internal_name = internal_reasons.get(record.get('reason_id'), (None, None))
+
+        values = {
+            'patient_id': patient_pks[record['patient_code']],
+            'reason_id': record.get('reason_id'),
+            'internal_reason_code': internal_code,
+            'internal_reason_name': internal_name,
+            # FK на Clinic и QueueReason идут через clinic_id/reason_id, поэтому pk не нужен
+            'branch_id': record.get('branch_id') if source_branch else None,
+            'target_branch_id': record.get('target_branch_id'),
+            'current_state': record.get('current_state'),
+            'contact_start_date': record.get('contact_start_date'),
+            'contact_end_date': record.get('contact_end_date'),
+            'desired_start_date': record.get('desired_start_date'),
+            'desired_end_date': record.get('desired_end_date'),
+            'payload_hash': record_hash(record),
+        }
+
+        previous = desired.get(queue_id) or (_snapshot(existing[queue_id], OPTIONAL_QUEUE_FIELDS)
+                                             if queue_id in existing else {})
+        for field in OPTIONAL_QUEUE_FIELDS:
+            values[field] = record[field] if field in record else previous.get(field)
+
+        if 'doctor_code' in record:
+            values['doctor_name'] = record.get('doctor_name', "Неизвестный доктор")
+        if 'department_number' in record:
+            values['department_name'] = record.get('department_name', "Неизвестное отделение")
+
+        desired[queue_id] = values
+
+    update_fields = list(next(iter(desired.values())).keys()) if desired else []
+    stats = bulk_upsert(QueueInfo, 'queue_id', desired, existing, update_fields)
+    return stats
+
+
+def _sync_contacts(records):
+    """
+    Варианты действий очереди: для записей, где пришел список контактов, старые контакты заменяются новыми.
+    """
+    contacts_by_queue = {record['queue_id']: record['contacts'] for record in records if record.get('contacts')}
+    if not contacts_by_queue:
+        return 0
+
+    queue_pks = dict(QueueInfo.objects.filter(queue_id__in=list(contacts_by_queue)).values_list('queue_id', 'pk'))
+    QueueContactInfo.objects.filter(queue_id__in=list(queue_pks.values())).delete()
+
+    contacts = [
+        QueueContactInfo(queue_id=queue_pks[queue_id], **contact)
+        for queue_id, queue_contacts in contacts_by_queue.items()
+        for contact in queue_contacts
+        if queue_id in queue_pks
+    ]
+    QueueContactInfo.objects.bulk_create(contacts)
+    return len(contacts)
+
+
+def skip_unchanged_records(records):
+    """
+    Отбрасывает записи, хэш которых совпадает с сохраненным payload_hash очереди.
+
+    Возвращает:
+    tuple: (измененные или новые записи, количество пропущенных)
+    """
+    stored_hashes = dict(QueueInfo.objects.filter(
+        queue_id__in=[record['queue_id'] for record in records]
+    ).values_list('queue_id', 'payload_hash'))
+
+    changed = [record for record in records if stored_hashes.get(record['queue_id']) != record_hash(record)]
+    return changed, len(records) - len(changed)
+
+
+def sync_queue_records(records, source_branch=False, incremental=False):
+    """
+    Сохраняет записи очереди одного ответа (QUEUE_LIST / QUEUE_INFO) пакетно, в одной транзакции:
+    существующие строки выбираются несколькими запросами IN по ключам, запись идет через
+    bulk_create(update_conflicts=True), неизменившиеся строки не пишутся.
+
+    Параметры:
+    records (list): Словари extract_fields('QUEUE_INFO', ...); необязательный ключ 'contacts' -
+                    список словарей extract_fields('QUEUE_CONTACT_INFO', ...)
+    source_branch (bool): Сохранять филиал звонка (FILIAL) в QueueInfo.branch
+    incremental (bool): Пропускать записи, содержимое которых не изменилось с прошлой синхронизации
+                        (по payload_hash), не обращаясь к связанным таблицам
+
+    Возвращает:
+    dict: {'created', 'updated', 'unchanged'} по записям очереди, 'changed_patients' - коды пациентов
+          с новыми или измененными записями, 'details' по остальным таблицам
+    """
+    records = [record for record in records if 'queue_id' in record and 'patient_code' in record]
+
+    skipped = 0
+    if incremental and records:
+        records, skipped = skip_unchanged_records(records)
+        logger.info(f"🔄 Инкрементальная синхронизация: изменено {len(records)}, без изменений {skipped}")
+
+    if not records:
+        return {'created': 0, 'updated': 0, 'unchanged': skipped, 'changed_patients': [], 'details': {}}
+
+    with transaction.atomic():
+        reason_stats, internal_reasons = _sync_reasons(records)
+        clinic_stats, clinic_pks = _sync_clinics(records, source_branch)
+        department_stats, department_pks = _sync_departments(records, clinic_pks)
+        doctor_stats = _sync_doctors(records, clinic_pks, department_pks)
+        patient_stats, patient_pks = _sync_patients(records, internal_reasons)
+        queue_stats = _sync_queue_entries(records, patient_pks, internal_reasons, source_branch)
+        contacts_saved = _sync_contacts(records)
+
+    queue_stats['unchanged'] += skipped
+
+    # Новые или измененные справочные записи - процессы перечитают справочники из БД
+    changed_tables = [
+        table for table, stats in (('queue_reason', reason_stats), ('clinic', clinic_stats),
+                                   ('department', department_stats), ('doctor', doctor_stats))
+        if stats['created'] or stats['updated']
+    ]
+    if changed_tables:
+        invalidate_reference_cache(*changed_tables)
+
+    details = {
+        'reasons': reason_stats,
+        'clinics': clinic_stats,
+        'departments': department_stats,
+        'doctors': doctor_stats,
+        'patients': patient_stats,
+        'contacts': contacts_saved,
+    }
+
+    logger.info(f"✅ Синхронизация очереди: создано {queue_stats['created']}, обновлено {queue_stats['updated']}, "
+                f"без изменений {queue_stats['unchanged']}")
+    for name, stats in details.items():
+        logger.info(f"  {name}: {stats}")
+
+    changed_patients = sorted({record['patient_code'] for record in records})
+    return {**queue_stats, 'changed_patients': changed_patients, 'details': details}
@@ -13,7 +13,9 @@ from reminder.infoclinica_requests.utils import generate_msh_10
 from django.utils.dateparse import parse_date
 from django.db import transaction
 
-import requests
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.xml_schemas import extract_fields
+from reminder.infoclinica_requests.reference_cache import invalidate_reference_cache
 import logging
 import xml.etree.ElementTree as ET
 import pytz
@@ -24,14 +26,6 @@ logger = logging.getLogger()
 
 # Загрузка переменных окружения
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def web_reference():
@@ -68,13 +62,7 @@ def web_reference():
             f"\n\n---------------\nОтправка запроса REFERENCE для WEB_SCHQUEUE_ADDTYPES: \n{xml_request}\n---------------\n")
 
         # Отправляем запрос
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-            data=xml_request,
-            cert=(cert_file_path, key_file_path),
-            verify=True
-        )
+        response = post_xml(xml_request)
 
         if response.status_code == 200:
             logger.info(f"\n\n---------------\nОтвет от REFERENCE: {response.text}\n---------------\n")
@@ -114,15 +102,14 @@ def parse_reference_response(xml_response):
         # Обрабатываем каждую запись
         with transaction.atomic():
             for rec in records:
-                rec_id_elem = rec.find("ns:RECID", namespace)
-                rec_name_elem = rec.find("ns:RECNAME", namespace)
+                rec_data = extract_fields('REC', rec)
 
-                if rec_id_elem is None or rec_name_elem is None:
+                if 'rec_id' not in rec_data or 'rec_name' not in rec_data:
                     logger.warning("⚠ Пропущена запись без ID или названия")
                     continue
 
-                rec_id = int(rec_id_elem.text)
-                rec_name = rec_name_elem.text.strip()
+                rec_id = rec_data['rec_id']
+                rec_name = rec_data['rec_name']
 
                 # Создаем или обновляем QueueReason
                 reason, created = QueueReason.objects.update_or_create(
@@ -135,6 +122,9 @@ def parse_reference_response(xml_response):
                 else:
                     logger.info(f"🔄 Обновлена существующая причина: {rec_id} - {rec_name}")
 
+        # Причины изменились - процессы перечитают справочник из БД
+        invalidate_reference_cache('queue_reason')
+
         # Создаем сопоставления причин с внутренними кодами
         create_reason_mappings()
 
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+from reminder.models import Clinic, Department, Doctor, QueueReason
+
+logger = logging.getLogger(__name__)
+
+# Справочники: имя -> (модель, натуральный ключ, select_related)
+REFERENCE_TABLES = {
+    'clinic': (Clinic, 'clinic_id', ()),
+    'department': (Department, 'department_id', ('clinic',)),
+    'doctor': (Doctor, 'doctor_code', ('department', 'clinic')),
+    'queue_reason': (QueueReason, 'reason_id', ()),
+}
+
+# Как часто сверять локальные версии справочников с общими (в Redis), секунд
+REFERENCE_VERSION_CHECK_INTERVAL = 30
+# Полная перезагрузка справочника, даже если версия не менялась (изменения в обход invalidate), секунд
+REFERENCE_CACHE_TTL = 60 * 60
+
+# Справочники, загруженные в этом процессе: имя -> {'version', 'loaded_at', 'items': {ключ: экземпляр}}
+_tables = {}
+_tables_lock = threading.Lock()
+_last_version_check = 0.0
+_shared_versions = {}
+
+
+def get_version_key(table):
+    return f"reference_version_{table}"
+
+
+def _refresh_shared_versions():
+    """
+    Раз в REFERENCE_VERSION_CHECK_INTERVAL секунд читает общие версии справочников одним запросом к кэшу.
+    """
+    global _last_version_check, _shared_versions
+
+    now = time.monotonic()
+    if now - _last_version_check < REFERENCE_VERSION_CHECK_INTERVAL:
+        return _shared_versions
+
+    try:
+        versions = cache.get_many([get_version_key(table) for table in REFERENCE_TABLES])
+        _shared_versions = {table: versions.get(get_version_key(table), 0) for table in REFERENCE_TABLES}
+    except Exception as e:
+        # Redis недоступен - живем на локальных данных до истечения REFERENCE_CACHE_TTL
+        logger.error(f"Ошибка при чтении версий справочников: {e}")
+
+    _last_version_check = now
+    return _shared_versions
+
+
+def _load_table(table, version):
+    model, key_field, related = REFERENCE_TABLES[table]
+    queryset = model.objects.select_related(*related) if related else model.objects.all()
+    items = {getattr(obj, key_field): obj for obj in queryset}
+
+    logger.info(f"🔄 Справочник {table} загружен в память: {len(items)} записей (версия {version})")
+    return {'version': version, 'loaded_at': time.monotonic(), 'items': items}
+
+
+def _get_table(table):
+    version = _refresh_shared_versions().get(table, 0)
+    entry = _tables.get(table)
+
+    if entry and entry['version'] == version and time.monotonic() - entry['loaded_at'] < REFERENCE_CACHE_TTL:
+        return entry['items']
+
+    with _tables_lock:
+        entry = _tables.get(table)
+        if entry is None or entry['version'] != version or time.monotonic() - entry['loaded_at'] >= REFERENCE_CACHE_TTL:
+            entry = _load_table(table, version)
+            _tables[table] = entry
+
+    return entry['items']
+
+
+def get_reference(table, key):
+    """
+    Возвращает запись справочника table по натуральному ключу из памяти процесса.
+    Если записи нет (создана после загрузки справочника), один раз ищет ее в БД и запоминает.
+
+    Возвращает:
+    Экземпляр модели или None
+    """
+    if key is None:
+        return None
+
+    items = _get_table(table)
+    instance = items.get(key)
+    if instance is not None:
+        return instance
+
+    model, key_field, related = REFERENCE_TABLES[table]
+    instance = model.objects.select_related(*related).filter(**{key_field: key}).first()
+    if instance is not None:
+        items[key] = instance
+    return instance
+
+
+def get_clinic(clinic_id):
+    return get_reference('clinic', clinic_id)
+
+
+def get_department(department_id):
+    return get_reference('department', department_id)
+
+
+def get_doctor(doctor_code):
+    return get_reference('doctor', doctor_code)
+
+
+def get_queue_reason(reason_id):
+    return get_reference('queue_reason', reason_id)
+
+
+def invalidate_reference_cache(*tables):
+    """
+    Сообщает всем процессам, что справочники изменились (по умолчанию - все):
+    увеличивает общую версию в кэше и сбрасывает локальную копию.
+    Другие процессы перезагрузят справочник при следующей сверке версий.
+    """
+    global _last_version_check
+
+    tables = tables or tuple(REFERENCE_TABLES)
+
+    for table in tables:
+        key = get_version_key(table)
+        try:
+            # Версия без срока жизни: add создает ключ, если его нет, incr атомарно увеличивает
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении версии справочника {table}: {e}")
+
+        with _tables_lock:
+            _tables.pop(table, None)
+
+    # Следующее обращение в этом процессе сразу прочитает новые версии
+    _last_version_check = 0.0
+    logger.info(f"ℹ️ Справочники помечены как измененные: {', '.join(tables)}")
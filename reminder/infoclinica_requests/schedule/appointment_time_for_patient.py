@@ -9,7 +9,7 @@ django.setup()
 
 import logging
 import xml.etree.ElementTree as ET
-import requests
+from reminder.infoclinica_requests.transport import post_xml
 from datetime import datetime
 from django.http import JsonResponse
 from dotenv import load_dotenv
@@ -20,15 +20,6 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Конфигурация
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def appointment_time_for_patient(patient_code, year_from_patient_for_returning=None):
@@ -117,12 +108,7 @@ def appointment_time_for_patient(patient_code, year_from_patient_for_returning=N
         logger.info(f"Полный XML-запрос web_schedule_info: {xml_request}")
         logger.info(
             f"Отправляем запрос с TOFILIAL={target_filial_id} для получения информации о записи {appointment_id}")
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers={'X-Forwarded-Host': infoclinica_x_forwarded_host, 'Content-Type': 'text/xml'},
-            data=xml_request,
-            cert=(cert_file_path, key_file_path)
-        )
+        response = post_xml(xml_request)
 
         if response.status_code == 200:
             try:
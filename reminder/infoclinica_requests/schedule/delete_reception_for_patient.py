@@ -5,7 +5,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
 from dotenv import load_dotenv
-import requests
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.schedule.schedule_cache import on_reception_removed
+from reminder.infoclinica_requests.schedule.slot_lease import release_owner_slot
 import logging
 import xml.etree.ElementTree as ET
 from datetime import datetime
@@ -15,15 +17,6 @@ from reminder.infoclinica_requests.utils import compare_times_for_redis, compare
 
 logger = logging.getLogger(__name__)
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host=os.getenv('INFOCLINICA_HOST')
-
-# Paths to certificates
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def delete_reception_for_patient(patient_id):
@@ -75,11 +68,6 @@ def delete_reception_for_patient(patient_id):
             logger.error(f"ID {appointment_id} is not an Infoclinica identifier")
             return {"status": "error", "message": "Cannot delete appointment not created in Infoclinica"}
 
-        # Заголовки запроса
-        headers = {
-            'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}',
-            'Content-Type': 'text/xml'
-        }
 
         # Формируем XML-запрос для удаления записи с TOFILIAL в MSH.99
         xml_request = f'''
@@ -105,12 +93,7 @@ def delete_reception_for_patient(patient_id):
         logger.info(f"Полный XML-запрос schedule_rec_remove_in: {xml_request}")
         # Выполняем POST-запрос
         logger.info(f"Отправка запроса на удаление записи {appointment_id} с TOFILIAL={target_branch_id}")
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers=headers,
-            data=xml_request,
-            cert=(cert_file_path, key_file_path)
-        )
+        response = post_xml(xml_request)
 
         # Обрабатываем ответ
         if response.status_code == 200:
@@ -137,6 +120,13 @@ def delete_reception_for_patient(patient_id):
                         appointment.is_active = False
                         appointment.save()
 
+                        # Освободившееся время должно снова появиться в расписании и не удерживаться арендой пациента
+                        if appointment.doctor and appointment.start_time:
+                            on_reception_removed(target_branch_id, appointment.doctor.doctor_code,
+                                                 appointment.start_time)
+                            release_owner_slot(target_branch_id, appointment.doctor.doctor_code,
+                                               appointment.start_time, owner=patient_id)
+
                         answer = {
                             'status': 'success_delete',
                             'message': f'Appointment with ID: {appointment_id}, '
@@ -6,11 +6,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
 import logging
-import requests
-import xml.etree.ElementTree as ET
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.xml_stream import iter_records
+from reminder.infoclinica_requests.xml_schemas import extract_fields
 from datetime import datetime, timedelta
+from reminder.infoclinica_requests.async_client import build_doct_schedule_free_xml
 from reminder.infoclinica_requests.schedule.schedule_cache import (
-    get_cached_schedule, cache_schedule, check_day_has_slots_from_cache
+    get_cached_schedule, cache_schedule, check_day_has_slots_from_cache, get_cached_doctor_scope, cache_doctor_scope,
+    get_schedule_scope_cache_key, run_single_flight, refresh_in_background, build_date_index, STALE_DURATION
 )
 
 # Настройка логирования
@@ -18,21 +21,11 @@ logger = logging.getLogger(__name__)
 
 # Импорты моделей
 from reminder.models import Clinic, Doctor, Department, Patient, QueueInfo, PatientDoctorAssociation
-from reminder.infoclinica_requests.utils import generate_msh_10
 
 # Загрузка переменных окружения
 from dotenv import load_dotenv
 
 load_dotenv()
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
-# Пути к сертификатам
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 
 
 def get_patient_doctor_schedule(patient_code, days_horizon=7, online_mode=0, return_raw=False):
@@ -59,72 +52,78 @@ def get_patient_doctor_schedule(patient_code, days_horizon=7, online_mode=0, ret
             'error': "Не удалось найти необходимые параметры для запроса графика"
         }
 
-    try:
-        # Временные параметры для запроса
-        current_date = datetime.now()
-        end_date = current_date + timedelta(days=days_horizon)
+    if return_raw:
+        bdate_iso, fdate_iso = get_schedule_window(days_horizon)
+        return request_doctor_schedule(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                       online_mode=online_mode, return_raw=True)
+
+    return get_doctor_schedule(clinic_id, doctor_code, department_id, days_horizon=days_horizon,
+                               online_mode=online_mode)
+
+
+def get_schedule_window(days_horizon=7):
+    """
+    Возвращает период запроса графика (сегодня .. сегодня + days_horizon) в формате YYYY-MM-DD.
+    """
+    current_date = datetime.now()
+    end_date = current_date + timedelta(days=days_horizon)
+    return current_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+
+
+def get_doctor_schedule(clinic_id, doctor_code, department_id, days_horizon=7, online_mode=0):
+    """
+    Возвращает график DOCT_SCHEDULE_FREE для фильтра (филиал, врач/отделение) через общий кэш.
+    """
+    bdate_iso, fdate_iso = get_schedule_window(days_horizon)
+
+    # Графики врачей общие для всех пациентов с тем же врачом/отделением - сначала смотрим общий кэш
+    cached_scope = get_cached_doctor_scope(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso)
+    if cached_scope is not None:
+        if cached_scope.get('stale'):
+            refresh_doctor_schedule_in_background(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                                  online_mode=online_mode)
+        return cached_scope
+
+    # Одновременные промахи по одному фильтру объединяются в один запрос к Инфоклинике
+    return run_single_flight(
+        get_schedule_scope_cache_key(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso),
+        lambda: request_doctor_schedule(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                        online_mode=online_mode),
+        lambda: get_cached_doctor_scope(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso)
+    )
+
+
+def refresh_doctor_schedule_in_background(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                          online_mode=0):
+    """
+    Обновляет устаревший график врачей в фоне, пока вызывающий код работает с данными из кэша.
+    """
+    return refresh_in_background(
+        get_schedule_scope_cache_key(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso),
+        lambda: request_doctor_schedule(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                        online_mode=online_mode)
+    )
 
+
+def request_doctor_schedule(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso, online_mode=0,
+                            return_raw=False, stale_duration=STALE_DURATION):
+    """
+    Выполняет запрос DOCT_SCHEDULE_FREE для фильтра (филиал, врач/отделение) и сохраняет результат в общий кэш.
+    stale_duration - сколько хранить результат после окончания свежести (см. cache_doctor_scope).
+    """
+    try:
         # Форматируем даты для запроса
-        bdate = current_date.strftime("%Y%m%d")
-        fdate = end_date.strftime("%Y%m%d")
-
-        # Генерируем уникальный ID сообщения и текущую метку времени
-        ts_1 = datetime.now().strftime("%Y%m%d%H%M%S")
-        msh_10 = generate_msh_10()
-
-        # Формируем элементы запроса в зависимости от имеющихся данных
-        filial_element = f"<FILIALLIST>{clinic_id}</FILIALLIST>" if clinic_id else "<FILIALLIST></FILIALLIST>"
-
-        # Если есть doctor_code - отправляем только его
-        if doctor_code:
-            doctor_filter = f"<DOCTLIST>{doctor_code}</DOCTLIST>"
-            department_filter = ""
-        # Если есть только department_id - отправляем только его
-        elif department_id:
-            doctor_filter = ""
-            department_filter = f"<CASHLIST>{department_id}</CASHLIST>"
-        else:
-            doctor_filter = ""
-            department_filter = ""
+        bdate = bdate_iso.replace('-', '')
+        fdate = fdate_iso.replace('-', '')
 
         # Construct the XML request
-        xml_request = f'''
-        <WEB_DOCT_SCHEDULE_FREE xmlns="http://sdsys.ru/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
-          <MSH>
-            <MSH.7>
-              <TS.1>{ts_1}</TS.1>
-            </MSH.7>
-            <MSH.9>
-              <MSG.1>WEB</MSG.1>
-              <MSG.2>DOCT_SCHEDULE_FREE</MSG.2>
-            </MSH.9>
-            <MSH.10>{msh_10}</MSH.10>
-            <MSH.18>UTF-8</MSH.18>
-            <MSH.99>{clinic_id if clinic_id else ""}</MSH.99>
-          </MSH>
-          <DOCT_SCHEDULE_FREE_IN>
-            {filial_element}{department_filter}{doctor_filter}
-            <SCHEDIDENTLIST></SCHEDIDENTLIST>
-            <BDATE>{bdate}</BDATE>
-            <FDATE>{fdate}</FDATE>
-            <ONLINEMODE>{online_mode}</ONLINEMODE>
-          </DOCT_SCHEDULE_FREE_IN>
-        </WEB_DOCT_SCHEDULE_FREE>
-        '''
+        xml_request = build_doct_schedule_free_xml(clinic_id, bdate, fdate, doctor_code=doctor_code,
+                                                   department_id=department_id, online_mode=online_mode)
 
         logger.info(f"Отправка запроса DOCT_SCHEDULE_FREE:\n{xml_request}")
 
         # Выполняем HTTP-запрос
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers={
-                'X-Forwarded-Host': infoclinica_x_forwarded_host,
-                'Content-Type': 'text/xml'
-            },
-            data=xml_request,
-            cert=(cert_file_path, key_file_path),
-            verify=True
-        )
+        response = post_xml(xml_request)
 
         # Проверяем ответ сервера
         if response.status_code == 200:
@@ -139,7 +138,22 @@ def get_patient_doctor_schedule(patient_code, days_horizon=7, online_mode=0, ret
                 return response.text
 
             # Иначе разбираем XML-ответ и возвращаем результат
-            return parse_doctor_schedule_response(response.text)
+            schedule_result = parse_doctor_schedule_response(response.content)
+
+            if schedule_result.get('success', False):
+                schedule_result['bdate'] = bdate_iso
+                schedule_result['fdate'] = fdate_iso
+                schedule_result['scope'] = {
+                    'clinic_id': clinic_id,
+                    'doctor_code': doctor_code,
+                    'department_id': department_id
+                }
+                schedule_result['stale'] = False
+                schedule_result['date_index'] = build_date_index(schedule_result.get('schedules', []))
+                cache_doctor_scope(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso, schedule_result,
+                                   stale_duration=stale_duration)
+
+            return schedule_result
         else:
             logger.error(f"❌ Ошибка запроса: {response.status_code}")
             logger.error(f"Ответ сервера: {response.text}")
@@ -164,6 +178,50 @@ def get_patient_doctor_schedule(patient_code, days_horizon=7, online_mode=0, ret
         }
 
 
+def get_schedule_filter_from_queue(queue_entry):
+    """
+    Определяет фильтр графика (doctor_code, department_id, clinic_id) по записи очереди.
+    Используется и для пациента, и для прогрева кэша, чтобы ключи кэша совпадали.
+
+    Возвращает:
+    tuple | None: (doctor_code, department_id, clinic_id) или None, если в очереди нет филиала
+    """
+    # Приоритеты:
+    # 1. Врач + отделение + филиал из очереди
+    if queue_entry.doctor_code and queue_entry.department_number and queue_entry.target_branch:
+        logger.info(f"Найден врач {queue_entry.doctor_code} в очереди {queue_entry.queue_id}")
+        return (
+            queue_entry.doctor_code,
+            queue_entry.department_number,
+            queue_entry.target_branch.clinic_id
+        )
+
+    # 2. Врач + филиал
+    if queue_entry.doctor_code and queue_entry.target_branch:
+        logger.info(f"Найден врач {queue_entry.doctor_code} и филиал в очереди {queue_entry.queue_id}")
+        return (
+            queue_entry.doctor_code,
+            None,
+            queue_entry.target_branch.clinic_id
+        )
+
+    # 3. Отделение + филиал
+    if queue_entry.department_number and queue_entry.target_branch:
+        logger.info(f"Найдено отделение {queue_entry.department_number} в очереди {queue_entry.queue_id}")
+        return (
+            None,
+            queue_entry.department_number,
+            queue_entry.target_branch.clinic_id
+        )
+
+    # 4. Только филиал
+    if queue_entry.target_branch:
+        logger.info(f"Найден только филиал в очереди {queue_entry.queue_id}")
+        return (None, None, queue_entry.target_branch.clinic_id)
+
+    return None
+
+
 def get_available_doctor_by_patient(patient_code):
     """
     Определяет доступного врача для пациента с улучшенной поддержкой
@@ -177,43 +235,14 @@ def get_available_doctor_by_patient(patient_code):
     """
     try:
         # Проверяем очереди пациента
-        queues = QueueInfo.objects.filter(patient__patient_code=patient_code).order_by('-created_at')
-
-        if queues.exists():
-            latest_queue = queues.first()
-
-            # Приоритеты:
-            # 1. Врач + отделение + филиал из очереди
-            if latest_queue.doctor_code and latest_queue.department_number and latest_queue.target_branch:
-                logger.info(f"Найден врач {latest_queue.doctor_code} в очереди пациента {patient_code}")
-                return (
-                    latest_queue.doctor_code,
-                    latest_queue.department_number,
-                    latest_queue.target_branch.clinic_id
-                )
-
-            # 2. Врач + филиал
-            if latest_queue.doctor_code and latest_queue.target_branch:
-                logger.info(f"Найден врач {latest_queue.doctor_code} и филиал в очереди пациента {patient_code}")
-                return (
-                    latest_queue.doctor_code,
-                    None,
-                    latest_queue.target_branch.clinic_id
-                )
-
-            # 3. Отделение + филиал
-            if latest_queue.department_number and latest_queue.target_branch:
-                logger.info(f"Найдено отделение {latest_queue.department_number} в очереди пациента {patient_code}")
-                return (
-                    None,
-                    latest_queue.department_number,
-                    latest_queue.target_branch.clinic_id
-                )
+        latest_queue = QueueInfo.objects.filter(
+            patient__patient_code=patient_code
+        ).select_related('target_branch').order_by('-created_at').first()
 
-            # 4. Только филиал
-            if latest_queue.target_branch:
-                logger.info(f"Найден только филиал в очереди пациента {patient_code}")
-                return (None, None, latest_queue.target_branch.clinic_id)
+        if latest_queue:
+            schedule_filter = get_schedule_filter_from_queue(latest_queue)
+            if schedule_filter:
+                return schedule_filter
 
         # Если не нашли в очередях, проверяем пациента напрямую
         patient = Patient.objects.filter(patient_code=patient_code).first()
@@ -527,125 +556,33 @@ def parse_doctor_schedule_response(xml_response):
     dict: Структурированный словарь с результатами
     """
     try:
-        root = ET.fromstring(xml_response)
-        namespace = {'ns': 'http://sdsys.ru/'}
-
-        # Проверяем статус ответа
-        msa_element = root.find(".//ns:MSA/ns:MSA.1", namespace)
-        if msa_element is None or msa_element.text != "AA":
-            logger.warning(
-                f"❗ Неуспешный ответ от сервера: {msa_element.text if msa_element is not None else 'Не найден'}")
-
-            # Проверяем, есть ли сообщение об ошибке
-            err_element = root.find(".//ns:ERR/ns:ERR.3/ns:CWE.2", namespace)
-            err_message = err_element.text if err_element is not None else "Неизвестная ошибка"
-
-            sp_comment = root.find(".//ns:SPCOMMENT", namespace)
-            if sp_comment is not None:
-                err_message = sp_comment.text
-
-            return {
-                'success': False,
-                'error': err_message
-            }
-
-        # Проверяем код результата
-        sp_result = root.find(".//ns:SPRESULT", namespace)
-        if sp_result is not None and sp_result.text != "1":
-            sp_comment = root.find(".//ns:SPCOMMENT", namespace)
-            err_message = sp_comment.text if sp_comment is not None else "Ошибка при получении расписания"
-
-            return {
-                'success': False,
-                'error': err_message
-            }
-
-        # Ищем все интервалы графика в ответе
-        schedule_elements = root.findall(".//ns:DOCT_SCHEDULE_FREE_OUT/ns:SCHINTERVAL", namespace)
-
-        if not schedule_elements:
-            logger.info("ℹ️ График работы не найден в ответе")
-            return {
-                'success': True,
-                'schedules': [],
-                'by_doctor': {}  # Добавляем структуру для группировки по врачам
-            }
-
+        header = {}
         schedules = []
         by_doctor = {}  # Группировка по врачам
         doctors_with_restrictions = set()  # Набор ID врачей с ограничениями
 
-        for sched in schedule_elements:
-            schedule_data = {}
-
-            # Базовые параметры графика
-            field_mappings = {
-                'schedule_id': 'SCHEDIDENT',
-                'doctor_code': 'DCODE',
-                'doctor_name': 'DNAME',
-                'department_id': 'DEPNUM',
-                'department_name': 'DEPNAME',
-                'clinic_id': 'FILIAL',
-                'clinic_name': 'FNAME',
-                'timezone': 'TIMEZONE',
-                'date': 'WDATE',
-                'begin_hour': 'BEGHOUR',
-                'begin_min': 'BEGMIN',
-                'end_hour': 'ENDHOUR',
-                'end_min': 'ENDMIN',
-                'room_num': 'RNUM',
-                'room_floor': 'RFLOOR',
-                'room_building': 'RBUILDING',
-                'free_flag': 'FREEFLAG',
-                'free_count': 'FREECOUNT',
-                'online_mode': 'ONLINEMODE'
-            }
-
-            for field_name, xml_field in field_mappings.items():
-                element = sched.find(f"ns:{xml_field}", namespace)
-                if element is not None and element.text:
-                    # Преобразуем численные поля в int
-                    numeric_fields = [
-                        'schedule_id', 'doctor_code', 'department_id', 'clinic_id',
-                        'begin_hour', 'begin_min', 'end_hour', 'end_min',
-                        'free_flag', 'free_count', 'online_mode', 'timezone'
-                    ]
-
-                    if field_name in numeric_fields:
-                        try:
-                            schedule_data[field_name] = int(element.text)
-                        except ValueError:
-                            schedule_data[field_name] = element.text
-                    else:
-                        schedule_data[field_name] = element.text
+        # Интервалы графика (DOCT_SCHEDULE_FREE_OUT/SCHINTERVAL) разбираются потоково, по одному
+        for sched in iter_records(xml_response, 'SCHINTERVAL', header=header):
+            # Базовые параметры графика (схема SCHINTERVAL, числовые поля приводятся к int)
+            schedule_data = extract_fields('SCHINTERVAL', sched)
 
             # Проверяем наличие ограничений (CHECKDATA) - УЛУЧШЕННАЯ ОБРАБОТКА
-            check_elements = sched.findall(".//ns:CHECKDATA", namespace)
+            check_elements = sched.get('CHECKDATA', [])
             has_blocking_restriction = False
 
             if check_elements:
                 check_data = []
                 for check in check_elements:
-                    check_info = {}
-                    check_code = check.find("ns:CHECKCODE", namespace)
-                    check_label = check.find("ns:CHECKLABEL", namespace)
-                    check_text = check.find("ns:CHECKTEXT", namespace)
-
-                    if check_code is not None:
-                        check_info['check_code'] = check_code.text
-                        # Проверяем на блокирующие ограничения
-                        if check_code.text == "2":
-                            has_blocking_restriction = True
-                            if 'doctor_code' in schedule_data:
-                                doctors_with_restrictions.add(str(schedule_data['doctor_code']))
-                                logger.warning(
-                                    f"Врач {schedule_data.get('doctor_code')} ({schedule_data.get('doctor_name', '')}) "
-                                    f"имеет блокирующее ограничение: {check_label.text if check_label is not None else 'Неизвестное ограничение'}")
-
-                    if check_label is not None:
-                        check_info['check_label'] = check_label.text
-                    if check_text is not None:
-                        check_info['check_text'] = check_text.text
+                    check_info = extract_fields('CHECKDATA', check)
+
+                    # Проверяем на блокирующие ограничения
+                    if check_info.get('check_code') == "2":
+                        has_blocking_restriction = True
+                        if 'doctor_code' in schedule_data:
+                            doctors_with_restrictions.add(str(schedule_data['doctor_code']))
+                            logger.warning(
+                                f"Врач {schedule_data.get('doctor_code')} ({schedule_data.get('doctor_name', '')}) "
+                                f"имеет блокирующее ограничение: {check_info.get('check_label', 'Неизвестное ограничение')}")
 
                     check_data.append(check_info)
 
@@ -719,6 +656,39 @@ def parse_doctor_schedule_response(xml_response):
                 if has_blocking_restriction:
                     by_doctor[doctor_code]['has_restrictions'] = True
 
+        # Проверяем статус ответа (заголовок собран при разборе)
+        if header.get('MSA.1') != "AA":
+            logger.warning(
+                f"❗ Неуспешный ответ от сервера: {header['MSA.1'] if 'MSA.1' in header else 'Не найден'}")
+
+            # Проверяем, есть ли сообщение об ошибке
+            err_message = header['CWE.2'] if 'CWE.2' in header else "Неизвестная ошибка"
+
+            if 'SPCOMMENT' in header:
+                err_message = header['SPCOMMENT']
+
+            return {
+                'success': False,
+                'error': err_message
+            }
+
+        # Проверяем код результата
+        if 'SPRESULT' in header and header['SPRESULT'] != "1":
+            err_message = header['SPCOMMENT'] if 'SPCOMMENT' in header else "Ошибка при получении расписания"
+
+            return {
+                'success': False,
+                'error': err_message
+            }
+
+        if not schedules:
+            logger.info("ℹ️ График работы не найден в ответе")
+            return {
+                'success': True,
+                'schedules': [],
+                'by_doctor': {}  # Добавляем структуру для группировки по врачам
+            }
+
         # Сортируем результаты по дате и времени
         schedules.sort(key=lambda x: (x.get('date', ''), x.get('begin_hour', 0), x.get('begin_min', 0)))
 
@@ -14,11 +14,51 @@ from reminder.infoclinica_requests.schedule.doct_schedule_free import (
     get_patient_doctor_schedule, select_best_doctor_from_schedules, get_available_doctor_by_patient
 )
 from reminder.infoclinica_requests.schedule.schedule_cache import get_cached_schedule, cache_schedule
+from reminder.infoclinica_requests.schedule.slot_lease import acquire_slot_lease, release_slot_lease
+from reminder.infoclinica_requests.transport import post_xml
 from reminder.models import Patient, Doctor, PatientDoctorAssociation, Appointment
 
 logger = logging.getLogger(__name__)
 
 
+def suggest_times_response(available_times, requested_time, requested_date, times_data, patient_id, doctor_code):
+    """
+    Ответ с ближайшими альтернативами, когда запрошенное время недоступно.
+    """
+    from reminder.infoclinica_requests.utils import compare_and_suggest_times
+
+    # Создаем список свободных интервалов
+    free_intervals = []
+    for t in available_times:
+        start_hour, start_min = map(int, t.split(':'))
+        end_hour = start_hour
+        end_min = start_min + 30
+        if end_min >= 60:
+            end_min -= 60
+            end_hour += 1
+
+        free_intervals.append({
+            'start_time': t,
+            'end_time': f"{end_hour:02d}:{end_min:02d}"
+        })
+
+    # Получаем предложенные времена
+    requested_time_obj = datetime.strptime(requested_time, "%H:%M").time()
+    suggested_times = compare_and_suggest_times(free_intervals, requested_time_obj, requested_date)
+
+    # Возвращаем предложение с альтернативами
+    result = {
+        "status": "suggest_times",
+        "suggested_times": suggested_times,
+        "specialist_name": times_data.get('specialist_name', 'Специалист'),
+        "patient_id": patient_id,
+        "date": requested_date,
+        "doctor_code": doctor_code
+    }
+
+    return JsonResponse(result)
+
+
 def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
     """
     Записывает пациента на прием к врачу с поддержкой автоматического выбора врача
@@ -26,6 +66,9 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
     """
     from django.db import models
 
+    # Аренда слота в Redis на время резервирования (см. slot_lease)
+    slot_lease = None
+
     try:
         logger.info(
             f"Запрос на запись/перенос: patient_id={patient_id}, date_from_patient={date_from_patient}, trigger_id={trigger_id}")
@@ -365,39 +408,20 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
             logger.info(f"ТОЧНОЕ ВРЕМЯ НЕ ДОСТУПНО: {requested_time}")
             logger.info(f"ВХОДИМ В БЛОК АЛЬТЕРНАТИВНЫХ ВРЕМЕН")
             # Точное время недоступно, нужно вернуть альтернативы
-            from reminder.infoclinica_requests.utils import compare_and_suggest_times
-
-            # Создаем список свободных интервалов
-            free_intervals = []
-            for t in available_times:
-                start_hour, start_min = map(int, t.split(':'))
-                end_hour = start_hour
-                end_min = start_min + 30
-                if end_min >= 60:
-                    end_min -= 60
-                    end_hour += 1
-
-                free_intervals.append({
-                    'start_time': t,
-                    'end_time': f"{end_hour:02d}:{end_min:02d}"
-                })
-
-            # Получаем предложенные времена
-            hour, minute = map(int, requested_time.split(':'))
-            requested_time_obj = datetime.strptime(requested_time, "%H:%M").time()
-            suggested_times = compare_and_suggest_times(free_intervals, requested_time_obj, requested_date)
-
-            # Возвращаем предложение с альтернативами
-            result = {
-                "status": "suggest_times",
-                "suggested_times": suggested_times,
-                "specialist_name": times_data.get('specialist_name', 'Специалист'),
-                "patient_id": patient_id,
-                "date": requested_date,
-                "doctor_code": doctor_code
-            }
+            return suggest_times_response(
+                available_times, requested_time, requested_date, times_data, patient_id, doctor_code
+            )
 
-            return JsonResponse(result)
+        # Захватываем слот до запросов в Инфоклинику: параллельный звонок на то же время
+        # получит альтернативы сразу, а не ошибку SCHEDULE_REC_RESERVE
+        slot_lease = acquire_slot_lease(target_branch_id, doctor_code, datetime_obj, owner=patient_id)
+        if slot_lease is None:
+            logger.info(f"ВРЕМЯ {requested_time} УЖЕ РЕЗЕРВИРУЕТСЯ ДРУГИМ ЗВОНКОМ, предлагаем альтернативы")
+            other_times = [t for t, normalized in zip(available_times, normalized_available_times)
+                           if normalized != normalized_requested_time]
+            return suggest_times_response(
+                other_times, requested_time, requested_date, times_data, patient_id, doctor_code
+            )
 
         # Если точное время доступно, выполняем резервирование
         logger.info(f"НАЧИНАЕМ РЕЗЕРВИРОВАНИЕ: время {requested_time} доступно")
@@ -405,14 +429,8 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
         # Получаем schedident напрямую через WEB_SCHEDULE
         schedident = None
         try:
-            from dotenv import load_dotenv
-            import requests
             import xml.etree.ElementTree as ET
 
-            load_dotenv()
-            infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-            infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
             xml_request = f'''
             <WEB_SCHEDULE xmlns="http://sdsys.ru/">
               <MSH>
@@ -438,18 +456,10 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
             </WEB_SCHEDULE>
             '''
 
-            cert_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'certs', 'cert.pem')
-            key_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'certs', 'key.pem')
-
             logger.info(f"Полный XML-запрос web_schedule: {xml_request}")
             logger.info(f"Получаем schedident для врача {doctor_code} на дату {requested_date}")
 
-            response = requests.post(
-                url=infoclinica_api_url,
-                headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-                data=xml_request,
-                cert=(cert_file_path, key_file_path)
-            )
+            response = post_xml(xml_request)
 
             if response.status_code == 200:
                 root = ET.fromstring(response.text)
@@ -472,6 +482,7 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
                             logger.warning(f"Обнаружено ограничение: {restriction_message}")
 
                             # Если есть ограничение, возвращаем ошибку
+                            release_slot_lease(slot_lease)
                             return JsonResponse({
                                 "status": "error_med_element",
                                 "message": restriction_message
@@ -492,6 +503,7 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
             logger.info(f"ПОЛУЧЕН SCHEDIDENT: {schedident}")
         else:
             logger.error(f"ОШИБКА: НЕ УДАЛОСЬ ПОЛУЧИТЬ SCHEDIDENT для врача {doctor_code} на дату {requested_date}")
+            release_slot_lease(slot_lease)
             return JsonResponse({
                 "status": "error",
                 "message": "Не удалось получить идентификатор расписания"
@@ -527,14 +539,21 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
             schedident_text=schedident,
             free_intervals=free_intervals,
             is_reschedule=is_reschedule,
-            schedid=existing_schedid
+            schedid=existing_schedid,
+            slot_lease=slot_lease
         )
 
         logger.info(f"РЕЗУЛЬТАТ SCHEDULE_REC_RESERVE: {reserve_result}")
 
+        is_reserved = reserve_result.get("status") in ["success_schedule", "success_change_reception"] or \
+            reserve_result.get("status", "").startswith("success_change_reception")
+
+        # Слот не занят - освобождаем его для других звонков (после успеха аренду продлил schedule_rec_reserve)
+        if not is_reserved:
+            release_slot_lease(slot_lease)
+
         # После успешного бронирования сохраняем ассоциацию врача
-        if reserve_result.get("status") in ["success_schedule", "success_change_reception"] or \
-                reserve_result.get("status", "").startswith("success_change_reception"):
+        if is_reserved:
 
             # Сохраняем ассоциацию врача с пациентом
             if doctor_code:
@@ -572,6 +591,7 @@ def reserve_reception_for_patient(patient_id, date_from_patient, trigger_id=1):
 
     except Exception as e:
         logger.error(f"Ошибка в reserve_reception_for_patient: {e}", exc_info=True)
+        release_slot_lease(slot_lease)
         return JsonResponse({
             "status": "error",
             "message": str(e)
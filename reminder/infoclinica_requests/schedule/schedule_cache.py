@@ -5,9 +5,148 @@ import logging
 from django.core.cache import cache
 from datetime import datetime
 
+import threading
+import time
+from concurrent.futures import Future
+
+from django.db import connections
+
 logger = logging.getLogger(__name__)
 
 CACHE_DURATION = 60 * 15
+# Сколько еще можно отдавать устаревшие данные, пока в фоне идет обновление
+STALE_DURATION = 60 * 10
+# Блокировка обновления одного ключа (на случай падения процесса, держащего блокировку)
+REFRESH_LOCK_TIMEOUT = 30
+# Сколько ждать результата запроса, который уже выполняет другой процесс
+REFRESH_WAIT_TIMEOUT = 15
+
+# Запросы, выполняемые в этом процессе: ключ -> Future с результатом
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_refresh_lock_key(cache_key):
+    return f"refresh_lock_{cache_key}"
+
+
+def is_fresh(entry):
+    """
+    Проверяет, не истек ли срок свежести записи кэша (поле fresh_until).
+    """
+    return entry.get('fresh_until', 0) > time.time()
+
+
+def _acquire_refresh_lock(cache_key):
+    try:
+        return cache.add(get_refresh_lock_key(cache_key), 1, timeout=REFRESH_LOCK_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Ошибка при получении блокировки обновления {cache_key}: {e}")
+        # Redis недоступен - не блокируем запрос
+        return True
+
+
+def _release_refresh_lock(cache_key):
+    try:
+        cache.delete(get_refresh_lock_key(cache_key))
+    except Exception as e:
+        logger.error(f"Ошибка при снятии блокировки обновления {cache_key}: {e}")
+
+
+def _is_refresh_locked(cache_key):
+    try:
+        return cache.get(get_refresh_lock_key(cache_key)) is not None
+    except Exception:
+        return False
+
+
+def _fetch_with_lock(cache_key, fetch_func, read_cached_func):
+    if _acquire_refresh_lock(cache_key):
+        try:
+            return fetch_func()
+        finally:
+            _release_refresh_lock(cache_key)
+
+    # Запрос уже выполняет другой процесс - ждем, пока он положит результат в кэш
+    logger.info(f"🔄 Ожидаем результат запроса {cache_key}, который выполняет другой процесс")
+    deadline = time.monotonic() + REFRESH_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        cached_result = read_cached_func()
+        if cached_result is not None:
+            return cached_result
+        if not _is_refresh_locked(cache_key):
+            break
+
+    logger.warning(f"⚠ Не дождались результата {cache_key}, выполняем запрос самостоятельно")
+    return fetch_func()
+
+
+def run_single_flight(cache_key, fetch_func, read_cached_func):
+    """
+    Выполняет fetch_func не более одного раза на ключ одновременно.
+    Конкурентные вызовы в этом процессе ждут общий Future, в других процессах - результат в кэше
+    (блокировка через cache.add в Redis).
+
+    Args:
+        cache_key: Ключ, по которому объединяются запросы
+        fetch_func: Запрос к Инфоклинике, который сам сохраняет результат в кэш
+        read_cached_func: Чтение результата из кэша (None, если его еще нет)
+    """
+    with _inflight_lock:
+        future = _inflight.get(cache_key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[cache_key] = future
+
+    if not is_owner:
+        logger.info(f"🔄 Запрос {cache_key} уже выполняется в этом процессе, ждем его результат")
+        return future.result(timeout=REFRESH_LOCK_TIMEOUT + REFRESH_WAIT_TIMEOUT)
+
+    try:
+        result = _fetch_with_lock(cache_key, fetch_func, read_cached_func)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
+
+
+def refresh_in_background(cache_key, fetch_func):
+    """
+    Запускает обновление устаревшей записи в фоновом потоке, если его еще никто не выполняет.
+
+    Returns:
+        bool: True, если обновление запущено этим вызовом
+    """
+    with _inflight_lock:
+        if cache_key in _inflight:
+            return False
+
+    try:
+        if not cache.add(get_refresh_lock_key(cache_key), 1, timeout=REFRESH_LOCK_TIMEOUT):
+            return False
+    except Exception as e:
+        logger.error(f"Ошибка при получении блокировки обновления {cache_key}: {e}")
+        return False
+
+    def refresh():
+        try:
+            fetch_func()
+            logger.info(f"✅ Фоновое обновление {cache_key} завершено")
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового обновления {cache_key}: {e}")
+        finally:
+            _release_refresh_lock(cache_key)
+            connections.close_all()
+
+    logger.info(f"🔄 Отдаем устаревшие данные {cache_key}, обновляем в фоне")
+    threading.Thread(target=refresh, daemon=True).start()
+    return True
 
 
 def get_schedule_cache_key(patient_code):
@@ -19,102 +158,393 @@ def get_schedule_cache_key(patient_code):
     return f"doct_schedule_{patient_code}_{today}"
 
 
-def get_cached_schedule(patient_code):
+def get_doctor_day_cache_key(clinic_id, doctor_code, date_iso):
+    """
+    Ключ графика врача (DOCT_SCHEDULE_FREE) на один день. Общий для всех пациентов.
+    """
+    return f"doctor_schedule_{clinic_id}_{doctor_code}_{date_iso}"
+
+
+def get_doctor_intervals_cache_key(clinic_id, doctor_code, date_iso):
+    """
+    Ключ свободных интервалов врача (SCHEDULE) на один день. Общий для всех пациентов.
+    """
+    return f"doctor_intervals_{clinic_id}_{doctor_code}_{date_iso}"
+
+
+def get_schedule_scope_cache_key(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso):
+    """
+    Ключ списка врачей, которых вернул DOCT_SCHEDULE_FREE для фильтра (филиал, врач/отделение) за период.
+    """
+    return f"schedule_scope_{clinic_id or ''}_{doctor_code or ''}_{department_id or ''}_{bdate_iso}_{fdate_iso}"
+
+
+def get_dates_in_range(bdate_iso, fdate_iso):
+    """
+    Возвращает список дат YYYY-MM-DD от bdate_iso до fdate_iso включительно.
     """
-    Получает кэшированное расписание
+    current_date = datetime.strptime(bdate_iso, "%Y-%m-%d").date()
+    end_date = datetime.strptime(fdate_iso, "%Y-%m-%d").date()
+
+    dates = []
+    while current_date <= end_date:
+        dates.append(current_date.strftime("%Y-%m-%d"))
+        current_date += timedelta(days=1)
+    return dates
+
+
+def store_doctor_schedules(schedule_data, bdate_iso=None, fdate_iso=None, default_clinic_id=None,
+                           stale_duration=STALE_DURATION):
     """
+    Раскладывает результат DOCT_SCHEDULE_FREE по ключам (филиал, врач, дата).
+    Для дней периода без графика сохраняется пустой список, чтобы отличать "нет приема" от истекшего кэша.
+    stale_duration - сколько хранить записи после окончания свежести (дольше - для прогрева перед обзвоном).
+
+    Returns:
+        list: Пары [clinic_id, doctor_code], попавшие в кэш
+    """
+    schedules = schedule_data.get('schedules', [])
+
+    if not bdate_iso or not fdate_iso:
+        dates_iso = sorted(schedule.get('date_iso') for schedule in schedules if schedule.get('date_iso'))
+        if not dates_iso:
+            return []
+        bdate_iso, fdate_iso = dates_iso[0], dates_iso[-1]
+
+    rows_by_key = {}
+    doctors = []
+    for schedule in schedules:
+        doctor_code = schedule.get('doctor_code')
+        date_iso = schedule.get('date_iso')
+        if not doctor_code or not date_iso:
+            continue
+
+        clinic_id = schedule.get('clinic_id') or default_clinic_id
+        if [clinic_id, doctor_code] not in doctors:
+            doctors.append([clinic_id, doctor_code])
+
+        rows_by_key.setdefault(get_doctor_day_cache_key(clinic_id, doctor_code, date_iso), []).append(schedule)
+
+    dates = get_dates_in_range(bdate_iso, fdate_iso)
+    cache_entries = {}
+    for clinic_id, doctor_code in doctors:
+        for date_iso in dates:
+            cache_key = get_doctor_day_cache_key(clinic_id, doctor_code, date_iso)
+            cache_entries[cache_key] = rows_by_key.get(cache_key, [])
+
     try:
-        cache_key = f"schedule_{patient_code}"
-        cached_data = cache.get(cache_key)
+        cache.set_many(cache_entries, timeout=CACHE_DURATION + stale_duration)
+        logger.info(f"Графики {len(doctors)} врачей за {bdate_iso} - {fdate_iso} сохранены в общий кэш")
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении графиков врачей в кэш: {e}")
 
-        if cached_data:
-            logger.info(f"Найдено кэшированное расписание для пациента {patient_code}")
-            return cached_data
+    return doctors
 
-        logger.info(f"Кэшированное расписание для пациента {patient_code} не найдено")
+
+def load_doctor_schedules(doctors, bdate_iso, fdate_iso):
+    """
+    Собирает строки графика врачей из общего кэша.
+
+    Returns:
+        list | None: Строки графика или None, если хотя бы один день хотя бы одного врача отсутствует в кэше
+    """
+    keys = [get_doctor_day_cache_key(clinic_id, doctor_code, date_iso)
+            for clinic_id, doctor_code in doctors
+            for date_iso in get_dates_in_range(bdate_iso, fdate_iso)]
+
+    try:
+        cached_rows = cache.get_many(keys)
+    except Exception as e:
+        logger.error(f"Ошибка при получении графиков врачей из кэша: {e}")
+        return None
+
+    if len(cached_rows) != len(keys):
         return None
 
+    schedules = []
+    for key in keys:
+        schedules.extend(cached_rows[key])
+    return schedules
+
+
+def build_date_index(schedules):
+    """
+    Строит индекс "дата -> врачи со свободными слотами", отсортированные по убыванию free_count.
+    Строится один раз при записи в кэш, чтобы проверка дня была поиском по словарю.
+
+    Returns:
+        dict: {'YYYY-MM-DD': [{'doctor_code', 'doctor_name', 'department_id', 'clinic_id', 'free_count'}, ...]}
+    """
+    by_date = {}
+    for schedule in schedules:
+        date_iso = schedule.get('date_iso')
+        doctor_code = schedule.get('doctor_code')
+        if not date_iso or not doctor_code or not schedule.get('has_free_slots', False):
+            continue
+
+        doctors = by_date.setdefault(date_iso, {})
+        doctor_key = (doctor_code, schedule.get('clinic_id'))
+        if doctor_key not in doctors:
+            doctors[doctor_key] = {
+                'doctor_code': doctor_code,
+                'doctor_name': schedule.get('doctor_name'),
+                'department_id': schedule.get('department_id'),
+                'clinic_id': schedule.get('clinic_id'),
+                'free_count': 0
+            }
+        doctors[doctor_key]['free_count'] += schedule.get('free_count', 0) or 0
+
+    return {
+        date_iso: sorted(doctors.values(), key=lambda x: x['free_count'], reverse=True)
+        for date_iso, doctors in by_date.items()
+    }
+
+
+def build_schedule_result(schedules):
+    """
+    Собирает из строк графика структуру, совместимую с parse_doctor_schedule_response.
+    """
+    schedules = sorted(schedules, key=lambda x: (x.get('date', ''), x.get('begin_hour', 0), x.get('begin_min', 0)))
+
+    by_doctor = {}
+    doctors_with_restrictions = set()
+    for schedule in schedules:
+        doctor_code = schedule.get('doctor_code')
+        if not doctor_code:
+            continue
+
+        if doctor_code not in by_doctor:
+            by_doctor[doctor_code] = {
+                'doctor_name': schedule.get('doctor_name'),
+                'department_id': schedule.get('department_id'),
+                'department_name': schedule.get('department_name'),
+                'clinic_id': schedule.get('clinic_id'),
+                'clinic_name': schedule.get('clinic_name'),
+                'schedules': [],
+                'has_restrictions': False
+            }
+        by_doctor[doctor_code]['schedules'].append(schedule)
+
+        if schedule.get('has_blocking_restriction', False):
+            by_doctor[doctor_code]['has_restrictions'] = True
+            doctors_with_restrictions.add(str(doctor_code))
+
+    return {
+        'success': True,
+        'schedules': schedules,
+        'by_doctor': by_doctor,
+        'doctors_with_restrictions': list(doctors_with_restrictions)
+    }
+
+
+def get_cached_doctor_scope(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso):
+    """
+    Возвращает результат DOCT_SCHEDULE_FREE для фильтра из общего кэша или None.
+    Пациенты одного отделения/врача получают один и тот же результат без повторного запроса.
+    """
+    cache_key = get_schedule_scope_cache_key(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso)
+
+    try:
+        scope_entry = cache.get(cache_key)
     except Exception as e:
-        logger.error(f"Ошибка при получении кэшированного расписания: {e}")
+        logger.error(f"Ошибка при получении кэша списка врачей: {e}")
         return None
 
+    if scope_entry is None:
+        return None
 
-def cache_schedule(patient_code, schedule_data):
+    doctors = scope_entry['doctors']
+    schedules = load_doctor_schedules(doctors, bdate_iso, fdate_iso)
+    if schedules is None:
+        return None
+
+    result = build_schedule_result(schedules)
+    result['bdate'] = bdate_iso
+    result['fdate'] = fdate_iso
+    result['scope'] = {'clinic_id': clinic_id, 'doctor_code': doctor_code, 'department_id': department_id}
+    result['date_index'] = scope_entry.get('date_index') or build_date_index(schedules)
+    # Устаревшие данные отдаются вызывающему коду, а обновление запускается в фоне
+    result['stale'] = not is_fresh(scope_entry)
+    logger.info(f"✅ График {len(doctors)} врачей (филиал {clinic_id}, врач {doctor_code}, отделение {department_id}) "
+                f"взят из общего кэша{' (устаревший)' if result['stale'] else ''}")
+    return result
+
+
+def cache_doctor_scope(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso, schedule_data,
+                       stale_duration=STALE_DURATION):
     """
-    Кэширует расписание с улучшенной поддержкой нескольких врачей
+    Сохраняет результат DOCT_SCHEDULE_FREE для фильтра: строки графика по (филиал, врач, дата)
+    и список врачей, которых вернул запрос.
     """
+    doctors = store_doctor_schedules(schedule_data, bdate_iso, fdate_iso, default_clinic_id=clinic_id,
+                                     stale_duration=stale_duration)
+    cache_key = get_schedule_scope_cache_key(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso)
+
+    scope_entry = {
+        'doctors': doctors,
+        'date_index': schedule_data.get('date_index') or build_date_index(schedule_data.get('schedules', [])),
+        'fresh_until': time.time() + CACHE_DURATION
+    }
+
     try:
-        cache_key = f"schedule_{patient_code}"
+        cache.set(cache_key, scope_entry, timeout=CACHE_DURATION + stale_duration)
+    except Exception as e:
+        logger.error(f"Ошибка при кэшировании списка врачей: {e}")
+
 
-        # Определяем целевую клинику и структурируем данные по врачам
-        target_clinic = None
-        doctors_availability = {}
+def build_doctors_availability(schedule_data):
+    """
+    Группирует дни со свободными слотами по врачам и определяет целевую клинику.
+
+    Returns:
+        tuple: (doctors_availability, target_clinic)
+    """
+    target_clinic = None
+    doctors_availability = {}
+
+    if schedule_data.get('by_doctor'):
+        by_doctor = schedule_data['by_doctor']
+
+        for doctor_code, doctor_data in by_doctor.items():
+            doctors_availability[doctor_code] = {
+                'name': doctor_data.get('doctor_name'),
+                'department_id': doctor_data.get('department_id'),
+                'department_name': doctor_data.get('department_name'),
+                'available_dates': []
+            }
 
-        if schedule_data.get('by_doctor'):
-            by_doctor = schedule_data['by_doctor']
+            for schedule in doctor_data.get('schedules', []):
+                if schedule.get('has_free_slots', False):
+                    doctors_availability[doctor_code]['available_dates'].append({
+                        'date': schedule.get('date_iso'),
+                        'free_count': schedule.get('free_count', 0),
+                        'clinic_id': schedule.get('clinic_id'),
+                        'begin_time': schedule.get('begin_time'),
+                        'end_time': schedule.get('end_time'),
+                        'schedule_id': schedule.get('schedule_id')
+                    })
 
-            for doctor_code, doctor_data in by_doctor.items():
-                doctors_availability[doctor_code] = {
-                    'name': doctor_data.get('doctor_name'),
-                    'department_id': doctor_data.get('department_id'),
-                    'department_name': doctor_data.get('department_name'),
+                if not target_clinic and schedule.get('clinic_id'):
+                    target_clinic = schedule['clinic_id']
+    else:
+        # Обрабатываем старый формат с одним врачом
+        schedules = schedule_data.get('schedules', [])
+        if schedules:
+            first_schedule = schedules[0]
+            doctors_availability = {
+                first_schedule.get('doctor_code'): {
+                    'name': first_schedule.get('doctor_name'),
+                    'department_id': first_schedule.get('department_id'),
+                    'department_name': first_schedule.get('department_name'),
                     'available_dates': []
                 }
+            }
+
+            for schedule in schedules:
+                if schedule.get('has_free_slots', False):
+                    doctors_availability[schedule.get('doctor_code')]['available_dates'].append({
+                        'date': schedule.get('date_iso'),
+                        'free_count': schedule.get('free_count', 0),
+                        'clinic_id': schedule.get('clinic_id'),
+                        'begin_time': schedule.get('begin_time'),
+                        'end_time': schedule.get('end_time'),
+                        'schedule_id': schedule.get('schedule_id')
+                    })
+
+                if not target_clinic and schedule.get('clinic_id'):
+                    target_clinic = schedule['clinic_id']
+
+    return doctors_availability, target_clinic
+
+
+def get_cached_schedule(patient_code):
+    """
+    Получает кэшированное расписание пациента.
+    Для пациента хранится только список его врачей, сами графики берутся из общего кэша по (филиал, врач, дата).
+    """
+    try:
+        cache_key = f"schedule_{patient_code}"
+        patient_view = cache.get(cache_key)
+
+        if not patient_view:
+            logger.info(f"Кэшированное расписание для пациента {patient_code} не найдено")
+            return None
 
-                for schedule in doctor_data.get('schedules', []):
-                    if schedule.get('has_free_slots', False):
-                        doctors_availability[doctor_code]['available_dates'].append({
-                            'date': schedule.get('date_iso'),
-                            'free_count': schedule.get('free_count', 0),
-                            'clinic_id': schedule.get('clinic_id'),
-                            'begin_time': schedule.get('begin_time'),
-                            'end_time': schedule.get('end_time'),
-                            'schedule_id': schedule.get('schedule_id')
-                        })
-
-                    if not target_clinic and schedule.get('clinic_id'):
-                        target_clinic = schedule['clinic_id']
+        scope = patient_view.get('scope')
+        if scope:
+            # Графики из общего кэша: устаревшие отдаем сразу и обновляем в фоне
+            schedule_data = get_cached_doctor_scope(scope['clinic_id'], scope['doctor_code'], scope['department_id'],
+                                                    patient_view['bdate'], patient_view['fdate'])
+            if schedule_data is None:
+                logger.info(f"Графики врачей пациента {patient_code} истекли в общем кэше")
+                return None
+
+            if schedule_data.get('stale'):
+                from reminder.infoclinica_requests.schedule.doct_schedule_free import refresh_doctor_schedule_in_background
+                refresh_doctor_schedule_in_background(scope['clinic_id'], scope['doctor_code'], scope['department_id'],
+                                                      patient_view['bdate'], patient_view['fdate'])
         else:
-            # Обрабатываем старый формат с одним врачом
-            schedules = schedule_data.get('schedules', [])
-            if schedules:
-                first_schedule = schedules[0]
-                doctors_availability = {
-                    first_schedule.get('doctor_code'): {
-                        'name': first_schedule.get('doctor_name'),
-                        'department_id': first_schedule.get('department_id'),
-                        'department_name': first_schedule.get('department_name'),
-                        'available_dates': []
-                    }
-                }
+            if not is_fresh(patient_view):
+                logger.info(f"Кэшированное расписание для пациента {patient_code} устарело")
+                return None
+
+            schedules = load_doctor_schedules(patient_view['doctors'], patient_view['bdate'], patient_view['fdate'])
+            if schedules is None:
+                logger.info(f"Графики врачей пациента {patient_code} истекли в общем кэше")
+                return None
+
+            schedule_data = build_schedule_result(schedules)
+            schedule_data['date_index'] = build_date_index(schedules)
+
+        doctors_availability, target_clinic = build_doctors_availability(schedule_data)
+
+        logger.info(f"Найдено кэшированное расписание для пациента {patient_code}")
+        return {
+            'timestamp': patient_view.get('timestamp'),
+            'schedules': schedule_data['schedules'],
+            'by_doctor': schedule_data['by_doctor'],
+            'patient_code': patient_code,
+            'success': True,
+            'target_clinic': target_clinic or patient_view.get('target_clinic'),
+            'doctors_availability': doctors_availability,
+            'date_index': schedule_data['date_index']
+        }
+
+    except Exception as e:
+        logger.error(f"Ошибка при получении кэшированного расписания: {e}")
+        return None
+
+
+def cache_schedule(patient_code, schedule_data):
+    """
+    Кэширует расписание с улучшенной поддержкой нескольких врачей.
+    Графики сохраняются в общий кэш по (филиал, врач, дата), а для пациента - только список его врачей.
+    """
+    try:
+        cache_key = f"schedule_{patient_code}"
+
+        doctors_availability, target_clinic = build_doctors_availability(schedule_data)
 
-                for schedule in schedules:
-                    if schedule.get('has_free_slots', False):
-                        doctors_availability[schedule.get('doctor_code')]['available_dates'].append({
-                            'date': schedule.get('date_iso'),
-                            'free_count': schedule.get('free_count', 0),
-                            'clinic_id': schedule.get('clinic_id'),
-                            'begin_time': schedule.get('begin_time'),
-                            'end_time': schedule.get('end_time'),
-                            'schedule_id': schedule.get('schedule_id')
-                        })
-
-                    if not target_clinic and schedule.get('clinic_id'):
-                        target_clinic = schedule['clinic_id']
-
-        # Добавляем информацию о целевой клинике в кэш
-        cache_data = {
+        schedules = schedule_data.get('schedules', [])
+        dates_iso = sorted(schedule.get('date_iso') for schedule in schedules if schedule.get('date_iso'))
+        bdate_iso = schedule_data.get('bdate') or (dates_iso[0] if dates_iso else datetime.now().strftime("%Y-%m-%d"))
+        fdate_iso = schedule_data.get('fdate') or (dates_iso[-1] if dates_iso else bdate_iso)
+
+        doctors = store_doctor_schedules(schedule_data, bdate_iso, fdate_iso, default_clinic_id=target_clinic)
+
+        patient_view = {
             'timestamp': datetime.now().isoformat(),
-            'schedules': schedule_data.get('schedules', []),
-            'by_doctor': schedule_data.get('by_doctor', {}),
             'patient_code': patient_code,
-            'success': schedule_data.get('success', True),
             'target_clinic': target_clinic,
-            'doctors_availability': doctors_availability
+            'doctors': doctors,
+            'bdate': bdate_iso,
+            'fdate': fdate_iso,
+            'scope': schedule_data.get('scope'),
+            'fresh_until': time.time() + CACHE_DURATION
         }
 
-        # Устанавливаем кэш с 15-минутным истечением
-        cache.set(cache_key, cache_data, timeout=900)
+        # Данные свежие 15 минут, после этого еще STALE_DURATION отдаются с фоновым обновлением
+        cache.set(cache_key, patient_view, timeout=CACHE_DURATION + STALE_DURATION)
 
         logger.info(f"Расписание для пациента {patient_code} кэшировано на 15 минут")
         logger.info(f"Целевая клиника определена: {target_clinic}")
@@ -144,59 +574,97 @@ def check_day_has_slots_from_cache(patient_code, date_str, cached_data=None):
     if not data.get('success', False):
         return {'has_slots': False}
 
-    # Преобразуем строку даты в объект datetime
+    # Приводим дату к ISO-строке один раз - дальше сравниваются только строки
     if date_str == "today":
-        check_date = datetime.now().date()
+        date_iso = datetime.now().strftime("%Y-%m-%d")
     elif date_str == "tomorrow":
-        check_date = (datetime.now() + timedelta(days=1)).date()
+        date_iso = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
     else:
-        check_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-    # Проверяем доступность по всем врачам
-    doctors_availability = data.get('doctors_availability', {})
-
-    if doctors_availability:
-        # Проверяем в новом формате с поддержкой нескольких врачей
-        available_doctors = []
-
-        for doctor_code, doctor_data in doctors_availability.items():
-            for available_date in doctor_data.get('available_dates', []):
-                if available_date.get('date') == date_str and available_date.get('free_count', 0) > 0:
-                    available_doctors.append({
-                        'doctor_code': doctor_code,
-                        'doctor_name': doctor_data.get('name'),
-                        'department_id': doctor_data.get('department_id'),
-                        'clinic_id': available_date.get('clinic_id'),
-                        'free_count': available_date.get('free_count')
-                    })
-
-        if available_doctors:
-            # Выбираем врача с наибольшим количеством слотов
-            best_doctor = max(available_doctors, key=lambda x: x['free_count'])
-
-            return {
-                'has_slots': True,
-                'doctor_code': best_doctor['doctor_code'],
-                'doctor_name': best_doctor['doctor_name'],
-                'department_id': best_doctor['department_id'],
-                'clinic_id': best_doctor['clinic_id'],
-                'free_count': best_doctor['free_count']
-            }
-    else:
-        # Обратная совместимость со старым форматом
-        schedules = data.get('schedules', [])
-        for slot in schedules:
-            slot_date_str = slot.get('date_iso')
-            if not slot_date_str:
-                continue
-
-            slot_date = datetime.strptime(slot_date_str, "%Y-%m-%d").date()
-            if slot_date == check_date and slot.get('has_free_slots', False):
-                return {
-                    'has_slots': True,
-                    'doctor_code': slot.get('doctor_code'),
-                    'department_id': slot.get('department_id'),
-                    'clinic_id': slot.get('clinic_id')
-                }
+        date_iso = date_str
+
+    # Индекс по датам строится при записи в кэш, поэтому проверка дня - поиск по словарю
+    date_index = data.get('date_index')
+    if date_index is None:
+        date_index = build_date_index(data.get('schedules', []))
+
+    available_doctors = date_index.get(date_iso, [])
+
+    if available_doctors:
+        # Врачи отсортированы по убыванию количества свободных слотов
+        best_doctor = available_doctors[0]
+
+        return {
+            'has_slots': True,
+            'doctor_code': best_doctor['doctor_code'],
+            'doctor_name': best_doctor['doctor_name'],
+            'department_id': best_doctor['department_id'],
+            'clinic_id': best_doctor['clinic_id'],
+            'free_count': best_doctor['free_count']
+        }
 
     return {'has_slots': False}
+
+
+def _parse_hour_minute(time_str):
+    hour, minute = str(time_str).split(':')[:2]
+    return int(hour), int(minute)
+
+
+def invalidate_doctor_day(clinic_id, doctor_code, date_iso, reserved_time=None):
+    """
+    Обновляет кэш расписания врача на день после изменения записей в Инфоклинике.
+
+    Если известно зарезервированное время, оно убирается из кэшированных свободных интервалов,
+    иначе (отмена записи) интервалы дня удаляются и будут загружены заново.
+    График DOCT_SCHEDULE_FREE на этот день удаляется всегда: количество свободных мест изменилось,
+    а все пациенты этого врача при следующем обращении получат его заново.
+    """
+    intervals_key = get_doctor_intervals_cache_key(clinic_id, doctor_code, date_iso)
+    schedule_key = get_doctor_day_cache_key(clinic_id, doctor_code, date_iso)
+
+    try:
+        cached_day = cache.get(intervals_key) if reserved_time else None
+
+        if cached_day is not None:
+            reserved = _parse_hour_minute(reserved_time)
+            intervals = [interval for interval in cached_day.get('intervals', [])
+                         if _parse_hour_minute(interval['start_time']) != reserved]
+            cached_day['intervals'] = intervals
+            # Исправленная запись живет не дольше исходной свежести
+            remaining = int(cached_day.get('fresh_until', 0) - time.time())
+            if remaining > 0:
+                cache.set(intervals_key, cached_day, timeout=remaining)
+            else:
+                cache.delete(intervals_key)
+            logger.info(f"Время {reserved_time} убрано из свободных интервалов врача {doctor_code} на {date_iso}")
+        else:
+            cache.delete(intervals_key)
+
+        cache.delete(schedule_key)
+        logger.info(f"Кэш расписания врача {doctor_code} (филиал {clinic_id}) на {date_iso} обновлен")
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении кэша расписания врача {doctor_code} на {date_iso}: {e}")
+
+
+def _to_local(appointment_datetime):
+    # Время из БД приходит в UTC, а расписание Инфоклиники - в местном времени
+    if timezone.is_aware(appointment_datetime):
+        return timezone.localtime(appointment_datetime)
+    return appointment_datetime
+
+
+def on_reception_reserved(clinic_id, doctor_code, appointment_datetime):
+    """
+    Хук после успешного SCHEDULE_REC_RESERVE: занятое время больше не считается свободным.
+    """
+    appointment_datetime = _to_local(appointment_datetime)
+    invalidate_doctor_day(clinic_id, doctor_code, appointment_datetime.strftime("%Y-%m-%d"),
+                          reserved_time=appointment_datetime.strftime("%H:%M"))
+
+
+def on_reception_removed(clinic_id, doctor_code, appointment_datetime):
+    """
+    Хук после успешного SCHEDULE_REC_REMOVE (или переноса): освободившееся время должно снова появиться.
+    """
+    appointment_datetime = _to_local(appointment_datetime)
+    invalidate_doctor_day(clinic_id, doctor_code, appointment_datetime.strftime("%Y-%m-%d"))
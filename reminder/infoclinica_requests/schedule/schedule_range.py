@@ -0,0 +1,331 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+
+from reminder.infoclinica_requests.async_client import build_schedule_xml
+from reminder.infoclinica_requests.schedule.schedule_cache import (
+    get_doctor_intervals_cache_key, get_dates_in_range, is_fresh, run_single_flight, refresh_in_background
+)
+from reminder.infoclinica_requests.transport import post_xml
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней запрашивать одним SCHEDULE (совпадает с горизонтом get_patient_doctor_schedule)
+RANGE_DAYS = 7
+# Свободные интервалы меняются чаще графика врачей, поэтому храним их меньше 15 минут
+RANGE_CACHE_DURATION = 60 * 5
+# Сколько еще отдавать устаревшие интервалы, пока в фоне идет обновление
+RANGE_STALE_DURATION = 60 * 2
+
+namespace = {'ns': 'http://sdsys.ru/'}
+
+
+def _parse_xml_date(value):
+    """
+    Преобразует дату Инфоклиники (YYYYMMDD или YYYY-MM-DD) в ISO-строку.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    for date_format, length in (("%Y%m%d", 8), ("%Y-%m-%d", 10)):
+        try:
+            return datetime.strptime(value[:length], date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _find_date(element):
+    for tag in ('WDATE', 'WORKDATE'):
+        date_element = element.find(f'ns:{tag}', namespace)
+        if date_element is not None and date_element.text:
+            return _parse_xml_date(date_element.text)
+    return None
+
+
+def _parse_interval(interval):
+    """
+    Возвращает свободный интервал {'start_time', 'end_time'} или None, если интервал занят.
+    """
+    freetype = interval.find('ns:FREETYPE', namespace)
+    if freetype is None or freetype.text != '1':
+        return None
+
+    bhour = interval.find('ns:BHOUR', namespace).text
+    bmin = interval.find('ns:BMIN', namespace).text
+    fhour = interval.find('ns:FHOUR', namespace).text
+    fmin = interval.find('ns:FMIN', namespace).text
+
+    return {
+        "start_time": f"{bhour}:{bmin.zfill(2)}",
+        "end_time": f"{fhour}:{fmin.zfill(2)}"
+    }
+
+
+def _get_day(days, date_iso):
+    if date_iso not in days:
+        days[date_iso] = {'schedident': None, 'intervals': []}
+    return days[date_iso]
+
+
+def parse_schedule_range_response(root, bdate_iso, fdate_iso):
+    """
+    Разбирает ответ WEB_SCHEDULE за период в индекс по дням.
+
+    :return: (days, requires_referral, referral_message, dated)
+        days - {'YYYY-MM-DD': {'schedident': ..., 'intervals': [{'start_time', 'end_time'}, ...]}}
+        dated - False, если в многодневном ответе не удалось определить дату интервалов
+    """
+    requires_referral = False
+    referral_message = ""
+    for check in root.findall('.//ns:CHECKDATA', namespace):
+        check_code = check.find('ns:CHECKCODE', namespace)
+        check_label = check.find('ns:CHECKLABEL', namespace)
+        check_text = check.find('ns:CHECKTEXT', namespace)
+
+        if check_code is not None and check_code.text == "2":
+            if check_label is not None and check_label.text and "направлени" in check_label.text.lower():
+                requires_referral = True
+                referral_message = check_text.text if check_text is not None else "Требуется направление"
+
+    days = {}
+    dated = True
+    single_day = bdate_iso == fdate_iso
+    intervals_in_schedint = set()
+
+    # Интервалы, вложенные в SCHEDINT, берут дату из своего графика
+    for schedint in root.findall('.//ns:SCHEDINT', namespace):
+        schedint_date = _find_date(schedint) or (bdate_iso if single_day else None)
+        schedident_element = schedint.find('ns:SCHEDIDENT', namespace)
+        schedident = schedident_element.text if schedident_element is not None else None
+
+        if schedint_date:
+            day = _get_day(days, schedint_date)
+            if day['schedident'] is None:
+                day['schedident'] = schedident
+
+        for interval in schedint.findall('.//ns:INTERVAL', namespace):
+            intervals_in_schedint.add(interval)
+            interval_date = _find_date(interval) or schedint_date
+            if not interval_date:
+                dated = False
+                continue
+
+            free_interval = _parse_interval(interval)
+            if free_interval:
+                _get_day(days, interval_date)['intervals'].append(free_interval)
+
+    # Интервалы вне SCHEDINT: дата либо в самом интервале, либо запрос был на один день
+    first_schedident = None
+    first_schedint = root.find('.//ns:SCHEDINT', namespace)
+    if first_schedint is not None:
+        schedident_element = first_schedint.find('ns:SCHEDIDENT', namespace)
+        first_schedident = schedident_element.text if schedident_element is not None else None
+
+    for interval in root.findall('.//ns:INTERVAL', namespace):
+        if interval in intervals_in_schedint:
+            continue
+
+        interval_date = _find_date(interval) or (bdate_iso if single_day else None)
+        if not interval_date:
+            dated = False
+            continue
+
+        free_interval = _parse_interval(interval)
+        if free_interval:
+            day = _get_day(days, interval_date)
+            day['intervals'].append(free_interval)
+            if day['schedident'] is None:
+                day['schedident'] = first_schedident
+
+    return days, requires_referral, referral_message, dated
+
+
+def fetch_schedule_range(target_branch_id, doctor_code, start_date=None, days=RANGE_DAYS):
+    """
+    Одним запросом WEB_SCHEDULE получает свободные интервалы врача на несколько дней.
+
+    :param target_branch_id: TOFILIAL (MSH.99)
+    :param doctor_code: Код врача
+    :param start_date: Дата начала периода (date/datetime/'YYYY-MM-DD'), по умолчанию сегодня
+    :param days: Количество дней в периоде
+    :return: Словарь с индексом по дням или {'success': False, ...}
+    """
+    if start_date is None:
+        start_date = datetime.now().date()
+    elif isinstance(start_date, str):
+        start_date = datetime.strptime(start_date[:10], "%Y-%m-%d").date()
+    elif isinstance(start_date, datetime):
+        start_date = start_date.date()
+
+    end_date = start_date + timedelta(days=max(days, 1) - 1)
+    bdate_iso = start_date.strftime("%Y-%m-%d")
+    fdate_iso = end_date.strftime("%Y-%m-%d")
+
+    xml_request = build_schedule_xml(target_branch_id, doctor_code, start_date.strftime("%Y%m%d"),
+                                     end_date.strftime("%Y%m%d"))
+
+    logger.info(f"Полный XML-запрос schedule_range: \n{xml_request}")
+    logger.info(f"🔄 Запрос SCHEDULE за период {bdate_iso} - {fdate_iso}: врач {doctor_code}, TOFILIAL={target_branch_id}")
+
+    try:
+        response = post_xml(xml_request)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при запросе SCHEDULE за период: {e}")
+        return {'success': False, 'error': str(e)}
+
+    logger.info(f"Получен ответ SCHEDULE за период (status code): {response.status_code}")
+
+    if response.status_code != 200:
+        logger.error(f"❌ Ошибка SCHEDULE за период: {response.status_code}, {response.text}")
+        return {'success': False, 'error': f"HTTP {response.status_code}"}
+
+    logger.info(f"Полный ответ SCHEDULE за период: \n{response.text}")
+
+    try:
+        root = ET.fromstring(response.text)
+    except ET.ParseError as e:
+        logger.error(f"❌ Ошибка разбора XML SCHEDULE за период: {e}")
+        return {'success': False, 'error': str(e)}
+
+    days_index, requires_referral, referral_message, dated = parse_schedule_range_response(root, bdate_iso,
+                                                                                           fdate_iso)
+
+    if not dated:
+        logger.warning(f"⚠ В ответе SCHEDULE за период не найдены даты интервалов (врач {doctor_code})")
+
+    logger.info(f"✅ Получено расписание врача {doctor_code} на {len(days_index)} дн. за период "
+                f"{bdate_iso} - {fdate_iso}")
+
+    return {
+        'success': True,
+        'dated': dated,
+        'doctor_code': doctor_code,
+        'clinic_id': target_branch_id,
+        'bdate': bdate_iso,
+        'fdate': fdate_iso,
+        'requires_referral': requires_referral,
+        'referral_message': referral_message,
+        'days': days_index,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def cache_schedule_range(range_result, stale_duration=RANGE_STALE_DURATION):
+    """
+    Сохраняет свободные интервалы периода по ключам (филиал, врач, дата).
+    Дни без интервалов тоже сохраняются, чтобы повторный вопрос о них не уходил в Инфоклинику.
+    stale_duration - сколько хранить дни после окончания свежести (дольше - для прогрева перед обзвоном).
+    """
+    target_branch_id = range_result['clinic_id']
+    doctor_code = range_result['doctor_code']
+
+    cache_entries = {}
+    for date_iso in get_dates_in_range(range_result['bdate'], range_result['fdate']):
+        day = range_result['days'].get(date_iso, {'schedident': None, 'intervals': []})
+        cache_entries[get_doctor_intervals_cache_key(target_branch_id, doctor_code, date_iso)] = {
+            'schedident': day.get('schedident'),
+            'intervals': day.get('intervals', []),
+            'requires_referral': range_result.get('requires_referral', False),
+            'referral_message': range_result.get('referral_message', ""),
+            'fresh_until': time.time() + RANGE_CACHE_DURATION
+        }
+
+    try:
+        cache.set_many(cache_entries, timeout=RANGE_CACHE_DURATION + stale_duration)
+        logger.info(f"Расписание врача {doctor_code} за {range_result['bdate']} - {range_result['fdate']} "
+                    f"закэшировано на {RANGE_CACHE_DURATION} сек.")
+    except Exception as e:
+        logger.error(f"Ошибка при кэшировании расписания за период: {e}")
+
+
+def _get_range_start(requested_date):
+    """
+    Период начинается с сегодняшнего дня, если запрошенная дата в него попадает.
+    """
+    today = datetime.now().date()
+    return today if 0 <= (requested_date - today).days < RANGE_DAYS else requested_date
+
+
+def _day_result(day):
+    return {
+        'success': True,
+        'schedident': day.get('schedident'),
+        'intervals': day.get('intervals', []),
+        'requires_referral': day.get('requires_referral', False),
+        'referral_message': day.get('referral_message', "")
+    }
+
+
+def load_schedule_range(target_branch_id, doctor_code, start_date, stale_duration=RANGE_STALE_DURATION):
+    """
+    Загружает период из Инфоклиники и сохраняет его в кэш по дням.
+    Если в многодневном ответе нет дат, делается запрос SCHEDULE только на start_date.
+    """
+    range_result = fetch_schedule_range(target_branch_id, doctor_code, start_date=start_date)
+
+    if range_result.get('success') and not range_result.get('dated'):
+        range_result = fetch_schedule_range(target_branch_id, doctor_code, start_date=start_date, days=1)
+
+    if range_result.get('success'):
+        cache_schedule_range(range_result, stale_duration=stale_duration)
+
+    return range_result
+
+
+def get_day_from_range(target_branch_id, doctor_code, date_str):
+    """
+    Возвращает свободные интервалы врача на конкретный день.
+    День берется из кэша, а при промахе загружается весь период (по умолчанию с сегодняшнего дня на 7 дней),
+    чтобы следующие вопросы о соседних днях отвечались локально.
+    Устаревший день отдается сразу, а период обновляется в фоне; одновременные промахи по одному дню
+    объединяются в один запрос.
+
+    :return: Словарь {'success', 'schedident', 'intervals', 'requires_referral', 'referral_message'}
+    """
+    date_iso = date_str[:10]
+    cache_key = get_doctor_intervals_cache_key(target_branch_id, doctor_code, date_iso)
+    requested_date = datetime.strptime(date_iso, "%Y-%m-%d").date()
+
+    def read_cached_day():
+        try:
+            return cache.get(cache_key)
+        except Exception as e:
+            logger.error(f"Ошибка при получении кэша расписания за период: {e}")
+            return None
+
+    cached_day = read_cached_day()
+
+    if cached_day is not None:
+        logger.info(f"Найден кэш свободных интервалов врача {doctor_code} на {date_iso}")
+        if not is_fresh(cached_day):
+            start_date = _get_range_start(requested_date)
+            refresh_in_background(
+                get_doctor_intervals_cache_key(target_branch_id, doctor_code, f"from_{start_date}"),
+                lambda: load_schedule_range(target_branch_id, doctor_code, start_date)
+            )
+        return _day_result(cached_day)
+
+    def load_day():
+        range_result = load_schedule_range(target_branch_id, doctor_code, _get_range_start(requested_date))
+
+        if not range_result.get('success'):
+            return {'success': False, 'error': range_result.get('error')}
+
+        day = range_result['days'].get(date_iso, {'schedident': None, 'intervals': []})
+        return {
+            **day,
+            'requires_referral': range_result.get('requires_referral', False),
+            'referral_message': range_result.get('referral_message', "")
+        }
+
+    day = run_single_flight(cache_key, load_day, read_cached_day)
+
+    if day.get('success') is False:
+        return day
+
+    return _day_result(day)
@@ -6,38 +6,38 @@ import os
 import django
 import logging
 import xml.etree.ElementTree as ET
-import redis
 from datetime import datetime, time
 from django.utils import timezone
 from reminder.models import *
-from reminder.infoclinica_requests.utils import compare_times_for_redis, compare_times, redis_reception_appointment, \
-    compare_and_suggest_times
+from reminder.infoclinica_requests.utils import compare_times_for_redis, compare_times, compare_and_suggest_times
 
 load_dotenv()
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
 django.setup()
 
+from reminder.infoclinica_requests.transport import post_xml
+from reminder.infoclinica_requests.schedule.schedule_cache import on_reception_reserved, on_reception_removed
+from reminder.infoclinica_requests.schedule.slot_lease import (
+    SLOT_BOOKED_TTL_MS, renew_slot_lease, release_owner_slot
+)
+from reminder.infoclinica_requests.reference_cache import get_clinic, get_department, get_doctor
+
 logger = logging.getLogger(__name__)
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
 
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
 
-# Paths to certificates
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
 current_date_time_for_xml = datetime.now().strftime('%Y%m%d%H%M%S')
 
 
 def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj, schedident_text, free_intervals,
-                         is_reschedule=False, schedid=None):
+                         is_reschedule=False, schedid=None, slot_lease=None):
     """
     Функция резервирует время при его успешном нахождении в свободных окошках.
     Отправляет XML запрос и резервирует свободное время за клиентом.
     Исправленная версия для работы с несколькими врачами.
+
+    slot_lease - аренда слота (slot_lease.acquire_slot_lease), захваченная вызывающим кодом до запросов в Инфоклинику.
+    Сама функция слот не захватывает: после успешной записи переданная аренда продлевается на SLOT_BOOKED_TTL_MS,
+    при неудаче ее освобождает вызывающий код.
     """
     try:
         # Получаем информацию о пациенте
@@ -72,11 +72,10 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
             target_branch_id = 1
 
         # Найти доктора по doctor_id
-        doctor = None
-        try:
-            doctor = Doctor.objects.get(doctor_code=doctor_id)
+        doctor = get_doctor(doctor_id)
+        if doctor:
             logger.info(f"Найден врач: {doctor.full_name}")
-        except Doctor.DoesNotExist:
+        else:
             logger.warning(f"Врач с кодом {doctor_id} не найден")
             # Пробуем создать объект врача с минимальной информацией
             doctor = Doctor.objects.create(
@@ -86,11 +85,10 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
             logger.info(f"Создан новый врач с кодом {doctor_id}")
 
         # Найти клинику по target_branch_id
-        clinic = None
-        try:
-            clinic = Clinic.objects.get(clinic_id=target_branch_id)
+        clinic = get_clinic(target_branch_id)
+        if clinic:
             logger.info(f"Найдена клиника: {clinic.name}")
-        except Clinic.DoesNotExist:
+        else:
             logger.warning(f"Клиника с ID {target_branch_id} не найдена")
             # Пробуем создать объект клиники с минимальной информацией
             clinic = Clinic.objects.create(
@@ -124,7 +122,7 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
             # Иначе проверяем инфо о департаменте в очереди
             elif latest_queue.department_number:
                 try:
-                    department = Department.objects.filter(department_id=latest_queue.department_number).first()
+                    department = get_department(latest_queue.department_number)
                     if department:
                         logger.info(f"Получено отделение из очереди: {department.name}")
                 except Exception as e:
@@ -133,10 +131,6 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
     except Patient.DoesNotExist:
         return {'status': 'error', 'message': 'Пациент не найден.'}
 
-    headers = {
-        'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}',
-        'Content-Type': 'text/xml'
-    }
 
     logger.info(f'DATE OBJECT {date_obj}')
 
@@ -298,12 +292,7 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
         f"Отправляем запрос на резервирование: DCODE={doctor_id}, WORKDATE={workdate}, BHOUR={bhour_str}, BMIN={bmin_str}, TOFILIAL={target_branch_id}")
 
     try:
-        response = requests.post(
-            url=infoclinica_api_url,
-            headers=headers,
-            data=xml_request,
-            cert=(cert_file_path, key_file_path)
-        )
+        response = post_xml(xml_request)
 
         if response.status_code == 200:
             try:
@@ -404,9 +393,20 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
                             # Поиск существующей записи
                             old_appointment = Appointment.objects.get(appointment_id=schedid)
 
-                            # Удаление старого времени из Redis
-                            previous_appointment_time_str = old_appointment.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                            redis_client.delete(previous_appointment_time_str)
+                            # Освобождаем старый слот пациента в Redis
+                            release_owner_slot(
+                                old_appointment.clinic.clinic_id if old_appointment.clinic else target_branch_id,
+                                old_appointment.doctor.doctor_code if old_appointment.doctor else doctor_id,
+                                old_appointment.start_time,
+                                owner=patient_id
+                            )
+
+                            # Старое время освободилось - сбрасываем кэш расписания на тот день
+                            on_reception_removed(
+                                old_appointment.clinic.clinic_id if old_appointment.clinic else target_branch_id,
+                                old_appointment.doctor.doctor_code if old_appointment.doctor else doctor_id,
+                                old_appointment.start_time
+                            )
 
                             # Обновляем время и дату
                             old_appointment.start_time = date_obj
@@ -417,9 +417,11 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
                         except Appointment.DoesNotExist:
                             logger.warning(f"Запись с ID {schedid} не найдена в Appointment")
 
-                    # Заносим время и дату в Redis
-                    appointment_time_str = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-                    redis_reception_appointment(patient_id=patient_id, appointment_time=appointment_time_str)
+                    # Слот остается занятым за пациентом, пока кэши расписаний не отразят запись
+                    renew_slot_lease(slot_lease, SLOT_BOOKED_TTL_MS)
+
+                    # Занятое время убираем из кэша свободных интервалов
+                    on_reception_reserved(target_branch_id, doctor_id, date_obj)
 
                     # ИЗМЕНЕНИЕ: Используем правильный статус в зависимости от даты
                     status_code = "success_change_reception"
@@ -444,7 +446,7 @@ def schedule_rec_reserve(result_time, doctor_id, date_part, patient_id, date_obj
                     # Формируем ответ с правильным статусом и полной информацией
                     return {
                         'status': status_code,
-                        'message': f'Запись произведена успешно на {appointment_time_str}',
+                        'message': f"Запись произведена успешно на {date_obj.strftime('%Y-%m-%d %H:%M:%S')}",
                         'time': result_time.strftime('%H:%M') if isinstance(result_time, datetime) else result_time,
                         'specialist_name': doctor.full_name if doctor else "Специалист",
                         'date': format_date(appointment_date),
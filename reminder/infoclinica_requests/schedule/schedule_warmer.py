@@ -0,0 +1,137 @@
+import os
+import django
+
+# Настройки Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
+django.setup()
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+
+from reminder.infoclinica_requests.schedule.doct_schedule_free import (
+    get_schedule_filter_from_queue, get_schedule_window, request_doctor_schedule
+)
+from reminder.infoclinica_requests.schedule.schedule_range import load_schedule_range
+from reminder.models import QueueInfo
+
+logger = logging.getLogger(__name__)
+
+
+def collect_queue_schedule_filters():
+    """
+    Собирает уникальные фильтры графика (doctor_code, department_id, clinic_id) по последней очереди каждого пациента.
+    Правила выбора совпадают с get_available_doctor_by_patient, поэтому прогретые ключи кэша
+    будут использованы при обработке звонков.
+    """
+    filters = []
+    seen_patients = set()
+
+    queue_entries = QueueInfo.objects.filter(patient__isnull=False).select_related('target_branch').order_by(
+        'patient_id', '-created_at'
+    )
+
+    for queue_entry in queue_entries:
+        if queue_entry.patient_id in seen_patients:
+            continue
+        seen_patients.add(queue_entry.patient_id)
+
+        schedule_filter = get_schedule_filter_from_queue(queue_entry)
+        if schedule_filter and schedule_filter not in filters:
+            filters.append(schedule_filter)
+
+    return filters
+
+
+def _warm_doctor_schedule(schedule_filter, days_horizon):
+    """
+    Прогревает общий кэш DOCT_SCHEDULE_FREE для одного фильтра (всегда свежим запросом, минуя кэш).
+    Возвращает пары (clinic_id, doctor_code) врачей со свободными днями.
+    """
+    doctor_code, department_id, clinic_id = schedule_filter
+    try:
+        bdate_iso, fdate_iso = get_schedule_window(days_horizon)
+        result = request_doctor_schedule(clinic_id, doctor_code, department_id, bdate_iso, fdate_iso,
+                                         stale_duration=settings.SCHEDULE_WARM_RETENTION)
+        if not result or not result.get('success'):
+            logger.warning(f"⚠ Не удалось прогреть график: врач {doctor_code}, отделение {department_id}, "
+                           f"филиал {clinic_id}: {(result or {}).get('error')}")
+            return []
+
+        pairs = []
+        for schedule in result.get('schedules', []):
+            if not schedule.get('has_free_slots') or not schedule.get('doctor_code'):
+                continue
+            pair = (schedule.get('clinic_id') or clinic_id, schedule['doctor_code'])
+            if pair not in pairs:
+                pairs.append(pair)
+        return pairs
+    except Exception as e:
+        logger.error(f"❌ Ошибка прогрева графика для фильтра {schedule_filter}: {e}")
+        return []
+    finally:
+        connections.close_all()
+
+
+def _warm_doctor_intervals(pair, date_iso):
+    """
+    Прогревает кэш свободных интервалов SCHEDULE (загружается весь период с date_iso).
+    """
+    target_branch_id, doctor_code = pair
+    try:
+        start_date = datetime.strptime(date_iso, "%Y-%m-%d").date()
+        range_result = load_schedule_range(target_branch_id, doctor_code, start_date,
+                                           stale_duration=settings.SCHEDULE_WARM_RETENTION)
+        return range_result.get('success', False)
+    except Exception as e:
+        logger.error(f"❌ Ошибка прогрева интервалов врача {doctor_code} (филиал {target_branch_id}): {e}")
+        return False
+    finally:
+        connections.close_all()
+
+
+def warm_schedule_cache(days_horizon=7, max_workers=None):
+    """
+    Заранее загружает в кэш графики врачей (DOCT_SCHEDULE_FREE) и свободные интервалы (SCHEDULE)
+    для врачей и филиалов из очереди, чтобы первые звонки не ждали ответа Инфоклиники.
+    Запускается планировщиком перед отправкой обзвона в ACS. Свежими прогретые записи остаются обычный срок
+    (15 минут графики, 5 минут интервалы), но хранятся SCHEDULE_WARM_RETENTION секунд - на все окно обзвона:
+    первый звонок по врачу получает их сразу, а обновление идет в фоне (как для любых устаревших записей).
+    max_workers - число параллельных запросов, по умолчанию INFOCLINICA_MAX_CONCURRENCY.
+
+    Возвращает:
+    dict: Статистика прогрева
+    """
+    filters = collect_queue_schedule_filters()
+    if not filters:
+        logger.info("Очередь пуста, прогрев кэша графиков не требуется")
+        return {'status': 'success', 'filters': 0, 'doctors': 0, 'intervals': 0}
+
+    logger.info(f"🔄 Прогрев кэша графиков: {len(filters)} уникальных фильтров из очереди")
+
+    with ThreadPoolExecutor(max_workers=max_workers or settings.INFOCLINICA_MAX_CONCURRENCY) as executor:
+        pairs = []
+        for filter_pairs in executor.map(lambda f: _warm_doctor_schedule(f, days_horizon), filters):
+            for pair in filter_pairs:
+                if pair not in pairs:
+                    pairs.append(pair)
+
+        today_iso = datetime.now().strftime("%Y-%m-%d")
+        warmed_intervals = sum(executor.map(lambda p: _warm_doctor_intervals(p, today_iso), pairs))
+
+    logger.info(f"✅ Прогрев кэша завершен: фильтров {len(filters)}, врачей {len(pairs)}, "
+                f"интервалы загружены для {warmed_intervals}")
+
+    return {
+        'status': 'success',
+        'filters': len(filters),
+        'doctors': len(pairs),
+        'intervals': warmed_intervals
+    }
+
+
+if __name__ == "__main__":
+    print(warm_schedule_cache())
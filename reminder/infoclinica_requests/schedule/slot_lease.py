@@ -0,0 +1,145 @@
+import logging
+import threading
+import uuid
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Сколько слот удерживается за звонком, пока идет резервирование в Инфоклинике, мс
+SLOT_LEASE_TTL_MS = 60 * 1000
+# Сколько слот остается занятым после успешной записи, пока кэши расписаний не обновились (как раньше в Redis), мс
+SLOT_BOOKED_TTL_MS = 5 * 60 * 1000
+
+# Продление и снятие - только владельцем: сравнение токена и действие выполняются атомарно на стороне Redis
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_redis_client = None
+_redis_client_lock = threading.Lock()
+
+
+def get_redis_client():
+    """
+    Клиент Redis для аренды слотов, общий для процесса (внутри - пул соединений).
+    """
+    global _redis_client
+
+    if _redis_client is None:
+        with _redis_client_lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    password=settings.REDIS_PASSWORD or None,
+                    decode_responses=True,
+                )
+
+    return _redis_client
+
+
+def get_slot_key(clinic_id, doctor_code, slot_datetime):
+    """
+    Ключ слота: филиал, врач и время приема с точностью до минуты (время филиала).
+    """
+    if timezone.is_aware(slot_datetime):
+        slot_datetime = timezone.localtime(slot_datetime)
+    return f"slot_lease:{clinic_id}:{doctor_code}:{slot_datetime.strftime('%Y%m%d%H%M')}"
+
+
+def _owner_prefix(owner):
+    return f"{owner}:"
+
+
+def acquire_slot_lease(clinic_id, doctor_code, slot_datetime, owner, ttl_ms=SLOT_LEASE_TTL_MS):
+    """
+    Захватывает слот (clinic_id, doctor_code, slot_datetime) за владельцем (код пациента) через SET NX PX.
+    Если слот уже удерживает тот же владелец (повторный запрос того же звонка), аренда продлевается.
+
+    Возвращает:
+    dict: {'key', 'token'} - аренда для renew_slot_lease/release_slot_lease, или None, если слот занят другим
+    """
+    key = get_slot_key(clinic_id, doctor_code, slot_datetime)
+    token = f"{_owner_prefix(owner)}{uuid.uuid4().hex}"
+
+    try:
+        client = get_redis_client()
+        if client.set(key, token, nx=True, px=ttl_ms):
+            logger.info(f"✅ Слот {key} захвачен пациентом {owner}")
+            return {'key': key, 'token': token}
+
+        current_token = client.get(key)
+        if current_token and current_token.startswith(_owner_prefix(owner)):
+            lease = {'key': key, 'token': current_token}
+            if renew_slot_lease(lease, ttl_ms):
+                logger.info(f"🔄 Слот {key} уже удерживается пациентом {owner}, аренда продлена")
+                return lease
+
+        logger.info(f"⚠ Слот {key} занят другим звонком ({current_token})")
+        return None
+    except redis.RedisError as e:
+        # Redis недоступен - не блокируем запись, конфликт при необходимости отклонит Инфоклиника
+        logger.error(f"Ошибка при захвате слота {key}: {e}")
+        return {'key': key, 'token': token}
+
+
+def renew_slot_lease(lease, ttl_ms=SLOT_LEASE_TTL_MS):
+    """
+    Продлевает аренду слота, если она все еще принадлежит владельцу токена.
+    """
+    if not lease:
+        return False
+
+    try:
+        return bool(get_redis_client().eval(_RENEW_SCRIPT, 1, lease['key'], lease['token'], ttl_ms))
+    except redis.RedisError as e:
+        logger.error(f"Ошибка при продлении аренды слота {lease['key']}: {e}")
+        return False
+
+
+def release_slot_lease(lease):
+    """
+    Освобождает слот, если аренда все еще принадлежит владельцу токена.
+    """
+    if not lease:
+        return False
+
+    try:
+        released = bool(get_redis_client().eval(_RELEASE_SCRIPT, 1, lease['key'], lease['token']))
+        if released:
+            logger.info(f"ℹ️ Слот {lease['key']} освобожден")
+        return released
+    except redis.RedisError as e:
+        logger.error(f"Ошибка при освобождении слота {lease['key']}: {e}")
+        return False
+
+
+def release_owner_slot(clinic_id, doctor_code, slot_datetime, owner):
+    """
+    Освобождает слот, удерживаемый владельцем без сохраненного токена (например, старое время при переносе записи).
+    """
+    key = get_slot_key(clinic_id, doctor_code, slot_datetime)
+
+    try:
+        current_token = get_redis_client().get(key)
+    except redis.RedisError as e:
+        logger.error(f"Ошибка при чтении аренды слота {key}: {e}")
+        return False
+
+    if not current_token or not current_token.startswith(_owner_prefix(owner)):
+        return False
+
+    return release_slot_lease({'key': key, 'token': current_token})
@@ -1,6 +1,5 @@
 import logging
 import pytz
-import requests
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, time as dt_time
 from django.http import JsonResponse
@@ -15,21 +14,15 @@ from django.utils.timezone import make_aware
 from reminder.infoclinica_requests.schedule.doct_schedule_free import get_patient_doctor_schedule, \
     select_best_doctor_from_schedules, check_day_has_slots_from_cache
 from reminder.infoclinica_requests.schedule.schedule_cache import get_cached_schedule, cache_schedule
+from reminder.infoclinica_requests.schedule.schedule_range import get_day_from_range
+from reminder.infoclinica_requests.reference_cache import get_clinic, get_doctor
 
 # Загрузка переменных окружения и настройка логирования
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 # Загрузка конфигурации из переменных окружения
-infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
-infoclinica_x_forwarded_host = os.getenv('INFOCLINICA_HOST')
-
-# Paths to certificates
-base_dir = os.path.dirname(os.path.abspath(__file__))
-certs_dir = os.path.join(base_dir, 'certs')
-os.makedirs(certs_dir, exist_ok=True)
-cert_file_path = os.path.join(certs_dir, 'cert.pem')
-key_file_path = os.path.join(certs_dir, 'key.pem')
+
 current_date_time_for_xml = datetime.now().strftime('%Y%m%d%H%M%S')
 
 
@@ -38,7 +31,6 @@ def which_time_in_certain_day(patient_code, date_time):
     Обработка запроса для получения доступных интервалов на определенный день.
     Модифицирована для правильного использования TOFILIAL и обработки ограничений.
     """
-    global doctor_name
     logger.info(
         f"Я в функции which_time_in_certain_day\nПришедшие данные: \npatient_code: {patient_code}\ndate_time: {date_time}")
 
@@ -98,11 +90,8 @@ def which_time_in_certain_day(patient_code, date_time):
                 target_branch_id = cache_check.get('clinic_id')
 
                 # Получаем имя врача
-                try:
-                    doc = Doctor.objects.get(doctor_code=doctor_code)
-                    doctor_name = doc.full_name
-                except Doctor.DoesNotExist:
-                    doctor_name = f"Врач {doctor_code}"
+                doc = get_doctor(doctor_code)
+                doctor_name = doc.full_name if doc else f"Врач {doctor_code}"
 
                 logger.info(f"✅ Из кэша выбран врач: {doctor_name} (ID: {doctor_code}), отделение: {department_id}")
             else:
@@ -129,11 +118,8 @@ def which_time_in_certain_day(patient_code, date_time):
                     target_branch_id = cache_check.get('clinic_id')
 
                     # Получаем имя врача
-                    try:
-                        doc = Doctor.objects.get(doctor_code=doctor_code)
-                        doctor_name = doc.full_name
-                    except Doctor.DoesNotExist:
-                        doctor_name = f"Врач {doctor_code}"
+                    doc = get_doctor(doctor_code)
+                    doctor_name = doc.full_name if doc else f"Врач {doctor_code}"
 
                     logger.info(
                         f"✅ Из свежих данных выбран врач: {doctor_name} (ID: {doctor_code}), отделение: {department_id}")
@@ -228,67 +214,20 @@ def which_time_in_certain_day(patient_code, date_time):
         response_status = 'which_time'
         day_for_return = 'null'
 
-    # XML-запрос для получения расписания с использованием TOFILIAL в MSH.99
-    xml_request = f'''
-    <WEB_SCHEDULE xmlns="http://sdsys.ru/">
-      <MSH>
-        <MSH.3></MSH.3>
-        <MSH.7>
-          <TS.1>{datetime.now().strftime('%Y%m%d%H%M')}</TS.1>
-        </MSH.7>
-        <MSH.9>
-          <MSG.1>WEB</MSG.1>
-          <MSG.2>SCHEDULE</MSG.2>
-        </MSH.9>
-        <MSH.10>f2e89dbc1e813cb680d2f847</MSH.10>
-        <MSH.18>UTF-8</MSH.18>
-        <MSH.99>{target_branch_id}</MSH.99>
-      </MSH>
-      <SCHEDULE_IN>
-        <INDOCTLIST>{doctor_code}</INDOCTLIST>
-        <BDATE>{date_time_obj.strftime('%Y%m%d')}</BDATE>
-        <FDATE>{date_time_obj.strftime('%Y%m%d')}</FDATE>
-        <EXTINTERV>30</EXTINTERV>
-        <SCHLIST/>
-      </SCHEDULE_IN>
-    </WEB_SCHEDULE>
-    '''
-
-    logger.info(f"Полный XML-запрос which_time_in_certain_day: \n{xml_request}")
+    # Свободные интервалы берем из индекса по дням: один запрос SCHEDULE покрывает 7 дней,
+    # поэтому последующие вопросы о других днях отвечаются без обращения к Инфоклинике
+    date_iso = date_time_obj.strftime('%Y-%m-%d')
     logger.info(
-        f"Отправка запроса с TOFILIAL={target_branch_id}, doctor_code={doctor_code}, date={date_time_obj.strftime('%Y%m%d')}")
-
-    # Выполнение POST-запроса
-    response = requests.post(
-        url=infoclinica_api_url,
-        headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}', 'Content-Type': 'text/xml'},
-        data=xml_request,
-        cert=(cert_file_path, key_file_path)
-    )
-
-    # Проверка на ошибки и вывод ответа сервера
-    logger.info(f"Получен ответ SCHEDULE (status code): {response.status_code}")
+        f"Получение расписания с TOFILIAL={target_branch_id}, doctor_code={doctor_code}, date={date_iso}")
 
-    if response.status_code == 200:
-        logger.info(f"Полный ответ SCHEDULE: \n{response.text}")
-
-        root = ET.fromstring(response.text)
-        namespace = {'ns': 'http://sdsys.ru/'}
+    day_schedule = get_day_from_range(target_branch_id, doctor_code, date_iso)
 
+    if day_schedule.get('success'):
         # Проверяем, требуется ли направление
-        requires_referral = False
-        referral_message = ""
-        check_data = root.findall('.//ns:CHECKDATA', namespace)
-        for check in check_data:
-            check_code = check.find('ns:CHECKCODE', namespace)
-            check_label = check.find('ns:CHECKLABEL', namespace)
-            check_text = check.find('ns:CHECKTEXT', namespace)
-
-            if check_code is not None and check_code.text == "2":
-                if check_label is not None and "направлени" in check_label.text.lower():
-                    requires_referral = True
-                    referral_message = check_text.text if check_text is not None else "Требуется направление"
-                    logger.warning(f"Для врача {doctor_code} требуется направление: {referral_message}")
+        requires_referral = day_schedule.get('requires_referral', False)
+        referral_message = day_schedule.get('referral_message', "")
+        if requires_referral:
+            logger.warning(f"Для врача {doctor_code} требуется направление: {referral_message}")
 
         # Если требуется направление, нужно попробовать другого врача
         if requires_referral:
@@ -328,52 +267,19 @@ def which_time_in_certain_day(patient_code, date_time):
 
                         # Если этот врач не требует направление, используем его
                         if not requires_referral_alt:
-                            doctor_code = alt_doctor_code
-                            doctor_name = doctor_data.get('doctor_name', f"Врач {alt_doctor_code}")
-                            department_id = doctor_data.get('department_id')
                             logger.info(
-                                f"✅ Найден альтернативный врач, не требующий направления: {doctor_name} (ID: {doctor_code})")
-
-                            # Обновляем XML-запрос с новым врачом
-                            xml_request = f'''
-                            <WEB_SCHEDULE xmlns="http://sdsys.ru/">
-                              <MSH>
-                                <MSH.3></MSH.3>
-                                <MSH.7>
-                                  <TS.1>{datetime.now().strftime('%Y%m%d%H%M')}</TS.1>
-                                </MSH.7>
-                                <MSH.9>
-                                  <MSG.1>WEB</MSG.1>
-                                  <MSG.2>SCHEDULE</MSG.2>
-                                </MSH.9>
-                                <MSH.10>f2e89dbc1e813cb680d2f847</MSH.10>
-                                <MSH.18>UTF-8</MSH.18>
-                                <MSH.99>{target_branch_id}</MSH.99>
-                              </MSH>
-                              <SCHEDULE_IN>
-                                <INDOCTLIST>{doctor_code}</INDOCTLIST>
-                                <BDATE>{date_time_obj.strftime('%Y%m%d')}</BDATE>
-                                <FDATE>{date_time_obj.strftime('%Y%m%d')}</FDATE>
-                                <EXTINTERV>30</EXTINTERV>
-                                <SCHLIST/>
-                              </SCHEDULE_IN>
-                            </WEB_SCHEDULE>
-                            '''
-
-                            logger.info(f"Повторный запрос с альтернативным врачом: \n{xml_request}")
-
-                            # Выполняем новый запрос с альтернативным врачом
-                            response = requests.post(
-                                url=infoclinica_api_url,
-                                headers={'X-Forwarded-Host': f'{infoclinica_x_forwarded_host}',
-                                         'Content-Type': 'text/xml'},
-                                data=xml_request,
-                                cert=(cert_file_path, key_file_path)
-                            )
-
-                            if response.status_code == 200:
-                                logger.info(f"Получен ответ для альтернативного врача: {response.status_code}")
-                                root = ET.fromstring(response.text)
+                                f"✅ Найден альтернативный врач, не требующий направления: "
+                                f"{doctor_data.get('doctor_name', f'Врач {alt_doctor_code}')} (ID: {alt_doctor_code})")
+
+                            # Получаем расписание альтернативного врача
+                            alt_day_schedule = get_day_from_range(target_branch_id, alt_doctor_code, date_iso)
+
+                            if alt_day_schedule.get('success'):
+                                logger.info(f"Получено расписание альтернативного врача {alt_doctor_code}")
+                                doctor_code = alt_doctor_code
+                                doctor_name = doctor_data.get('doctor_name', f"Врач {alt_doctor_code}")
+                                department_id = doctor_data.get('department_id')
+                                day_schedule = alt_day_schedule
                                 tried_alternate_doctor = True
                                 requires_referral = False
                                 break
@@ -386,25 +292,8 @@ def which_time_in_certain_day(patient_code, date_time):
                 logger.warning(f"Не удалось получить список доступных врачей, продолжаем с текущим")
                 # Продолжаем обработку ниже с предупреждением
 
-        free_time_intervals = []
-        schedint = root.find('.//ns:SCHEDINT', namespace)
-        schedident_text = schedint.find('ns:SCHEDIDENT', namespace).text if schedint is not None else None
-
-        for interval in root.findall('.//ns:INTERVAL', namespace):
-            bhour = interval.find('ns:BHOUR', namespace).text
-            bmin = interval.find('ns:BMIN', namespace).text
-            fhour = interval.find('ns:FHOUR', namespace).text
-            fmin = interval.find('ns:FMIN', namespace).text
-            freetype = interval.find('ns:FREETYPE', namespace).text
-
-            # Выводим данные перед добавлением в список
-            logger.info(
-                f"Parsed interval: BHOUR={bhour}, BMIN={bmin}, FHOUR={fhour}, FMIN={fmin}, FREETYPE={freetype}")
-
-            if freetype == '1':  # Только свободные интервалы
-                start_time = f"{bhour}:{bmin.zfill(2)}"
-                end_time = f"{fhour}:{fmin.zfill(2)}"
-                free_time_intervals.append({"start_time": start_time, "end_time": end_time})
+        schedident_text = day_schedule.get('schedident')
+        free_time_intervals = day_schedule.get('intervals', [])
 
         logger.info("Свободные интервалы в формате JSON:")
         logger.info(free_time_intervals)
@@ -423,27 +312,28 @@ def which_time_in_certain_day(patient_code, date_time):
 
         # Получаем объект врача если есть doctor_code
         if doctor_code:
-            try:
-                doctor_obj = Doctor.objects.get(doctor_code=doctor_code)
-            except Doctor.DoesNotExist:
-                # Если врач не существует в БД, создадим его запись
-                doctor_obj = Doctor.objects.create(
+            doctor_obj = get_doctor(doctor_code)
+            if doctor_obj is None:
+                # Если врач не существует в БД, создадим его запись.
+                # get_or_create: запросы на сегодня и завтра выполняются параллельно и могут создавать того же врача
+                doctor_obj, created = Doctor.objects.get_or_create(
                     doctor_code=doctor_code,
-                    full_name=doctor_name if doctor_name else f"Врач {doctor_code}"
+                    defaults={'full_name': doctor_name if doctor_name else f"Врач {doctor_code}"}
                 )
-                logger.info(f"Создан новый врач в БД: {doctor_obj.full_name} (ID: {doctor_code})")
+                if created:
+                    logger.info(f"Создан новый врач в БД: {doctor_obj.full_name} (ID: {doctor_code})")
 
         # Получаем объект клиники по target_branch_id
         if target_branch_id:
-            try:
-                clinic_obj = Clinic.objects.get(clinic_id=target_branch_id)
-            except Clinic.DoesNotExist:
-                # Если клиника не существует, создадим её запись
-                clinic_obj = Clinic.objects.create(
+            clinic_obj = get_clinic(target_branch_id)
+            if clinic_obj is None:
+                # Если клиника не существует, создадим её запись (так же, как врача, - через get_or_create)
+                clinic_obj, created = Clinic.objects.get_or_create(
                     clinic_id=target_branch_id,
-                    name=f"Клиника {target_branch_id}"
+                    defaults={'name': f"Клиника {target_branch_id}"}
                 )
-                logger.info(f"Создана новая клиника в БД: ID {target_branch_id}")
+                if created:
+                    logger.info(f"Создана новая клиника в БД: ID {target_branch_id}")
 
         for interval in free_time_intervals:
             time_str = interval["start_time"]
@@ -534,11 +424,10 @@ def which_time_in_certain_day(patient_code, date_time):
 
         return JsonResponse(response)
     else:
-        logger.error(f'Ошибка при запросе: {response.status_code}')
-        logger.error(f'Ответ сервера: {response.text}')
+        logger.error(f"Ошибка при запросе: {day_schedule.get('error')}")
         return JsonResponse({
             'status': 'error',
-            'message': f'Ошибка при запросе: {response.status_code}'
+            'message': f"Ошибка при запросе: {day_schedule.get('error')}"
         })
 
 
@@ -0,0 +1,127 @@
+import os
+import ssl
+import logging
+import threading
+
+import certifi
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Сертификаты по умолчанию лежат рядом с модулем, их можно переопределить через INFOCLINICA_CERT/INFOCLINICA_KEY
+base_dir = os.path.dirname(os.path.abspath(__file__))
+certs_dir = os.path.join(base_dir, 'certs')
+cert_file_path = settings.INFOCLINICA_CERT or os.path.join(certs_dir, 'cert.pem')
+key_file_path = settings.INFOCLINICA_KEY or os.path.join(certs_dir, 'key.pem')
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class InfoClinicaAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, который использует заранее подготовленный SSL-контекст с клиентским сертификатом.
+    Сертификат читается с диска один раз, а не при каждом новом соединении.
+    """
+
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def build_ssl_context():
+    """
+    Создает SSL-контекст для mTLS с Инфоклиникой: проверка сервера по certifi и клиентский сертификат.
+    """
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    ssl_context.load_cert_chain(certfile=cert_file_path, keyfile=key_file_path)
+    return ssl_context
+
+
+def get_timeout():
+    """
+    Возвращает кортеж (connect, read) таймаутов из настроек.
+    """
+    return settings.INFOCLINICA_CONNECT_TIMEOUT, settings.INFOCLINICA_READ_TIMEOUT
+
+
+def _create_session():
+    session = requests.Session()
+    session.headers.update({
+        'X-Forwarded-Host': f'{settings.INFOCLINICA_HOST}',
+        'Content-Type': 'text/xml',
+        'Connection': 'keep-alive',
+    })
+
+    pool_size = settings.INFOCLINICA_POOL_SIZE
+    adapter = InfoClinicaAdapter(
+        ssl_context=build_ssl_context(),
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        # Повторяем только неудачную установку соединения: POST-запросы (например, резервирование) не идемпотентны
+        max_retries=Retry(total=1, connect=1, read=0, redirect=0, status=0),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    logger.info(f"Создан пул соединений к Инфоклинике (размер пула: {pool_size})")
+    return session
+
+
+def get_session():
+    """
+    Возвращает общую для процесса сессию Инфоклиники с пулом keep-alive соединений.
+    После fork (gunicorn/celery) сессия создается заново, чтобы не делить сокеты между процессами.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = _create_session()
+            _session_pid = pid
+
+    return _session
+
+
+def close_session():
+    """
+    Закрывает общую сессию и все соединения пула.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def post_xml(xml_request, timeout=None):
+    """
+    Отправляет XML-запрос в Инфоклинику через общий пул соединений.
+
+    :param xml_request: Тело XML-запроса
+    :param timeout: Таймаут (connect, read); по умолчанию берется из настроек
+    :return: requests.Response
+    """
+    return get_session().post(
+        url=settings.INFOCLINICA_BASE_URL,
+        data=xml_request.encode('utf-8') if isinstance(xml_request, str) else xml_request,
+        timeout=timeout or get_timeout(),
+    )
@@ -22,7 +22,6 @@ import json
 import time
 import django
 import pytz
-import redis
 import uuid
 import base64
 import re
@@ -60,9 +59,6 @@ infoclinica_api_url = os.getenv('INFOCLINICA_BASE_URL')
 
 current_date_time_for_xml = datetime.now().strftime('%Y%m%d%H%M%S')
 
-# Соединение с Redis
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
-
 
 def normalize_time_for_receptions(free_intervals):
     """
@@ -381,27 +377,6 @@ def compare_and_suggest_times(free_intervals, user_time, user_date):
     return available_times
 
 
-def redis_reception_appointment(patient_id, appointment_time):
-    """
-    Функция выполняет резервацию времени при записи, на 15 минут в Redis для избежания конфликтов по времени,
-    когда несколько клиентов хотят записаться на одно и то же время во время звонков
-
-    :param patient_id:
-    :param appointment_time:
-    :return:
-    """
-
-    if redis_client.exists(appointment_time):
-        logger.info('Время уже занято')
-        result_redis = 0
-        return result_redis
-    else:
-        redis_client.set(appointment_time, patient_id, ex=300)
-        logger.info('Запись произведена на 5 минут')
-        result_redis = 1
-        return result_redis
-
-
 def format_russian_date(date_obj):
     # Создаем словарь для русских названий месяцев
     months = {
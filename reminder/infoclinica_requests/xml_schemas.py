@@ -0,0 +1,202 @@
+import logging
+from datetime import datetime
+
+from django.utils.dateparse import parse_date
+
+from reminder.infoclinica_requests.xml_stream import INFOCLINICA_NS
+
+logger = logging.getLogger(__name__)
+
+
+# Конвертеры значений полей
+
+def to_text(value):
+    return value
+
+
+def to_stripped(value):
+    return value.strip()
+
+
+def to_int_or_text(value):
+    """
+    Число, а если значение не числовое - исходный текст (как раньше в разборе графика).
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def to_flag(value):
+    return value == "1"
+
+
+def to_date(value):
+    """
+    Дата Инфоклиники: 'YYYYMMDD' или ISO 'YYYY-MM-DD'. Нераспознанное значение дает None.
+    """
+    if len(value) == 8 and value.isdigit():
+        return datetime.strptime(value, "%Y%m%d").date()
+    return parse_date(value[:10])
+
+
+def compile_schema(fields):
+    """
+    Компилирует описание полей {XML_ТЕГ: (имя_поля, конвертер)} в функцию извлечения.
+
+    Функция принимает элемент ElementTree или словарь записи из xml_stream.iter_records
+    и за один проход по дочерним тегам возвращает {имя_поля: значение}.
+    В результат попадают только присутствующие непустые теги; ошибка конвертера пишется в лог, поле пропускается.
+    """
+    by_local_tag = dict(fields)
+    # Для элементов ElementTree сразу ищем по полному имени тега, без отрезания namespace
+    by_tag = {**by_local_tag, **{f"{{{INFOCLINICA_NS}}}{tag}": spec for tag, spec in by_local_tag.items()}}
+
+    def extract(source):
+        if isinstance(source, dict):
+            items = ((by_local_tag.get(tag), value) for tag, value in source.items())
+        else:
+            items = ((by_tag.get(child.tag), child.text) for child in source)
+
+        values = {}
+        for spec, value in items:
+            if spec is None or not value:
+                continue
+
+            field_name, converter = spec
+            if field_name in values:
+                continue
+
+            try:
+                values[field_name] = converter(value)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"❗ Ошибка при обработке поля {field_name}: {e}")
+
+        return values
+
+    extract.fields = by_local_tag
+    return extract
+
+
+SCHEMAS = {}
+
+
+def register_schema(record_tag, fields):
+    """
+    Регистрирует схему для записи record_tag и возвращает скомпилированную функцию извлечения.
+    """
+    SCHEMAS[record_tag] = compile_schema(fields)
+    return SCHEMAS[record_tag]
+
+
+def extract_fields(record_tag, source):
+    """
+    Извлекает поля записи record_tag (элемент или словарь iter_records) по зарегистрированной схеме.
+    """
+    return SCHEMAS[record_tag](source)
+
+
+# DOCT_SCHEDULE_FREE: интервал графика врача
+register_schema('SCHINTERVAL', {
+    'SCHEDIDENT': ('schedule_id', to_int_or_text),
+    'DCODE': ('doctor_code', to_int_or_text),
+    'DNAME': ('doctor_name', to_text),
+    'DEPNUM': ('department_id', to_int_or_text),
+    'DEPNAME': ('department_name', to_text),
+    'FILIAL': ('clinic_id', to_int_or_text),
+    'FNAME': ('clinic_name', to_text),
+    'TIMEZONE': ('timezone', to_int_or_text),
+    'WDATE': ('date', to_text),
+    'BEGHOUR': ('begin_hour', to_int_or_text),
+    'BEGMIN': ('begin_min', to_int_or_text),
+    'ENDHOUR': ('end_hour', to_int_or_text),
+    'ENDMIN': ('end_min', to_int_or_text),
+    'RNUM': ('room_num', to_text),
+    'RFLOOR': ('room_floor', to_text),
+    'RBUILDING': ('room_building', to_text),
+    'FREEFLAG': ('free_flag', to_int_or_text),
+    'FREECOUNT': ('free_count', to_int_or_text),
+    'ONLINEMODE': ('online_mode', to_int_or_text),
+})
+
+# Ограничения интервала графика
+register_schema('CHECKDATA', {
+    'CHECKCODE': ('check_code', to_text),
+    'CHECKLABEL': ('check_label', to_text),
+    'CHECKTEXT': ('check_text', to_text),
+})
+
+# QUEUE_LIST / CLIENT_INFO: запись очереди
+register_schema('QUEUE_INFO', {
+    'QUEUEID': ('queue_id', int),
+    'PCODE': ('patient_code', int),
+    'ADDID': ('reason_id', int),
+    'ADDNAME': ('reason_name', to_text),
+    'FILIAL': ('branch_id', int),
+    'FILIALNAME': ('branch_name', to_text),
+    'TOFILIAL': ('target_branch_id', int),
+    'TOFILIALNAME': ('target_branch_name', to_stripped),
+    'DCODE': ('doctor_code', int),
+    'DNAME': ('doctor_name', to_text),
+    'DEPNUM': ('department_number', int),
+    'DEPNAME': ('department_name', to_text),
+    'CURRENTSTATE': ('current_state', int),
+    'CURRENTSTATENAME': ('current_state_name', to_text),
+    'DEFAULTNEXTSTATE': ('default_next_state', int),
+    'DEFAULTNEXTSTATENAME': ('default_next_state_name', to_text),
+    'CONTACTBDATE': ('contact_start_date', to_date),
+    'CONTACTFDATE': ('contact_end_date', to_date),
+    'ACTIONBDATE': ('desired_start_date', to_date),
+    'ACTIONFDATE': ('desired_end_date', to_date),
+})
+
+# Вариант действия по записи очереди
+register_schema('QUEUE_CONTACT_INFO', {
+    'NEXTSTATE': ('next_state', int),
+    'NEXTSTATENAME': ('next_state_name', to_text),
+    'PARENTACTIONID': ('parent_action_id', int),
+    'NEXTDCODE': ('next_dcode', int),
+    'NEXTDNAME': ('next_dname', to_text),
+    'NEXTCALLDATETIME': ('next_call_datetime', to_date),
+})
+
+# CLIENT_INFO: основные данные пациента
+register_schema('CLIENT_MAININFO', {
+    'PCODE': ('patient_code', int),
+    'PNAME': ('full_name', to_text),
+    'PADDR': ('address', to_text),
+    'PPHONE': ('phone_mobile', to_text),
+    'PMAIL': ('email', to_text),
+    'GENDER': ('gender', int),
+    'BDATE': ('birth_date', to_date),
+})
+
+# GET_FILIAL_LIST: филиал
+register_schema('GETFILIALLIST', {
+    'FILIAL': ('clinic_id', int),
+    'FNAME': ('name', to_text),
+    'FADDR': ('address', to_text),
+    'FPHONE': ('phone', to_text),
+    'FMAIL': ('email', to_text),
+    'TIMEZONE': ('timezone', int),
+    'VIEWINWEB_OUT': ('view_in_web', to_flag),
+    'WORKHOURS': ('work_hours', to_text),
+})
+
+# GET_DEPARTMENT_LIST: отделение
+register_schema('GETDEPARTMENTLIST', {
+    'DEPNUM': ('department_id', int),
+    'DEPNAME': ('name', to_text),
+    'DEPGRPNAME': ('group_name', to_text),
+    'VIEWINWEB_OUT': ('view_in_web', to_flag),
+    'MEDIAID': ('media_id', to_text),
+    'ISFAVORITE': ('is_favorite', to_flag),
+    'COMMENT': ('comment', to_text),
+})
+
+# REFERENCE: запись справочника
+register_schema('REC', {
+    'RECID': ('rec_id', int),
+    'RECNAME': ('rec_name', to_stripped),
+})
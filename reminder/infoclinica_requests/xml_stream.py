@@ -0,0 +1,108 @@
+import logging
+from itertools import chain
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+INFOCLINICA_NS = 'http://sdsys.ru/'
+
+# Размер порции, которой ответ подается в парсер
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def local_name(tag):
+    """
+    Возвращает имя тега без namespace: '{http://sdsys.ru/}PCODE' -> 'PCODE'.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _iter_chunks(xml_source, chunk_size):
+    """
+    Делит ответ на порции. Принимает str/bytes (response.text, response.content)
+    или итерируемый источник порций (response.iter_content()).
+    """
+    if isinstance(xml_source, (str, bytes)):
+        for start in range(0, len(xml_source), chunk_size):
+            yield xml_source[start:start + chunk_size]
+    else:
+        for chunk in xml_source:
+            if chunk:
+                yield chunk
+
+
+def element_to_record(element):
+    """
+    Превращает элемент записи в словарь {ИМЯ_ПОЛЯ: текст}.
+    Поле присутствует в словаре, только если тег был в ответе (как и find() is not None); пустой тег дает None.
+    Вложенные блоки с дочерними тегами (например, CHECKDATA) собираются списками словарей по имени блока
+    на любой глубине, как при поиске './/ns:CHECKDATA'.
+    """
+    record = {}
+
+    for child in element:
+        if len(child):
+            continue
+        record.setdefault(local_name(child.tag), child.text)
+
+    for nested in element.iter():
+        if nested is element or not len(nested):
+            continue
+        nested_record = {}
+        for child in nested:
+            if not len(child):
+                nested_record.setdefault(local_name(child.tag), child.text)
+        record.setdefault(local_name(nested.tag), []).append(nested_record)
+
+    return record
+
+
+def iter_records(xml_source, record_tag, header=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Потоково разбирает XML-ответ Инфоклиники и по одной выдает записи record_tag (QUEUE_INFO, SCHINTERVAL, ...)
+    в виде словарей element_to_record. Дерево целиком не строится: каждая запись удаляется сразу после обработки,
+    поэтому память не растет с размером ответа.
+
+    header - необязательный словарь, в который собираются простые поля вне записей
+    (MSA.1, SPRESULT, SPCOMMENT, CWE.2 ...); для каждого имени сохраняется первое значение.
+    Заполняется по ходу разбора, окончательно - после исчерпания генератора.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    stack = []
+    containers = set()  # id элементов вне записей, у которых были дочерние теги
+    record_depth = None
+
+    # None в конце - сигнал закрыть парсер и забрать последние события
+    for chunk in chain(_iter_chunks(xml_source, chunk_size), [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+
+        for event, element in parser.read_events():
+            if event == 'start':
+                if stack and record_depth is None:
+                    containers.add(id(stack[-1]))
+                stack.append(element)
+                if record_depth is None and local_name(element.tag) == record_tag:
+                    record_depth = len(stack)
+                continue
+
+            stack.pop()
+
+            if record_depth is not None:
+                if len(stack) + 1 > record_depth:
+                    # Тег внутри записи - освобождается вместе с записью
+                    continue
+
+                record_depth = None
+                yield element_to_record(element)
+            elif id(element) in containers:
+                containers.discard(id(element))
+            elif header is not None:
+                header.setdefault(local_name(element.tag), element.text)
+
+            # Освобождаем обработанный элемент, чтобы родитель не накапливал потомков
+            element.clear()
+            if stack:
+                stack[-1].remove(element)
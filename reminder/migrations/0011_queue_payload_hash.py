@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminder', '0010_alter_patientdoctorassociation_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='client_info_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Хэш последнего ответа CLIENT_INFO'),
+        ),
+        migrations.AddField(
+            model_name='queueinfo',
+            name='payload_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Хэш записи QUEUE_INFO из Инфоклиники'),
+        ),
+    ]
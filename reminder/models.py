@@ -128,6 +128,10 @@ class Patient(models.Model):
         max_length=255, null=True, blank=True,
         verbose_name="Последняя причина очереди (название)"
     )
+    client_info_hash = models.CharField(
+        max_length=64, null=True, blank=True,
+        verbose_name="Хэш последнего ответа CLIENT_INFO"
+    )
 
     class Meta:
         verbose_name = "Пациент"
@@ -387,6 +391,10 @@ class QueueInfo(models.Model):
         max_length=255, null=True, blank=True,
         verbose_name="Внутреннее название причины"
     )
+    payload_hash = models.CharField(
+        max_length=64, null=True, blank=True,
+        verbose_name="Хэш записи QUEUE_INFO из Инфоклиники"
+    )
 
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания записи")
@@ -11,6 +11,8 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
 from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
 import json
 import logging
 import calendar
@@ -31,11 +33,14 @@ from reminder.models import Patient, Appointment, Assistant, Thread, Run, Ignore
 from reminder.infoclinica_requests.schedule.which_time_in_certain_day import which_time_in_certain_day
 from reminder.infoclinica_requests.schedule.reserve_reception_for_patient import reserve_reception_for_patient
 from reminder.infoclinica_requests.schedule.delete_reception_for_patient import delete_reception_for_patient
-from reminder.openai_assistant.assistant_client import AssistantClient
+from reminder.openai_assistant.assistant_client import get_assistant_client
 from reminder.openai_assistant.assistant_instructions import get_enhanced_assistant_prompt, \
     get_time_selection_instructions, get_enhanced_comprehensive_instructions
 from reminder.openai_assistant.helpers import check_if_time_selection_request, get_selected_time_slot
+from reminder.openai_assistant.openai_client import get_openai_client
 from reminder.openai_assistant.redis_conversation_context_manager import ConversationContextManager
+from reminder.openai_assistant.rule_nlu import parse_user_input, is_confident, select_time_slot, closest_times, \
+    build_analysis_data
 from reminder.properties.utils import get_formatted_date_info
 
 logger = logging.getLogger(__name__)
@@ -382,10 +387,15 @@ def select_best_times_with_ai(user_input, all_available_times, date_obj):
     if len(all_available_times) <= 3:
         return all_available_times
 
+    # Запрос однозначно разобран правилами - те же правила отбора, что и в промпте, без вызова GPT
+    nlu_result = parse_user_input(user_input)
+    if is_confident(nlu_result):
+        if nlu_result['specific_time']:
+            return closest_times(nlu_result['specific_time'], all_available_times)
+        return fallback_time_selection(user_input, all_available_times)
+
     try:
-        from openai import OpenAI
-        from django.conf import settings
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
 
         # Группировка времен по периодам дня
         morning_times = [t for t in all_available_times if t < "12:00"]  # Утро: до 12:00
@@ -650,10 +660,7 @@ def process_reserve_reception_response(response_data, date_obj, requested_time,
 
             if clean_times and patient_id and user_input:
                 try:
-                    # Create an assistant client specifically for time selection
-                    from openai import OpenAI
-                    from django.conf import settings
-                    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+                    client = get_openai_client()
 
                     # Create a prompt for time selection based on user context
                     prompt = f"""
@@ -900,6 +907,181 @@ def process_delete_reception_response(response_data):
         }
 
 
+def _which_time_as_dict(patient_code, date_str):
+    """
+    Вызывает which_time_in_certain_day в потоке пула и возвращает результат в виде словаря.
+    Соединения с БД, открытые в потоке, закрываются после вызова.
+    """
+    try:
+        result = which_time_in_certain_day(patient_code, date_str)
+        if hasattr(result, 'content'):
+            result = json.loads(result.content.decode('utf-8'))
+        return result
+    finally:
+        connections.close_all()
+
+
+def fetch_which_time_for_dates(patient_code, dates):
+    """
+    Запрашивает доступные времена на несколько дат (например, сегодня и завтра) параллельно в потоках,
+    чтобы не ждать запросы к Инфоклинике последовательно.
+
+    Args:
+        patient_code: Код пациента
+        dates: Список дат в формате YYYY-MM-DD
+
+    Returns:
+        list: Результаты which_time_in_certain_day в том же порядке, что и dates ({} при ошибке)
+    """
+    with ThreadPoolExecutor(max_workers=max(len(dates), 1)) as executor:
+        futures = [executor.submit(_which_time_as_dict, patient_code, date_str) for date_str in dates]
+
+    results = []
+    for date_str, future in zip(dates, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Ошибка при получении времени на {date_str}: {e}")
+            results.append({})
+
+    return results
+
+
+def analyze_request_with_assistant(assistant_client, patient, patient_code, user_input):
+    """
+    Определяет намерение, дату и предпочтение по времени с помощью ассистента (отдельный тред анализа).
+    Используется, когда разбор запроса правилами неуверенный.
+
+    Returns:
+        dict: intent, date_type, specific_date, time_preference, specific_time
+    """
+    current_datetime = datetime.now()
+
+    # УЛУЧШЕННЫЕ инструкции для анализа запроса пользователя
+    request_analysis_instructions = f"""
+    # АНАЛИЗ ЗАПРОСА ПОЛЬЗОВАТЕЛЯ
+
+    ## КРИТИЧЕСКИ ВАЖНО: ОПРЕДЕЛЕНИЕ ТЕКУЩЕЙ ДАТЫ И ОТНОСИТЕЛЬНЫХ ДАТ
+    
+    ДАТА НА СЕГОДНЯ: {current_datetime}
+    
+    Примеры как болванки:
+    1. Текущая дата: 2025-05-14 (14 мая 2025)
+    2. Завтра: 2025-05-15 (15 мая 2025)
+    3. Послезавтра: 2025-05-16 (16 мая 2025)
+    4. Через неделю: 2025-05-21 (21 мая 2025)
+
+    Проанализируй запрос пользователя и определи следующие параметры:
+
+    1. Тип запроса:
+       - booking (запись/перенос)
+       - info (запрос информации о времени)
+       - cancel (отмена записи)
+
+    2. Дата запроса:
+       - today (сегодня)
+       - tomorrow (завтра)
+       - day_after_tomorrow (послезавтра)
+       - near_future (ближайшие 2-3 дня)
+       - far_future (через неделю или больше)
+       - specific_date (конкретная дата)
+
+    3. Предпочтение по времени суток:
+       - morning (утро, 9:00-11:59)
+       - afternoon (день, 12:00-15:59)
+       - evening (вечер, 16:00-20:30)
+       - specific_time (конкретное время)
+       - any_time (любое время)
+
+    ## КРИТИЧЕСКИ ВАЖНО: ОБРАБОТКА ТОЧНЫХ ДАТ И ВРЕМЕННЫХ ИНТЕРВАЛОВ
+
+    1. Если в запросе указана фраза "через X дней":
+       - ВСЕГДА устанавливай date_type = "specific_date"
+       - ОБЯЗАТЕЛЬНО вычисли и укажи точную дату в формате YYYY-MM-DD
+       - Например, при запросе "через 4 дня" рассчитай дату путем прибавления 4 дней к текущей дате (2025-05-14 + 4 дня = 2025-05-18)
+       - НИКОГДА не используй дату из прошлого
+
+    2. Для выражений о будущем:
+       - "через неделю" = 2025-05-14 + 7 дней = 2025-05-21 (date_type = "specific_date", specific_date = "2025-05-21")
+       - "через 2 недели" = 2025-05-14 + 14 дней = 2025-05-28 (date_type = "specific_date", specific_date = "2025-05-28")
+       - "через месяц" = 2025-05-14 + 30 дней ~ 2025-06-13 (date_type = "specific_date", specific_date = "2025-06-13")
+
+    3. Если указана конкретная дата (например, "15 мая"), переведи её в формат YYYY-MM-DD с правильным годом
+       - "15 мая" = "2025-05-15"
+       - "20 июня" = "2025-06-20"
+
+    4. ВАЖНО: Все даты ДОЛЖНЫ быть в будущем. Если расчеты дают дату в прошлом, добавь 1 год.
+
+    5. ПРОВЕРКА: Убедись, что все specific_date имеют формат YYYY-MM-DD и относятся к будущему.
+
+    Верни результат в формате JSON без дополнительных комментариев:
+    ```json
+    {{
+      "intent": "booking|info|cancel",
+      "date_type": "today|tomorrow|day_after_tomorrow|near_future|far_future|specific_date",
+      "specific_date": "YYYY-MM-DD или null",
+      "time_preference": "morning|afternoon|evening|specific_time|any_time",
+      "specific_time": "HH:MM или null"
+    }}
+    ```
+    """
+
+    # Запрос к ассистенту для анализа намерения пользователя
+    analysis_thread = assistant_client.get_or_create_thread(f"analysis_{patient_code}", patient)
+    assistant_client.add_message_to_thread(analysis_thread.thread_id,
+                                           f"Запрос пользователя: '{user_input}'. Проанализируй и определи намерение, дату и предпочтение по времени.")
+
+    # Запускаем анализ и ждем его результат
+    analysis_result = assistant_client.run_assistant(
+        analysis_thread,
+        patient,
+        instructions=request_analysis_instructions,
+        timeout=5
+    )
+
+    try:
+        # Извлекаем результат анализа из ответа ассистента
+        analysis_messages = assistant_client.get_messages(analysis_thread.thread_id, limit=1)
+        analysis_data = extract_json_from_message(analysis_messages[0])
+
+        if not analysis_data:
+            analysis_data = {
+                "intent": "info",  # По умолчанию считаем, что пользователь запрашивает информацию
+                "date_type": "today",
+                "specific_date": None,
+                "time_preference": "any_time",
+                "specific_time": None
+            }
+
+        logger.info(f"Анализ запроса: {analysis_data}")
+
+        # Валидация дат - проверяем, не в прошлом ли даты
+        if analysis_data.get("specific_date"):
+            try:
+                specified_date = datetime.strptime(analysis_data.get("specific_date"), "%Y-%m-%d")
+                if specified_date.date() < datetime.now().date():
+                    logger.warning(f"Обнаружена дата в прошлом: {analysis_data.get('specific_date')}, исправляем")
+                    # Поправляем на сегодняшнюю дату
+                    analysis_data["specific_date"] = datetime.now().strftime("%Y-%m-%d")
+                    analysis_data["date_type"] = "today"
+            except ValueError:
+                logger.error(f"Некорректный формат даты: {analysis_data.get('specific_date')}")
+                analysis_data["specific_date"] = None
+                analysis_data["date_type"] = "today"
+
+    except Exception as analysis_error:
+        logger.error(f"Ошибка при анализе запроса: {analysis_error}")
+        analysis_data = {
+            "intent": "info",
+            "date_type": "today",
+            "specific_date": None,
+            "time_preference": "any_time",
+            "specific_time": None
+        }
+
+    return analysis_data
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def process_voicebot_request(request):
@@ -985,6 +1167,11 @@ def process_voicebot_request(request):
             if hour < 9 or (hour == 20 and minute > 30) or hour > 20:
                 return JsonResponse({"status": "nonworktime"})
 
+        # Сначала разбираем запрос правилами: при уверенном разборе LLM не вызывается
+        nlu_result = parse_user_input(user_input)
+        nlu_confident = is_confident(nlu_result)
+        logger.info(f"Разбор запроса правилами: {nlu_result}, уверенность достаточна: {nlu_confident}")
+
         # Initialize context for the assistant
         additional_context = {}
 
@@ -993,17 +1180,12 @@ def process_voicebot_request(request):
             today = datetime.now().strftime("%Y-%m-%d")
             tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
 
-            # Fetch available slots for today
-            today_result = which_time_in_certain_day(patient_code, today)
-            if hasattr(today_result, 'content'):
-                today_result = json.loads(today_result.content.decode('utf-8'))
+            # Fetch available slots for today and tomorrow concurrently
+            today_result, tomorrow_result = fetch_which_time_for_dates(patient_code, [today, tomorrow])
+
             today_slots = extract_available_times(today_result)
             additional_context["today_slots"] = today_slots
 
-            # Fetch available slots for tomorrow
-            tomorrow_result = which_time_in_certain_day(patient_code, tomorrow)
-            if hasattr(tomorrow_result, 'content'):
-                tomorrow_result = json.loads(tomorrow_result.content.decode('utf-8'))
             tomorrow_slots = extract_available_times(tomorrow_result)
             additional_context["tomorrow_slots"] = tomorrow_slots
 
@@ -1111,24 +1293,27 @@ def process_voicebot_request(request):
 
                     return JsonResponse(processed_result)
 
-            # Use improved date extraction with AI
-            is_time_selection = check_if_time_selection_request_ai(user_input, today_slots, tomorrow_slots)
-            if is_time_selection:
+            # Выбор из доступных времен: правилами, а если разбор неуверенный - с помощью AI
+            target_date, target_time = None, None
+            if nlu_confident:
+                target_date, target_time = select_time_slot(nlu_result, today_slots, tomorrow_slots)
+            elif check_if_time_selection_request_ai(user_input, today_slots, tomorrow_slots):
                 target_date, target_time = get_selected_time_slot_ai(user_input, today_slots, tomorrow_slots)
-                if target_date and target_time:
-                    # Directly book the selected time
-                    date_str = target_date.strftime("%Y-%m-%d")
-                    datetime_str = f"{date_str} {target_time}"
 
-                    result = reserve_reception_for_patient(patient_code, datetime_str, 1)
-                    if hasattr(result, 'content'):
-                        result_dict = json.loads(result.content.decode('utf-8'))
-                    else:
-                        result_dict = result
+            if target_date and target_time:
+                # Directly book the selected time
+                date_str = target_date.strftime("%Y-%m-%d")
+                datetime_str = f"{date_str} {target_time}"
 
-                    processed_result = process_reserve_reception_response(result_dict, target_date, target_time,
-                                                                          user_input)
-                    return JsonResponse(processed_result)
+                result = reserve_reception_for_patient(patient_code, datetime_str, 1)
+                if hasattr(result, 'content'):
+                    result_dict = json.loads(result.content.decode('utf-8'))
+                else:
+                    result_dict = result
+
+                processed_result = process_reserve_reception_response(result_dict, target_date, target_time,
+                                                                      user_input)
+                return JsonResponse(processed_result)
 
         except Exception as slots_error:
             logger.error(f"Error fetching available slots: {slots_error}")
@@ -1187,139 +1372,14 @@ def process_voicebot_request(request):
             return JsonResponse(response)
 
         # Initialize assistant client for analyzing intent
-        assistant_client = AssistantClient()
-        thread = assistant_client.get_or_create_thread(f"patient_{patient_code}", patient)
+        assistant_client = get_assistant_client()
 
-        # Add user message
-        assistant_client.add_message_to_thread(thread.thread_id, user_input)
-        current_datetime = datetime.now()
-
-        # УЛУЧШЕННЫЕ инструкции для анализа запроса пользователя
-        request_analysis_instructions = f"""
-        # АНАЛИЗ ЗАПРОСА ПОЛЬЗОВАТЕЛЯ
-
-        ## КРИТИЧЕСКИ ВАЖНО: ОПРЕДЕЛЕНИЕ ТЕКУЩЕЙ ДАТЫ И ОТНОСИТЕЛЬНЫХ ДАТ
-        
-        ДАТА НА СЕГОДНЯ: {current_datetime}
-        
-        Примеры как болванки:
-        1. Текущая дата: 2025-05-14 (14 мая 2025)
-        2. Завтра: 2025-05-15 (15 мая 2025)
-        3. Послезавтра: 2025-05-16 (16 мая 2025)
-        4. Через неделю: 2025-05-21 (21 мая 2025)
-
-        Проанализируй запрос пользователя и определи следующие параметры:
-
-        1. Тип запроса:
-           - booking (запись/перенос)
-           - info (запрос информации о времени)
-           - cancel (отмена записи)
-
-        2. Дата запроса:
-           - today (сегодня)
-           - tomorrow (завтра)
-           - day_after_tomorrow (послезавтра)
-           - near_future (ближайшие 2-3 дня)
-           - far_future (через неделю или больше)
-           - specific_date (конкретная дата)
-
-        3. Предпочтение по времени суток:
-           - morning (утро, 9:00-11:59)
-           - afternoon (день, 12:00-15:59)
-           - evening (вечер, 16:00-20:30)
-           - specific_time (конкретное время)
-           - any_time (любое время)
-
-        ## КРИТИЧЕСКИ ВАЖНО: ОБРАБОТКА ТОЧНЫХ ДАТ И ВРЕМЕННЫХ ИНТЕРВАЛОВ
-
-        1. Если в запросе указана фраза "через X дней":
-           - ВСЕГДА устанавливай date_type = "specific_date"
-           - ОБЯЗАТЕЛЬНО вычисли и укажи точную дату в формате YYYY-MM-DD
-           - Например, при запросе "через 4 дня" рассчитай дату путем прибавления 4 дней к текущей дате (2025-05-14 + 4 дня = 2025-05-18)
-           - НИКОГДА не используй дату из прошлого
-
-        2. Для выражений о будущем:
-           - "через неделю" = 2025-05-14 + 7 дней = 2025-05-21 (date_type = "specific_date", specific_date = "2025-05-21")
-           - "через 2 недели" = 2025-05-14 + 14 дней = 2025-05-28 (date_type = "specific_date", specific_date = "2025-05-28")
-           - "через месяц" = 2025-05-14 + 30 дней ~ 2025-06-13 (date_type = "specific_date", specific_date = "2025-06-13")
-
-        3. Если указана конкретная дата (например, "15 мая"), переведи её в формат YYYY-MM-DD с правильным годом
-           - "15 мая" = "2025-05-15"
-           - "20 июня" = "2025-06-20"
-
-        4. ВАЖНО: Все даты ДОЛЖНЫ быть в будущем. Если расчеты дают дату в прошлом, добавь 1 год.
-
-        5. ПРОВЕРКА: Убедись, что все specific_date имеют формат YYYY-MM-DD и относятся к будущему.
-
-        Верни результат в формате JSON без дополнительных комментариев:
-        ```json
-        {{
-          "intent": "booking|info|cancel",
-          "date_type": "today|tomorrow|day_after_tomorrow|near_future|far_future|specific_date",
-          "specific_date": "YYYY-MM-DD или null",
-          "time_preference": "morning|afternoon|evening|specific_time|any_time",
-          "specific_time": "HH:MM или null"
-        }}
-        ```
-        """
-
-        # Запрос к ассистенту для анализа намерения пользователя
-        analysis_thread = assistant_client.get_or_create_thread(f"analysis_{patient_code}", patient)
-        assistant_client.add_message_to_thread(analysis_thread.thread_id,
-                                               f"Запрос пользователя: '{user_input}'. Проанализируй и определи намерение, дату и предпочтение по времени.")
-
-        analysis_run = assistant_client.run_assistant(
-            analysis_thread,
-            patient,
-            instructions=request_analysis_instructions
-        )
-
-        # Ждем результат анализа
-        try:
-            analysis_result = assistant_client.wait_for_run_completion(
-                analysis_thread.thread_id,
-                analysis_run.run_id,
-                timeout=5
-            )
-
-            # Извлекаем результат анализа из ответа ассистента
-            analysis_messages = assistant_client.get_messages(analysis_thread.thread_id, limit=1)
-            analysis_data = extract_json_from_message(analysis_messages[0])
-
-            if not analysis_data:
-                analysis_data = {
-                    "intent": "info",  # По умолчанию считаем, что пользователь запрашивает информацию
-                    "date_type": "today",
-                    "specific_date": None,
-                    "time_preference": "any_time",
-                    "specific_time": None
-                }
-
-            logger.info(f"Анализ запроса: {analysis_data}")
-
-            # Валидация дат - проверяем, не в прошлом ли даты
-            if analysis_data.get("specific_date"):
-                try:
-                    specified_date = datetime.strptime(analysis_data.get("specific_date"), "%Y-%m-%d")
-                    if specified_date.date() < datetime.now().date():
-                        logger.warning(f"Обнаружена дата в прошлом: {analysis_data.get('specific_date')}, исправляем")
-                        # Поправляем на сегодняшнюю дату
-                        analysis_data["specific_date"] = datetime.now().strftime("%Y-%m-%d")
-                        analysis_data["date_type"] = "today"
-                except ValueError:
-                    logger.error(f"Некорректный формат даты: {analysis_data.get('specific_date')}")
-                    analysis_data["specific_date"] = None
-                    analysis_data["date_type"] = "today"
-
-        except Exception as analysis_error:
-            logger.error(f"Ошибка при анализе запроса: {analysis_error}")
-            analysis_data = {
-                "intent": "info",
-                "date_type": "today",
-                "specific_date": None,
-                "time_preference": "any_time",
-                "specific_time": None
-            }
+        if nlu_confident and (nlu_result['intent'] or nlu_result['date']):
+            # Намерение и дата разобраны правилами - анализ ассистентом не нужен
+            analysis_data = build_analysis_data(nlu_result)
+            logger.info(f"Анализ запроса правилами: {analysis_data}")
+        else:
+            analysis_data = analyze_request_with_assistant(assistant_client, patient, patient_code, user_input)
 
         # Определяем дату запроса
         request_date = datetime.now()  # По умолчанию сегодня
@@ -1511,60 +1571,66 @@ def process_voicebot_request(request):
                     # Если после фильтрации есть времена, используем их
                     selected_times = filtered_times if filtered_times else available_times
 
-                    # Выбираем время с помощью OpenAI
+                    # Выбираем время: правилами, а если разбор неуверенный - с помощью OpenAI
                     try:
-                        from openai import OpenAI
-                        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-                        # Формируем запрос для ассистента
-                        time_selection_prompt = f"""
-                        На основе запроса пользователя: "{user_input}"
-                        выбери наиболее подходящее время из доступных: {', '.join(selected_times)}
-
-                        Анализируй:
-                        1. Предпочтения по времени суток (утро: до 12:00, день: 12:00-16:00, вечер: после 16:00)
-                        2. Конкретные временные упоминания в запросе
-                        3. По умолчанию выбирай время, соответствующее контексту пользователя
-
-                        Верни только выбранное время в формате ЧЧ:ММ без дополнительных пояснений.
-                        """
-
-                        # Отправляем запрос к ассистенту
-                        response = client.chat.completions.create(
-                            model="gpt-4o-mini",
-                            messages=[
-                                {"role": "system",
-                                 "content": "You are a helpful assistant that selects the most appropriate time slot based on user's preferences."},
-                                {"role": "user", "content": time_selection_prompt}
-                            ],
-                            temperature=0.2
-                        )
-
-                        # Извлекаем ответ ассистента
-                        time_response = response.choices[0].message.content.strip()
-
-                        # Проверяем, соответствует ли ответ формату времени
-                        time_match = re.search(r'(\d{1,2}):(\d{2})', time_response)
-                        if time_match:
-                            # Форматируем время в правильный формат
-                            hour = int(time_match.group(1))
-                            minute = int(time_match.group(2))
-                            selected_time = f"{hour:02d}:{minute:02d}"
-
-                            # Проверяем, есть ли выбранное время в списке доступных
-                            if selected_time in selected_times:
-                                logger.info(f"Ассистент выбрал время: {selected_time}")
+                        if nlu_confident:
+                            if nlu_result['specific_time']:
+                                selected_time = closest_times(nlu_result['specific_time'], selected_times, limit=1)[0]
                             else:
-                                # Ищем ближайшее время из доступных
-                                selected_datetime = datetime.strptime(selected_time, "%H:%M")
-                                closest_time = min(selected_times, key=lambda x:
-                                abs((datetime.strptime(x, "%H:%M") - selected_datetime).total_seconds()))
-                                selected_time = closest_time
-                                logger.info(f"Ассистент выбрал ближайшее доступное время: {selected_time}")
+                                selected_time = selected_times[0]
+                            logger.info(f"Время выбрано правилами: {selected_time}")
                         else:
-                            # Если ассистент не вернул корректное время, используем первое доступное
-                            selected_time = selected_times[0]
-                            logger.info(f"Используем первое доступное время: {selected_time}")
+                            client = get_openai_client()
+
+                            # Формируем запрос для ассистента
+                            time_selection_prompt = f"""
+                            На основе запроса пользователя: "{user_input}"
+                            выбери наиболее подходящее время из доступных: {', '.join(selected_times)}
+
+                            Анализируй:
+                            1. Предпочтения по времени суток (утро: до 12:00, день: 12:00-16:00, вечер: после 16:00)
+                            2. Конкретные временные упоминания в запросе
+                            3. По умолчанию выбирай время, соответствующее контексту пользователя
+
+                            Верни только выбранное время в формате ЧЧ:ММ без дополнительных пояснений.
+                            """
+
+                            # Отправляем запрос к ассистенту
+                            response = client.chat.completions.create(
+                                model="gpt-4o-mini",
+                                messages=[
+                                    {"role": "system",
+                                     "content": "You are a helpful assistant that selects the most appropriate time slot based on user's preferences."},
+                                    {"role": "user", "content": time_selection_prompt}
+                                ],
+                                temperature=0.2
+                            )
+
+                            # Извлекаем ответ ассистента
+                            time_response = response.choices[0].message.content.strip()
+
+                            # Проверяем, соответствует ли ответ формату времени
+                            time_match = re.search(r'(\d{1,2}):(\d{2})', time_response)
+                            if time_match:
+                                # Форматируем время в правильный формат
+                                hour = int(time_match.group(1))
+                                minute = int(time_match.group(2))
+                                selected_time = f"{hour:02d}:{minute:02d}"
+
+                                # Проверяем, есть ли выбранное время в списке доступных
+                                if selected_time in selected_times:
+                                    logger.info(f"Ассистент выбрал время: {selected_time}")
+                                else:
+                                    # Ищем ближайшее время из доступных
+                                    selected_datetime = datetime.strptime(selected_time, "%H:%M")
+                                    closest_time = min(selected_times, key=lambda x:
+                                    abs((datetime.strptime(x, "%H:%M") - selected_datetime).total_seconds()))
+                                    selected_time = closest_time
+                                    logger.info(f"Ассистент выбрал ближайшее доступное время: {selected_time}")
+                            else:
+                                # Если ассистент не вернул корректное время, используем первое доступное
+                                selected_time = selected_times[0]
+                                logger.info(f"Используем первое доступное время: {selected_time}")
 
                         # Записываем на выбранное время
                         datetime_str = f"{date_str} {selected_time}"
@@ -1633,6 +1699,12 @@ def process_voicebot_request(request):
                         "message": f"На {date_str} нет доступных времен для записи"
                     })
 
+        # Тред пациента нужен только для общего запуска ассистента
+        thread = assistant_client.get_or_create_thread(f"patient_{patient_code}", patient)
+
+        # Add user message
+        assistant_client.add_message_to_thread(thread.thread_id, user_input)
+
         # Create context-enhanced instructions with previous interaction data
         context_instructions = """
         # КРИТИЧЕСКИ ВАЖНАЯ ИНФОРМАЦИЯ О ПРЕДЫДУЩЕМ КОНТЕКСТЕ
@@ -1727,11 +1799,8 @@ def process_voicebot_request(request):
                               date_booking_instructions + "\n\n" +
                               available_slots_context)
 
-        # Запускаем ассистента
-        run = assistant_client.run_assistant(thread, patient, instructions=final_instructions)
-
-        # Ждем ответ
-        result = assistant_client.wait_for_run_completion(thread.thread_id, run.run_id, timeout=15)
+        # Запускаем ассистента и ждем ответ
+        result = assistant_client.run_assistant(thread, patient, instructions=final_instructions, timeout=15)
 
         # Проверяем валидность результата
         valid_statuses = [
@@ -1958,9 +2027,7 @@ def check_if_time_selection_request_ai(user_input, today_slots, tomorrow_slots):
         Верни только "true" или "false" без дополнительных пояснений.
         """
 
-        from openai import OpenAI
-        from django.conf import settings
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
 
         response = client.chat.completions.create(
             model="gpt-4",
@@ -2030,9 +2097,7 @@ def get_selected_time_slot_ai(user_input, today_slots, tomorrow_slots):
         Если невозможно определить время, верни null вместо времени.
         """
 
-        from openai import OpenAI
-        from django.conf import settings
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
 
         response = client.chat.completions.create(
             model="gpt-4",
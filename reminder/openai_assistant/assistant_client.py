@@ -2,15 +2,16 @@ import os
 import re
 import json
 import logging
+import threading
 import time as time_module
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Union
 
 from django.http.response import JsonResponse
 from django.utils import timezone
 from django.conf import settings
-from openai import OpenAI
-from django.db import transaction
+from django.db import connections, transaction
 
 from reminder.infoclinica_requests.schedule.appointment_time_for_patient import appointment_time_for_patient
 from reminder.infoclinica_requests.schedule.delete_reception_for_patient import delete_reception_for_patient
@@ -18,6 +19,10 @@ from reminder.infoclinica_requests.schedule.reserve_reception_for_patient import
 from reminder.infoclinica_requests.schedule.which_time_in_certain_day import which_time_in_certain_day
 from reminder.models import Assistant, Thread, Run as RunModel, Patient, Appointment, QueueInfo, AvailableTimeSlot
 from reminder.openai_assistant.assistant_instructions import get_enhanced_assistant_prompt
+from reminder.openai_assistant.openai_client import get_openai_client
+from reminder.openai_assistant.thread_state import (
+    get_thread_state, record_offered_slots, record_run_status
+)
 
 logger = logging.getLogger(__name__)
 
@@ -73,15 +78,47 @@ WEEKDAYS_KZ = {
 }
 
 
+# Статусы ответа, которые принимает ACS
+VALID_ACS_STATUSES = [
+    "success_change_reception", "success_change_reception_today", "success_change_reception_tomorrow",
+    "error_change_reception", "error_change_reception_today", "error_change_reception_tomorrow",
+    "which_time", "which_time_today", "which_time_tomorrow",
+    "error_empty_windows", "error_empty_windows_today", "error_empty_windows_tomorrow",
+    "nonworktime", "error_med_element", "no_action_required",
+    "success_deleting_reception", "error_deleting_reception", "error_change_reception_bad_date",
+    "only_first_time_tomorrow", "only_first_time_today", "only_first_time",
+    "only_two_time_tomorrow", "only_two_time_today", "only_two_time",
+    "change_only_first_time_tomorrow", "change_only_first_time_today", "change_only_first_time",
+    "change_only_two_time_tomorrow", "change_only_two_time_today", "change_only_two_time"
+]
+
+# События потока запуска, после которых запуск завершен
+RUN_TERMINAL_EVENTS = [
+    "thread.run.completed", "thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"
+]
+ACTIVE_RUN_STATUSES = ["queued", "in_progress", "requires_action"]
+
+# Тред продлевается на сутки, только если до истечения осталось меньше этого срока (без записи в БД на каждом ходе)
+THREAD_EXTEND_THRESHOLD = timedelta(hours=12)
+
+# Сколько вызовов функций из одного requires_action выполнять одновременно
+ASSISTANT_TOOL_MAX_WORKERS = 4
+# Функции, меняющие запись пациента: для одного пациента выполняются строго по очереди
+WRITE_FUNCTIONS = ["reserve_reception_for_patient", "delete_reception_for_patient"]
+# Сколько потоков запусков, результат которых уже отдан, дочитывается одновременно (общий пул процесса)
+RUN_DRAIN_MAX_WORKERS = 4
+
+
 class AssistantClient:
     """
     Improved client for working with OpenAI Assistant API.
     Provides interface for patient interactions with appointment system.
     """
 
-    def __init__(self):
-        """Initialize client with API key from settings."""
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    @property
+    def client(self):
+        """Process-wide OpenAI client (shared connection pool)."""
+        return get_openai_client()
 
     def get_or_create_thread(self, thread_identifier, entity):
         """
@@ -89,7 +126,7 @@ class AssistantClient:
         """
         try:
             # Look for an active thread with this identifier
-            existing_thread = Thread.objects.filter(
+            existing_thread = Thread.objects.select_related("assistant", "current_run").filter(
                 order_key=str(thread_identifier),
                 expires_at__gt=timezone.now()
             ).first()
@@ -97,29 +134,25 @@ class AssistantClient:
             if existing_thread:
                 logger.info(f"Найден существующий тред {existing_thread.thread_id} для {thread_identifier}")
 
-                # Check for active runs that could block new messages
-                try:
-                    runs = self.client.beta.threads.runs.list(
-                        thread_id=existing_thread.thread_id,
-                        limit=1
-                    )
-
-                    if runs.data and runs.data[0].status in ["in_progress", "queued", "requires_action"]:
-                        logger.warning(f"Тред {existing_thread.thread_id} имеет активный запуск, отменяем его")
-                        try:
-                            self.client.beta.threads.runs.cancel(
-                                thread_id=existing_thread.thread_id,
-                                run_id=runs.data[0].id
-                            )
-                        except Exception as cancel_error:
-                            logger.error(f"Ошибка при отмене запуска: {cancel_error}")
-                            # Even if cancellation fails, continue with the existing thread
-                except Exception as run_check_error:
-                    logger.error(f"Ошибка при проверке запусков: {run_check_error}")
+                # Статус последнего запуска берем из трекера состояния треда (обновляется по событиям запуска),
+                # а не из runs.list: отменяем только запуск, который по нашим данным еще активен
+                run_id, run_status = self._get_last_run(existing_thread)
+                if run_id and run_status in ACTIVE_RUN_STATUSES:
+                    logger.warning(f"Тред {existing_thread.thread_id} имеет активный запуск {run_id}, отменяем его")
+                    try:
+                        self.client.beta.threads.runs.cancel(
+                            thread_id=existing_thread.thread_id,
+                            run_id=run_id
+                        )
+                        record_run_status(existing_thread.thread_id, run_id, "cancelled")
+                    except Exception as cancel_error:
+                        logger.error(f"Ошибка при отмене запуска: {cancel_error}")
+                        # Even if cancellation fails, continue with the existing thread
 
-                # Update thread expiration
-                existing_thread.expires_at = timezone.now() + timedelta(hours=24)
-                existing_thread.save()
+                # Продлеваем тред, только когда до истечения осталось меньше половины срока
+                if existing_thread.expires_at - timezone.now() < THREAD_EXTEND_THRESHOLD:
+                    existing_thread.expires_at = timezone.now() + timedelta(hours=24)
+                    existing_thread.save(update_fields=["expires_at"])
 
                 return existing_thread
 
@@ -131,6 +164,20 @@ class AssistantClient:
             # If an error occurs, create a new thread
             return self._create_fresh_thread(entity)
 
+    def _get_last_run(self, thread) -> tuple:
+        """
+        Returns (run_id, status) of the last run of the thread: from the thread state tracker,
+        or from Thread.current_run if the tracker has no entry (expired or Redis unavailable).
+        """
+        state = get_thread_state(thread.thread_id)
+        if state.get("run_id"):
+            return state["run_id"], state.get("run_status")
+
+        if thread.current_run:
+            return thread.current_run.run_id, thread.current_run.status
+
+        return None, None
+
     def _create_fresh_thread(self, entity):
         """
         Creates a completely new thread for an appointment or patient.
@@ -250,366 +297,432 @@ class AssistantClient:
             logger.error(f"Error adding message to thread: {e}")
             raise
 
-    def run_assistant(self, thread, entity, instructions=None):
+    def _build_run_instructions(self, thread_id: str, instructions: str = None) -> str:
         """
-        Запускает ассистента с улучшенной обработкой контекста.
+        Собирает инструкции запуска: контекст ранее показанных времен и переданные инструкции.
+        Показанные времена берутся из трекера состояния треда, сообщения треда не запрашиваются.
         """
-        try:
-            # Get thread ID
-            thread_id = thread.thread_id
+        state = get_thread_state(thread_id)
+        date_from_context = state.get("date")
+        day_from_context = state.get("day")
+        time_slots = state.get("times") or []
 
-            # Get the last few messages to extract context
-            messages = self.client.beta.threads.messages.list(
-                thread_id=thread_id,
-                limit=10,  # Increased limit to ensure we catch context
-                order="desc"
-            )
+        # Build powerful context instructions if we found relevant previous context
+        context_instructions = ""
+        if (date_from_context or day_from_context) and time_slots:
+            context_instructions = f"""
+            ## КРИТИЧЕСКИ ВАЖНЫЙ ПРЕДЫДУЩИЙ КОНТЕКСТ
 
-            # Extract context from previous assistant messages
-            last_times_message = None
-            date_from_context = None
-            day_from_context = None
-            time_slots = []
+            В предыдущем ответе я показал пациенту следующие доступные времена:
 
-            for message in messages.data:
-                if message.role == "assistant" and hasattr(message, 'content') and message.content:
-                    content_text = ""
-                    for content_item in message.content:
-                        if hasattr(content_item, 'text') and content_item.text:
-                            content_text += content_item.text.value
+            ### Дата: {date_from_context or "Неизвестно"}"""
 
-                    # Check for time-related statuses in JSON format
-                    if any(marker in content_text for marker in
-                           ["first_time", "second_time", "third_time", "which_time"]):
-                        last_times_message = content_text
+            if day_from_context:
+                context_instructions += f" ({day_from_context})"
 
-                        # Extract date information
-                        date_pattern = r'"date":\s*"([^"]+)"'
-                        date_match = re.search(date_pattern, content_text)
+            context_instructions += "\n\n"
 
-                        # Extract day information (today/tomorrow)
-                        day_pattern = r'"day":\s*"([^"]+)"'
-                        day_match = re.search(day_pattern, content_text)
+            # Add time slots with explicit labeling
+            for i, time_value in enumerate(time_slots):
+                slot_label = {0: "Первое время", 1: "Второе время", 2: "Третье время"}.get(i, f"Время {i + 1}")
+                context_instructions += f"- {slot_label}: {time_value}\n"
 
-                        # Extract time slots
-                        time_pattern = r'"(first_time|second_time|third_time)":\s*"([^"]+)"'
-                        time_matches = re.findall(time_pattern, content_text)
+            context_instructions += """
+            ## ПРАВИЛА ОБРАБОТКИ ССЫЛОК НА ПРЕДЫДУЩИЕ ВРЕМЕНА
 
-                        if time_matches:
-                            time_slots = [time_value for _, time_value in time_matches]
+            КРИТИЧЕСКИ ВАЖНО: Когда пользователь ссылается на времена из предыдущего контекста:
 
-                        if date_match:
-                            date_from_context = date_match.group(1)
+            1. Если пользователь говорит "первое время", "первый вариант", "первое", "на первое окошко" → ему нужно первое время из списка выше
+            2. Если пользователь говорит "второе время", "второй вариант", "второе", "на второе окошко" → ему нужно второе время из списка выше
+            3. Если пользователь говорит "третье время", "третий вариант", "третье", "на третье окошко" → ему нужно третье время из списка выше
+            4. Если пользователь говорит "давай", "ок", "да", "хорошо", "записывай" без уточнения → ему нужно первое время из списка
 
-                        if day_match:
-                            day_from_context = day_match.group(1)
+            КРИТИЧЕСКИ ВАЖНО: Используй именно ту ДАТУ, которая была показана ранее! 
+            Не используй сегодняшнюю дату, если в предыдущем ответе была показана дата другого дня!
 
-                        break
-
-            # Build powerful context instructions if we found relevant previous context
-            context_instructions = ""
-            if last_times_message and (date_from_context or day_from_context) and time_slots:
-                context_instructions = f"""
-                ## КРИТИЧЕСКИ ВАЖНЫЙ ПРЕДЫДУЩИЙ КОНТЕКСТ
-
-                В предыдущем ответе я показал пациенту следующие доступные времена:
+            Если пациент говорит что-то вроде "а давай на первое окошко" после того, как ему были показаны
+            времена на другую дату, запись ДОЛЖНА быть сделана на ПЕРВОЕ ИЗ ПОКАЗАННЫХ ВРЕМЕН с ДАТОЙ ИЗ КОНТЕКСТА,
+            а НЕ с сегодняшней датой!
+            """
 
-                ### Дата: {date_from_context or "Неизвестно"}"""
+        # Create final instructions by combining context with other instructions
+        final_instructions = ""
 
-                if day_from_context:
-                    context_instructions += f" ({day_from_context})"
+        if context_instructions:
+            final_instructions += context_instructions + "\n\n"
 
-                context_instructions += "\n\n"
+        if instructions:
+            final_instructions += instructions
+        else:
+            # Default instructions if none provided
+            final_instructions += """
+            # КРИТИЧЕСКИ ВАЖНО: ВСЕГДА ИСПОЛЬЗУЙ ФУНКЦИИ, А НЕ ТЕКСТОВЫЕ ОТВЕТЫ!
 
-                # Add time slots with explicit labeling
-                for i, time_value in enumerate(time_slots):
-                    slot_label = {0: "Первое время", 1: "Второе время", 2: "Третье время"}.get(i, f"Время {i + 1}")
-                    context_instructions += f"- {slot_label}: {time_value}\n"
+            В следующих ситуациях ты ОБЯЗАТЕЛЬНО должен вызвать функцию вместо текстового ответа:
 
-                context_instructions += """
-                ## ПРАВИЛА ОБРАБОТКИ ССЫЛОК НА ПРЕДЫДУЩИЕ ВРЕМЕНА
+            1. Когда пользователь спрашивает о свободных окошках или времени:
+               → ВСЕГДА вызывай функцию which_time_in_certain_day
 
-                КРИТИЧЕСКИ ВАЖНО: Когда пользователь ссылается на времена из предыдущего контекста:
+            2. Когда пользователь интересуется своей текущей записью:
+               → ВСЕГДА вызывай функцию appointment_time_for_patient
 
-                1. Если пользователь говорит "первое время", "первый вариант", "первое", "на первое окошко" → ему нужно первое время из списка выше
-                2. Если пользователь говорит "второе время", "второй вариант", "второе", "на второе окошко" → ему нужно второе время из списка выше
-                3. Если пользователь говорит "третье время", "третий вариант", "третье", "на третье окошко" → ему нужно третье время из списка выше
-                4. Если пользователь говорит "давай", "ок", "да", "хорошо", "записывай" без уточнения → ему нужно первое время из списка
+            3. Когда пользователь хочет записаться или перенести запись:
+               → ВСЕГДА вызывай функцию reserve_reception_for_patient
 
-                КРИТИЧЕСКИ ВАЖНО: Используй именно ту ДАТУ, которая была показана ранее! 
-                Не используй сегодняшнюю дату, если в предыдущем ответе была показана дата другого дня!
+            4. Когда пользователь хочет отменить запись:
+               → ВСЕГДА вызывай функцию delete_reception_for_patient
 
-                Если пациент говорит что-то вроде "а давай на первое окошко" после того, как ему были показаны
-                времена на другую дату, запись ДОЛЖНА быть сделана на ПЕРВОЕ ИЗ ПОКАЗАННЫХ ВРЕМЕН с ДАТОЙ ИЗ КОНТЕКСТА,
-                а НЕ с сегодняшней датой!
-                """
+            # ЗАПРЕЩЕНО использовать текстовые ответы для вышеперечисленных запросов!
+            # ВСЕГДА вызывай соответствующую функцию!
+            """
 
-            # Create final instructions by combining context with other instructions
-            final_instructions = ""
+        return final_instructions
 
-            if context_instructions:
-                final_instructions += context_instructions + "\n\n"
+    def run_assistant(self, thread, entity, instructions=None, timeout: int = 30) -> dict:
+        """
+        Запускает ассистента и обрабатывает поток событий запуска (streaming) вместо опроса runs.retrieve.
+        requires_action обрабатывается в момент получения события, результаты функций отправляются сразу,
+        итоговый статус запуска сохраняется в БД один раз.
+        Статус запуска и предложенные пациенту времена записываются в трекер состояния треда (thread_state).
 
-            if instructions:
-                final_instructions += instructions
-            else:
-                # Default instructions if none provided
-                final_instructions += """
-                # КРИТИЧЕСКИ ВАЖНО: ВСЕГДА ИСПОЛЬЗУЙ ФУНКЦИИ, А НЕ ТЕКСТОВЫЕ ОТВЕТЫ!
+        Args:
+            thread: Thread object
+            entity: Appointment or Patient object
+            instructions: Additional run instructions
+            timeout: Maximum run time in seconds
 
-                В следующих ситуациях ты ОБЯЗАТЕЛЬНО должен вызвать функцию вместо текстового ответа:
+        Returns:
+            dict: Formatted function result or status information
+        """
+        thread_id = thread.thread_id
 
-                1. Когда пользователь спрашивает о свободных окошках или времени:
-                   → ВСЕГДА вызывай функцию which_time_in_certain_day
+        try:
+            final_instructions = self._build_run_instructions(thread_id, instructions)
 
-                2. Когда пользователь интересуется своей текущей записью:
-                   → ВСЕГДА вызывай функцию appointment_time_for_patient
+            stream = self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=thread.assistant.assistant_id,
+                instructions=final_instructions,
+                stream=True,
+                timeout=timeout
+            )
+        except Exception as e:
+            logger.error(f"Ошибка запуска ассистента: {e}", exc_info=True)
+            raise
 
-                3. Когда пользователь хочет записаться или перенести запись:
-                   → ВСЕГДА вызывай функцию reserve_reception_for_patient
+        start_time = time_module.time()
+        run_id = None
+        status = None
+        last_message = None
+        pending_stream = None
 
-                4. Когда пользователь хочет отменить запись:
-                   → ВСЕГДА вызывай функцию delete_reception_for_patient
+        try:
+            while stream is not None:
+                next_stream = None
+
+                with stream:
+                    for event in stream:
+                        if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                            run_id = event.data.id
+                            status = event.data.status
+                            if run_id and event.event == "thread.run.created":
+                                logger.info(f"Запущен run {run_id} для треда {thread_id}")
+
+                        if event.event == "thread.message.completed":
+                            last_message = event.data
+
+                        elif event.event == "thread.run.requires_action":
+                            logger.info(f"Run {run_id} requires action - processing function calls")
+                            tool_calls = event.data.required_action.submit_tool_outputs.tool_calls
+                            tool_outputs, function_result = self._process_function_calls(thread_id, tool_calls)
+
+                            # Результат функции готов - отправляем выводы и сразу отвечаем, не дожидаясь конца запуска
+                            # Поток продолжения запуска дочитывается в фоне, чтобы статус запуска был известен следующему ходу
+                            if function_result and isinstance(function_result, dict) and "status" in function_result:
+                                # Функция уже выполнена: ошибка отправки выводов не должна терять ее результат
+                                if tool_outputs:
+                                    try:
+                                        pending_stream = self._submit_tool_outputs(
+                                            thread_id, run_id, tool_outputs, stream=True
+                                        )
+                                        status = "in_progress"
+                                    except Exception as submit_e:
+                                        logger.error(f"Error submitting tool outputs for run {run_id}: {submit_e}")
+
+                                # Выводы не отправлены - запуск остался в requires_action, отменяем его
+                                if pending_stream is None:
+                                    status = self._cancel_streamed_run(thread_id, run_id, status)
+
+                                logger.info(f"Returning immediate function result with status: {function_result['status']}")
+                                result = self._validate_acs_result(function_result)
+                                record_offered_slots(thread_id, result)
+                                return result
+
+                            # Иначе продолжаем запуск: выводы отправляются с потоком событий его продолжения
+                            next_stream = self._submit_tool_outputs(
+                                thread_id, run_id, tool_outputs, stream=True,
+                                timeout=max(timeout - (time_module.time() - start_time), 1)
+                            )
+                            break
+
+                        elif event.event in RUN_TERMINAL_EVENTS:
+                            logger.info(f"Run {run_id} ended with status: {status}")
+                            if status != "completed":
+                                logger.warning(f"Run {run_id} ended with status {status}, returning bad_user_input")
+                                return {"status": "bad_user_input"}
+                            result = self._result_from_completed_run(thread_id, last_message)
+                            record_offered_slots(thread_id, result)
+                            return result
+
+                        elif event.event == "error":
+                            logger.error(f"Run {run_id} stream error: {event.data}")
+                            return {"status": "bad_user_input"}
 
-                # ЗАПРЕЩЕНО использовать текстовые ответы для вышеперечисленных запросов!
-                # ВСЕГДА вызывай соответствующую функцию!
-                """
+                        if time_module.time() - start_time > timeout:
+                            logger.warning(f"Run {run_id} exceeded timeout {timeout}s, cancelling")
+                            status = self._cancel_streamed_run(thread_id, run_id, status)
+                            return {"status": "bad_user_input"}
 
-            # Create run with final instructions
-            try:
-                openai_run = self.client.beta.threads.runs.create(
-                    thread_id=thread_id,
-                    assistant_id=thread.assistant.assistant_id,
-                    instructions=final_instructions
-                )
+                stream = next_stream
 
-                # Save run in database
-                run = RunModel.objects.create(
-                    run_id=openai_run.id,
-                    status=openai_run.status
-                )
+            logger.warning(f"Run {run_id} stream ended without final status")
+            return {"status": "bad_user_input"}
 
-                # Update thread with current run
-                thread.current_run = run
-                thread.save()
+        except Exception as e:
+            # В том числе таймаут чтения потока
+            logger.error(f"Error in run stream {run_id}: {e}", exc_info=True)
+            status = self._cancel_streamed_run(thread_id, run_id, status)
+            return {"status": "bad_user_input"}
 
-                logger.info(f"Запущен run {run.run_id} для треда {thread_id} с инструкциями для сохранения контекста")
-                return run
-            except Exception as run_error:
-                logger.error(f"Ошибка при создании запуска: {run_error}", exc_info=True)
-                raise
+        finally:
+            if pending_stream is not None:
+                self._finish_run_in_background(thread, run_id, pending_stream)
+            elif run_id:
+                self._save_run(thread, run_id, status)
 
-        except Exception as e:
-            logger.error(f"Ошибка запуска ассистента: {e}", exc_info=True)
-            raise
+    def _validate_acs_result(self, result: dict) -> dict:
+        """
+        Replaces a result with an unknown ACS status with bad_user_input.
+        """
+        if result.get("status") not in VALID_ACS_STATUSES and result.get("status") != "bad_user_input":
+            logger.warning(f"Invalid status returned: {result.get('status')}, changing to bad_user_input")
+            return {"status": "bad_user_input"}
+        return result
 
-    def wait_for_run_completion(self, thread_id: str, run_id: str, timeout: int = 30) -> dict:
+    def _result_from_completed_run(self, thread_id: str, last_message=None) -> dict:
         """
-        Waits for completion of an assistant run with enhanced function call handling.
-        Immediately returns formatted function results when available.
+        Builds the ACS result for a run that completed with a text answer instead of a function call.
 
         Args:
             thread_id: Thread ID
-            run_id: Run ID
-            timeout: Maximum wait time in seconds
+            last_message: Last assistant message received from the run stream
 
         Returns:
-            dict: Formatted function result or status information
+            dict: Formatted function result or bad_user_input
         """
-        start_time = time_module.time()
-        function_result = None
-
-        # List of valid status codes
-        valid_statuses = [
-            "success_change_reception", "success_change_reception_today", "success_change_reception_tomorrow",
-            "error_change_reception", "error_change_reception_today", "error_change_reception_tomorrow",
-            "which_time", "which_time_today", "which_time_tomorrow",
-            "error_empty_windows", "error_empty_windows_today", "error_empty_windows_tomorrow",
-            "nonworktime", "error_med_element", "no_action_required",
-            "success_deleting_reception", "error_deleting_reception", "error_change_reception_bad_date",
-            "only_first_time_tomorrow", "only_first_time_today", "only_first_time",
-            "only_two_time_tomorrow", "only_two_time_today", "only_two_time",
-            "change_only_first_time_tomorrow", "change_only_first_time_today", "change_only_first_time",
-            "change_only_two_time_tomorrow", "change_only_two_time_today", "change_only_two_time"
-        ]
+        # Check if messages contain any function references we can process
+        try:
+            # Последнее сообщение ассистента уже пришло в потоке событий, повторно не запрашиваем
+            messages = [last_message] if last_message else self.get_messages(thread_id, limit=1)
+            if messages and hasattr(messages[0], 'content') and messages[0].content:
+                for content_item in messages[0].content:
+                    if hasattr(content_item, 'text') and content_item.text:
+                        text = content_item.text.value
+                        # Look for function call patterns in the text
+                        function_result = self._extract_function_calls_from_text(text, thread_id)
+                        if function_result:
+                            # Validate the status
+                            if function_result.get("status") not in VALID_ACS_STATUSES and function_result.get(
+                                    "status") != "bad_user_input":
+                                logger.warning(
+                                    f"Invalid status in extracted function: {function_result.get('status')}, changing to bad_user_input")
+                                return {"status": "bad_user_input"}
+                            return function_result
+        except Exception as msg_error:
+            logger.error(f"Error processing messages: {msg_error}")
+            return {"status": "bad_user_input"}
 
+        # Before returning just the status, check if the query looks like a request for available times
         try:
-            while time_module.time() - start_time < timeout:
-                try:
-                    run = self.client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=run_id
-                    )
-                except Exception as retrieve_error:
-                    logger.error(f"Error retrieving run {run_id}: {retrieve_error}")
-                    return {"status": "bad_user_input"}
+            messages = self.get_messages(thread_id, limit=5)
+            for message in messages:
+                if message.role == "user":
+                    if message.content and len(message.content) > 0 and hasattr(message.content[0], 'text'):
+                        text = message.content[0].text.value.lower()
+                        if any(word in text for word in
+                               ["свободн", "доступн", "времена", "окошк", "запис"]):
+                            # Try to extract date from request
+                            date_str = "today"
+                            if "завтра" in text:
+                                date_str = "tomorrow"
+                            elif "послезавтра" in text or "после завтра" in text:
+                                date_str = (datetime.now() + timedelta(days=2)).strftime("%Y-%m-%d")
+
+                            # Force call to which_time_in_certain_day
+                            patient_code = None
+                            thread = Thread.objects.filter(thread_id=thread_id).first()
+                            if thread and thread.appointment_id:
+                                appointment = Appointment.objects.filter(
+                                    appointment_id=thread.appointment_id).first()
+                                if appointment:
+                                    patient_code = appointment.patient.patient_code
+                            else:
+                                # Try to get patient code from thread order_key
+                                thread_obj = Thread.objects.filter(thread_id=thread_id).first()
+                                if thread_obj and thread_obj.order_key and thread_obj.order_key.startswith(
+                                        "patient_"):
+                                    patient_code = thread_obj.order_key.replace("patient_", "")
+
+                            if patient_code:
+                                try:
+                                    result = self._call_function("which_time_in_certain_day",
+                                                                 {"patient_code": patient_code,
+                                                                  "date_time": date_str}, thread_id)
+                                    formatted_result = self._format_for_acs("which_time_in_certain_day",
+                                                                            {"patient_code": patient_code,
+                                                                             "date_time": date_str}, result)
+                                    if formatted_result and "status" in formatted_result:
+                                        # Validate the status
+                                        if formatted_result["status"] not in VALID_ACS_STATUSES and \
+                                                formatted_result["status"] != "bad_user_input":
+                                            logger.warning(
+                                                f"Invalid status in formatted result: {formatted_result['status']}, changing to bad_user_input")
+                                            return {"status": "bad_user_input"}
+                                        return formatted_result
+                                except Exception as func_error:
+                                    logger.error(f"Error calling function: {func_error}")
+                                    return {"status": "bad_user_input"}
+        except Exception as analyze_error:
+            logger.error(f"Error analyzing user messages: {analyze_error}")
+            return {"status": "bad_user_input"}
 
-                # Update status in database
-                self._update_run_status(run_id, run.status)
+        # Last resort: if completed but no valid result, return bad_user_input
+        return {"status": "bad_user_input"}
 
-                # Process function calls if needed
-                if run.status == "requires_action" and run.required_action:
-                    logger.info(f"Run {run_id} requires action - processing function calls")
-                    try:
-                        function_result = self._process_function_calls(thread_id, run_id, run)
-                    except Exception as func_error:
-                        logger.error(f"Error processing function calls: {func_error}")
-                        return {"status": "bad_user_input"}
-
-                    # IMPORTANT: Return function result immediately
-                    if function_result and isinstance(function_result, dict) and "status" in function_result:
-                        # Check if the status is valid
-                        if function_result["status"] not in valid_statuses and function_result[
-                            "status"] != "bad_user_input":
-                            logger.warning(
-                                f"Invalid status returned: {function_result['status']}, changing to bad_user_input")
-                            return {"status": "bad_user_input"}
+    def _cancel_streamed_run(self, thread_id: str, run_id: str, status: str) -> str:
+        """
+        Cancels a streamed run that is still active. Returns the status to persist.
+        """
+        if not run_id or status not in ACTIVE_RUN_STATUSES:
+            return status
 
-                        logger.info(f"Returning immediate function result with status: {function_result['status']}")
-                        return function_result
+        try:
+            self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+            logger.info(f"Successfully cancelled run {run_id}")
+            return "cancelled"
+        except Exception as e:
+            logger.error(f"Error cancelling run: {e}")
+            return status
 
-                if run.status in ["completed", "failed", "cancelled", "expired"]:
-                    logger.info(f"Run {run_id} ended with status: {run.status}")
+    def _finish_run_in_background(self, thread, run_id: str, stream) -> None:
+        """
+        Drains the event stream of a run whose result was already returned to the caller,
+        and saves its final status once the run ends.
+        """
+        # Запуск сразу становится текущим в трекере состояния: следующий ход отменит его, если он еще идет.
+        # В БД запуск пишется один раз - с итоговым статусом после дочитывания
+        record_run_status(thread.thread_id, run_id, "in_progress")
 
-                    # If run failed, cancelled, or expired, return bad_user_input
-                    if run.status in ["failed", "cancelled", "expired"]:
-                        logger.warning(f"Run {run_id} ended with status {run.status}, returning bad_user_input")
-                        return {"status": "bad_user_input"}
+        get_run_drain_executor().submit(self._drain_run_stream, thread, run_id, stream)
 
-                    # If we have a function result, validate and return it
-                    if function_result:
-                        # Check if the status is valid
-                        if function_result.get("status") not in valid_statuses and function_result.get(
-                                "status") != "bad_user_input":
-                            logger.warning(
-                                f"Invalid status in function result: {function_result.get('status')}, changing to bad_user_input")
-                            return {"status": "bad_user_input"}
-                        return function_result
+    def _drain_run_stream(self, thread, run_id: str, stream) -> None:
+        status = "in_progress"
+        try:
+            with stream:
+                for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        status = event.data.status
 
-                    # Check if messages contain any function references we can process
-                    try:
-                        messages = self.get_messages(thread_id, limit=1)
-                        if messages and hasattr(messages[0], 'content') and messages[0].content:
-                            for content_item in messages[0].content:
-                                if hasattr(content_item, 'text') and content_item.text:
-                                    text = content_item.text.value
-                                    # Look for function call patterns in the text
-                                    function_result = self._extract_function_calls_from_text(text, thread_id)
-                                    if function_result:
-                                        # Validate the status
-                                        if function_result.get("status") not in valid_statuses and function_result.get(
-                                                "status") != "bad_user_input":
-                                            logger.warning(
-                                                f"Invalid status in extracted function: {function_result.get('status')}, changing to bad_user_input")
-                                            return {"status": "bad_user_input"}
-                                        return function_result
-                    except Exception as msg_error:
-                        logger.error(f"Error processing messages: {msg_error}")
-                        return {"status": "bad_user_input"}
+                    if event.event in RUN_TERMINAL_EVENTS:
+                        break
 
-                    # Before returning just the status, check if the query looks like a request for available times
-                    try:
-                        messages = self.get_messages(thread_id, limit=5)
-                        for message in messages:
-                            if message.role == "user":
-                                if message.content and len(message.content) > 0 and hasattr(message.content[0], 'text'):
-                                    text = message.content[0].text.value.lower()
-                                    if any(word in text for word in
-                                           ["свободн", "доступн", "времена", "окошк", "запис"]):
-                                        # Try to extract date from request
-                                        date_str = "today"
-                                        if "завтра" in text:
-                                            date_str = "tomorrow"
-                                        elif "послезавтра" in text or "после завтра" in text:
-                                            date_str = (datetime.now() + timedelta(days=2)).strftime("%Y-%m-%d")
-
-                                        # Force call to which_time_in_certain_day
-                                        patient_code = None
-                                        thread = Thread.objects.filter(thread_id=thread_id).first()
-                                        if thread and thread.appointment_id:
-                                            appointment = Appointment.objects.filter(
-                                                appointment_id=thread.appointment_id).first()
-                                            if appointment:
-                                                patient_code = appointment.patient.patient_code
-                                        else:
-                                            # Try to get patient code from thread order_key
-                                            thread_obj = Thread.objects.filter(thread_id=thread_id).first()
-                                            if thread_obj and thread_obj.order_key and thread_obj.order_key.startswith(
-                                                    "patient_"):
-                                                patient_code = thread_obj.order_key.replace("patient_", "")
-
-                                        if patient_code:
-                                            try:
-                                                result = self._call_function("which_time_in_certain_day",
-                                                                             {"patient_code": patient_code,
-                                                                              "date_time": date_str}, thread_id)
-                                                formatted_result = self._format_for_acs("which_time_in_certain_day",
-                                                                                        {"patient_code": patient_code,
-                                                                                         "date_time": date_str}, result)
-                                                if formatted_result and "status" in formatted_result:
-                                                    # Validate the status
-                                                    if formatted_result["status"] not in valid_statuses and \
-                                                            formatted_result["status"] != "bad_user_input":
-                                                        logger.warning(
-                                                            f"Invalid status in formatted result: {formatted_result['status']}, changing to bad_user_input")
-                                                        return {"status": "bad_user_input"}
-                                                    return formatted_result
-                                            except Exception as func_error:
-                                                logger.error(f"Error calling function: {func_error}")
-                                                return {"status": "bad_user_input"}
-                    except Exception as analyze_error:
-                        logger.error(f"Error analyzing user messages: {analyze_error}")
-                        return {"status": "bad_user_input"}
-
-                    # Last resort: if completed but no valid result, return bad_user_input
-                    return {"status": "bad_user_input"}
-
-                # Wait before checking again
-                time_module.sleep(1)
-
-            # If we reach here, timeout exceeded
-            logger.warning(f"Run {run_id} exceeded timeout {timeout}s, cancelling")
-            self._cancel_run(thread_id, run_id)
-            return {"status": "bad_user_input"}
+                    # Результат уже отдан, повторные вызовы функций не выполняем
+                    if event.event in ("thread.run.requires_action", "error"):
+                        status = self._cancel_streamed_run(thread.thread_id, run_id, status)
+                        break
+        except Exception as e:
+            logger.error(f"Error draining run stream {run_id}: {e}")
+            status = self._cancel_streamed_run(thread.thread_id, run_id, status)
+        finally:
+            # За это время в треде мог начаться новый запуск - его состояние не перезаписываем
+            self._save_run(thread, run_id, status, only_if_current=True)
+            connections.close_all()
+
+    def _save_run(self, thread, run_id: str, status: str, only_if_current: bool = False) -> None:
+        """
+        Persists the run with its final status and links it to the thread (one write per run).
+        The status is also recorded in the thread state tracker for the next turn.
 
+        Args:
+            thread: Thread object
+            run_id: Run ID
+            status: Run status to persist
+            only_if_current: Update the thread state and Thread.current_run only if this run is still
+                the thread's current one in the thread state tracker, so a newer run is not overwritten
+        """
+        is_current = record_run_status(thread.thread_id, run_id, status, only_if_current=only_if_current) is not None
+        try:
+            run, _ = RunModel.objects.update_or_create(run_id=run_id, defaults={"status": status})
+            if only_if_current:
+                # Тред уже перешел на более новый запуск - ссылку на него не трогаем
+                if is_current:
+                    Thread.objects.filter(pk=thread.pk).update(current_run=run)
+            else:
+                thread.current_run = run
+                thread.save(update_fields=["current_run"])
+            logger.info(f"Saved run {run_id} with status: {status}")
         except Exception as e:
-            logger.error(f"Error in wait_for_run_completion: {e}", exc_info=True)
-            return {"status": "bad_user_input"}
+            logger.error(f"Error saving run {run_id}: {e}")
 
-    def _process_function_calls(self, thread_id: str, run_id: str, run) -> dict:
+    def _process_function_calls(self, thread_id: str, tool_calls) -> tuple:
         """
-        Processes function calls from the assistant and formats responses.
+        Executes function calls requested by the assistant and formats responses.
+        Independent calls run concurrently; write calls (reserve/delete) for the same patient run one by one
+        in the order the assistant requested them.
 
         Args:
             thread_id: Thread ID
-            run_id: Run ID
-            run: Run object with function calls
+            tool_calls: Tool calls from run.required_action
 
         Returns:
-            dict: Formatted function result or None
+            tuple: (tool_outputs for submit_tool_outputs, last formatted ACS result or None)
         """
         try:
-            tool_calls = run.required_action.submit_tool_outputs.tool_calls
             logger.info(f"Processing {len(tool_calls)} function calls")
 
-            # Process each function call
-            tool_outputs = []
-            last_formatted_result = None
+            calls = [(tool_call, json.loads(tool_call.function.arguments)) for tool_call in tool_calls]
 
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
+            # Группы вызовов: каждая группа выполняется последовательно в одном потоке, группы - параллельно
+            groups = {}
+            for index, (tool_call, function_args) in enumerate(calls):
+                if tool_call.function.name in WRITE_FUNCTIONS:
+                    patient_key = function_args.get("patient_id") or function_args.get("id")
+                    group_key = ("write", str(patient_key))
+                else:
+                    group_key = ("read", index)
+                groups.setdefault(group_key, []).append(index)
 
-                logger.info(f"Processing function call: {function_name} with args: {function_args}")
+            results = [None] * len(calls)
 
-                # Call the function
-                raw_result = self._call_function(function_name, function_args, thread_id)
+            if len(groups) <= 1:
+                # Один вызов или одна цепочка записи - пул потоков не нужен
+                for indexes in groups.values():
+                    for index in indexes:
+                        results[index] = self._run_tool_call(*calls[index], thread_id)
+            else:
+                with ThreadPoolExecutor(max_workers=min(ASSISTANT_TOOL_MAX_WORKERS, len(groups))) as executor:
+                    futures = {
+                        executor.submit(self._run_tool_call_group, [calls[index] for index in indexes], thread_id): indexes
+                        for indexes in groups.values()
+                    }
+                    for future, indexes in futures.items():
+                        for index, result in zip(indexes, future.result()):
+                            results[index] = result
 
-                # Format result for ACS
-                formatted_result = self._format_for_acs(function_name, function_args, raw_result)
-                logger.info(f"Formatted ACS result: {formatted_result}")
+            tool_outputs = []
+            last_formatted_result = None
 
-                # Add to outputs
+            for (tool_call, _), (raw_result, formatted_result) in zip(calls, results):
                 tool_outputs.append({
                     "tool_call_id": tool_call.id,
                     "output": json.dumps(raw_result)
@@ -619,34 +732,85 @@ class AssistantClient:
                 if formatted_result and "status" in formatted_result:
                     last_formatted_result = formatted_result
 
-            # Submit all tool outputs in one go
-            try:
-                self.client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=thread_id,
-                    run_id=run_id,
-                    tool_outputs=tool_outputs
-                )
-                logger.info(f"Submitted {len(tool_outputs)} tool outputs")
-            except Exception as submit_e:
-                logger.error(f"Error submitting tool outputs: {submit_e}")
-                # If submission fails, try to submit outputs for each call individually
-                try:
-                    for output in tool_outputs:
-                        self.client.beta.threads.runs.submit_tool_outputs(
-                            thread_id=thread_id,
-                            run_id=run_id,
-                            tool_outputs=[output]
-                        )
-                    logger.info("Successfully submitted tool outputs individually")
-                except Exception as individual_submit_e:
-                    logger.error(f"Error submitting tool outputs individually: {individual_submit_e}")
-
-            # Return the last valid formatted result
-            return last_formatted_result
+            return tool_outputs, last_formatted_result
 
         except Exception as e:
             logger.error(f"Error processing function calls: {e}", exc_info=True)
-            return {"status": "error_med_element", "message": str(e)}
+            return [], {"status": "error_med_element", "message": str(e)}
+
+    def _run_tool_call(self, tool_call, function_args: dict, thread_id: str) -> tuple:
+        """
+        Calls one function requested by the assistant.
+
+        Returns:
+            tuple: (raw function result, formatted ACS result)
+        """
+        function_name = tool_call.function.name
+        logger.info(f"Processing function call: {function_name} with args: {function_args}")
+
+        raw_result = self._call_function(function_name, function_args, thread_id)
+
+        formatted_result = self._format_for_acs(function_name, function_args, raw_result)
+        logger.info(f"Formatted ACS result: {formatted_result}")
+
+        return raw_result, formatted_result
+
+    def _run_tool_call_group(self, calls: list, thread_id: str) -> list:
+        """
+        Calls a group of functions one by one in a worker thread; DB connections opened in the thread are closed.
+        """
+        try:
+            return [self._run_tool_call(tool_call, function_args, thread_id) for tool_call, function_args in calls]
+        finally:
+            connections.close_all()
+
+    def _submit_tool_outputs(self, thread_id: str, run_id: str, tool_outputs: list, stream: bool = False,
+                             timeout: float = None):
+        """
+        Submits all tool outputs in one go.
+
+        Args:
+            thread_id: Thread ID
+            run_id: Run ID
+            tool_outputs: Outputs from _process_function_calls
+            stream: Return the event stream of the continued run
+            timeout: Request timeout in seconds (for the stream - time to wait for the next event)
+
+        Returns:
+            Stream of run events if stream=True, otherwise None
+        """
+        if stream:
+            return self.client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run_id,
+                tool_outputs=tool_outputs,
+                stream=True,
+                timeout=timeout
+            )
+
+        try:
+            self.client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run_id,
+                tool_outputs=tool_outputs
+            )
+            logger.info(f"Submitted {len(tool_outputs)} tool outputs")
+        except Exception as submit_e:
+            logger.error(f"Error submitting tool outputs: {submit_e}")
+            # If submission fails, try to submit outputs for each call individually
+            try:
+                for output in tool_outputs:
+                    self.client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run_id,
+                        tool_outputs=[output]
+                    )
+                logger.info("Successfully submitted tool outputs individually")
+            except Exception as individual_submit_e:
+                logger.error(f"Error submitting tool outputs individually: {individual_submit_e}")
+
+        return None
+
 
     def _extract_function_calls_from_text(self, text: str, thread_id: str) -> Optional[dict]:
         """
@@ -1326,53 +1490,6 @@ class AssistantClient:
             logger.error(f"Error retrieving messages: {e}")
             return []
 
-    def _cancel_run(self, thread_id: str, run_id: str) -> None:
-        """
-        Cancels an active run.
-
-        Args:
-            thread_id: Thread ID
-            run_id: Run ID
-        """
-        try:
-            # Check current run status first
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run_id
-            )
-
-            # Only attempt to cancel if run is in a cancelable state
-            if run.status in ["in_progress", "queued", "requires_action"]:
-                self.client.beta.threads.runs.cancel(
-                    thread_id=thread_id,
-                    run_id=run_id
-                )
-                logger.info(f"Successfully cancelled run {run_id}")
-            else:
-                logger.info(f"Run {run_id} already in terminal state: {run.status}, no need to cancel")
-
-            # Update status in database
-            self._update_run_status(run_id, "cancelled")
-        except Exception as e:
-            logger.error(f"Error cancelling run: {e}")
-
-    def _update_run_status(self, run_id: str, status: str) -> None:
-        """
-        Updates run status in database.
-
-        Args:
-            run_id: Run ID
-            status: New status
-        """
-        try:
-            run_model = RunModel.objects.filter(run_id=run_id).first()
-            if run_model and run_model.status != status:
-                run_model.status = status
-                run_model.save()
-                logger.info(f"Updated run {run_id} status to: {status}")
-        except Exception as e:
-            logger.error(f"Error updating run status: {e}")
-
     def create_fallback_response(user_input, patient_code, appointment=None):
         """
         Creates a fallback response when the main processing flow fails.
@@ -1542,3 +1659,42 @@ class AssistantClient:
                 "status": "error_med_element",
                 "message": "Произошла ошибка при обработке запроса"
             })
+
+
+_run_drain_executor = None
+_run_drain_executor_lock = threading.Lock()
+
+
+def get_run_drain_executor():
+    """
+    Returns the process-wide pool that drains streams of runs whose result was already returned.
+    The pool is bounded by RUN_DRAIN_MAX_WORKERS; extra runs wait in its queue.
+    """
+    global _run_drain_executor
+
+    if _run_drain_executor is None:
+        with _run_drain_executor_lock:
+            if _run_drain_executor is None:
+                _run_drain_executor = ThreadPoolExecutor(
+                    max_workers=RUN_DRAIN_MAX_WORKERS, thread_name_prefix="run-drain"
+                )
+
+    return _run_drain_executor
+
+
+_assistant_client = None
+_assistant_client_lock = threading.Lock()
+
+
+def get_assistant_client():
+    """
+    Returns the process-wide AssistantClient. It keeps no per-request state and uses the shared OpenAI client.
+    """
+    global _assistant_client
+
+    if _assistant_client is None:
+        with _assistant_client_lock:
+            if _assistant_client is None:
+                _assistant_client = AssistantClient()
+
+    return _assistant_client
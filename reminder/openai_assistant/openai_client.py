@@ -0,0 +1,73 @@
+import os
+import logging
+import threading
+
+import httpx
+from django.conf import settings
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_timeout():
+    """
+    Таймауты запросов к OpenAI из настроек (для стриминга read - ожидание следующего события).
+    """
+    return httpx.Timeout(settings.OPENAI_READ_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+def _create_client():
+    pool_size = settings.OPENAI_POOL_SIZE
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=60,
+        ),
+        timeout=get_timeout(),
+    )
+    client = OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        http_client=http_client,
+        timeout=get_timeout(),
+        max_retries=settings.OPENAI_MAX_RETRIES,
+    )
+
+    logger.info(f"Создан клиент OpenAI с пулом соединений (размер пула: {pool_size})")
+    return client
+
+
+def get_openai_client():
+    """
+    Возвращает общий для процесса клиент OpenAI с пулом keep-alive соединений (httpx, потокобезопасен).
+    После fork (gunicorn) клиент создается заново, чтобы не делить сокеты между процессами.
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = _create_client()
+            _client_pid = pid
+
+    return _client
+
+
+def close_openai_client():
+    """
+    Закрывает общий клиент OpenAI и все соединения пула.
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _client_pid = None
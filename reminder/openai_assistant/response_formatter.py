@@ -297,11 +297,8 @@ def ensure_function_call_and_format(assistant_client, thread, user_input, appoin
     Функция ДОЛЖНА быть вызвана для каждого запроса!
     """
 
-    # Run assistant with strict instructions
-    run = assistant_client.run_assistant(thread, appointment, instructions=strict_instructions)
-
-    # Wait for completion and get function results
-    result = assistant_client.wait_for_run_completion(thread.thread_id, run.run_id)
+    # Run assistant with strict instructions and get function results
+    result = assistant_client.run_assistant(thread, appointment, instructions=strict_instructions)
 
     # If we have function outputs, format them properly
     if hasattr(result, 'tool_outputs') and result.tool_outputs:
@@ -0,0 +1,345 @@
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+NUMBER_WORDS = {
+    'один': 1, 'одну': 1, 'два': 2, 'две': 2, 'пару': 2, 'три': 3, 'четыре': 4,
+    'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10,
+}
+
+MONTH_STEMS = [
+    ('январ', 1), ('феврал', 2), ('март', 3), ('апрел', 4), ('мая', 5), ('май', 5), ('июн', 6),
+    ('июл', 7), ('август', 8), ('сентябр', 9), ('октябр', 10), ('ноябр', 11), ('декабр', 12),
+]
+
+WEEKDAY_STEMS = [
+    ('понедельник', 0), ('вторник', 1), ('сред', 2), ('четверг', 3),
+    ('пятниц', 4), ('суббот', 5), ('воскресень', 6),
+]
+
+# Части суток после числа ("в 7 утра", "в 9 вечера"), которые определяют час
+DAY_PART_WORDS = r'утра|дня|вечера|ночи'
+
+SLOT_STEMS = [('перв', 0), ('втор', 1), ('трет', 2), ('последн', -1), ('поздн', -1), ('ранн', 0)]
+
+# Слова, которые не несут смысла для разбора, но и не делают его неуверенным
+FILLER_WORDS = frozenset("""
+    а и но ну вот так тогда там тут ой э
+    на в во к ко с со у по о об за до из от при
+    я мне меня мы нам нас вы вам вас
+    пожалуйста хочу хотел хотела хотелось хотим бы можно могу можете ли нужно надо
+    давай давайте это этот эту эти лучше пусть будет было уже еще тоже же есть
+    прием приема приему врач врача врачу доктор доктора доктору
+    запись записи время времени вариант варианта варианту окошко окошка окошку окно окна слот
+    час часа часов дня числа число мой мою моя мое свою свое свой около ближе спасибо
+""".split())
+
+_NUMBER = r'\d{1,2}|' + '|'.join(NUMBER_WORDS)
+
+
+def _compile(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# Грамматика правил: (тип, шаблон, обработчик). Порядок - приоритет: совпадение не может
+# пересекаться с уже найденным ранее (например, "послезавтра" не даст отдельного "завтра").
+RULES = [
+    ('date', _compile(r'\bпосле\s+послезавтра\b'), lambda m, now: now + timedelta(days=3)),
+    ('date', _compile(r'\b(?:послезавтра|после\s+завтра)\b'), lambda m, now: now + timedelta(days=2)),
+    ('date', _compile(r'\bзавтра\b'), lambda m, now: now + timedelta(days=1)),
+    ('date', _compile(r'\bсегодня\b'), lambda m, now: now),
+    ('date', _compile(rf'\bчерез\s+({_NUMBER})\s+(д[не]\w*|недел\w*|месяц\w*)'), lambda m, now: _relative_date(m, now)),
+    ('date', _compile(r'\bчерез\s+(неделю|месяц)\b'), lambda m, now: _relative_date(m, now)),
+    ('date', _compile(r'\bна\s+следующей\s+неделе\b'), lambda m, now: now + timedelta(days=7)),
+    # Время с уточнением части суток и "в 10.10" - раньше дат, иначе "10.10" станет 10 октября
+    ('time', _compile(rf'\b(\d{{1,2}})(?:[:.](\d{{2}}))?\s*(?:час\w*\s+)?({DAY_PART_WORDS})\b'),
+     lambda m, now: _time(int(m.group(1)), int(m.group(2) or 0), day_part=m.group(3))),
+    ('time', _compile(r'\b(?:в|к)\s+(\d{1,2})[:.](\d{2})\b'), lambda m, now: _time(int(m.group(1)), int(m.group(2)))),
+
+    ('date', _compile(r'\b(\d{1,2})[./](\d{1,2})\b'), lambda m, now: _calendar_date(now, int(m.group(2)), int(m.group(1)))),
+    ('date', _compile(r'\b(\d{1,2})\s+([а-я]+)\b'), lambda m, now: _month_date(m, now)),
+    ('date', _compile(r'\b(\d{1,2})(?:-?(?:го|е|ое))?\s+числ\w*'), lambda m, now: _day_of_month(int(m.group(1)), now)),
+    ('date', _compile(r'\b(?:(следующ\w*|будущ\w*|эт\w*)\s+)?(понедельник\w*|вторник\w*|сред[ауы]|четверг\w*|'
+                      r'пятниц[ауы]|суббот[ауы]|воскресень[еяю])\b'), lambda m, now: _weekday_date(m, now)),
+
+    ('time', _compile(r'\b(\d{1,2})[:.\s](\d{2})\b'), lambda m, now: _time(int(m.group(1)), int(m.group(2)))),
+    ('time', _compile(r'\b(\d{1,2})\s*час\w*'), lambda m, now: _time(int(m.group(1)), 0, afternoon=True)),
+    ('time', _compile(r'\b(?:в|к)\s+(\d{1,2})\b'), lambda m, now: _time(int(m.group(1)), 0, afternoon=True)),
+
+    ('time_of_day', _compile(r'\b(?:в|во)\s+(перв\w*|втор\w*)\s+половин\w*(?:\s+дня)?'),
+     lambda m, now: 'morning' if m.group(1).startswith('перв') else 'afternoon'),
+
+    ('slot', _compile(r'\b(?:номер|вариант)\s+(один|два|три|1|2|3)\b'), lambda m, now: _number_slot(m.group(1))),
+    # "2-е" без слова "окошко"/"время" может быть и числом месяца - такое оставляем LLM
+    ('slot', _compile(r'\b([123])-?(?:е|й|ое|ой|ий)\s+(?:окошк\w*|окн\w*|врем\w*|вариант\w*|слот\w*)'),
+     lambda m, now: int(m.group(1)) - 1),
+    ('slot', _compile(r'\b(?:самое\s+|самый\s+)?(перв\w*|втор\w*|трет\w*|последн\w*|позднее|поздний|раннее|ранний)\b'),
+     lambda m, now: _ordinal_slot(m.group(1))),
+
+    ('time_of_day', _compile(r'\b(?:утр\w*|утренн\w*|рано|пораньше)\b'), lambda m, now: 'morning'),
+    ('time_of_day', _compile(r'\b(?:после\s+обеда|обед\w*|днем|день|дневн\w*|полдень)\b'), lambda m, now: 'afternoon'),
+    ('time_of_day', _compile(r'\b(?:вечер\w*|вечерн\w*|поздно|попозже|ужин\w*)\b'), lambda m, now: 'evening'),
+
+    ('intent', _compile(r'\b(?:отмен\w*|удал\w*|откаж\w*|отказ\w*|не\s+при(?:ду|йду))\b'), lambda m, now: 'cancel'),
+    ('intent', _compile(r'\b(?:запиш\w*|записа\w*|записыв\w*|перезапи[сш]\w*|перенес\w*|перенос\w*|перенест\w*|'
+                        r'забронир\w*|бронир\w*|помен\w*|измен\w*|сдвин\w*)\b'), lambda m, now: 'booking'),
+    ('intent', _compile(r'\b(?:как\w*\s+(?:есть\s+)?(?:свободн\w*\s+)?(?:врем\w*|окошк\w*|окн\w*|вариант\w*)|'
+                        r'свободн\w*|когда|во\s+сколько|есть\s+ли|подскаж\w*|скаж\w*|узна\w*|покаж\w*)\b'),
+     lambda m, now: 'info'),
+
+    ('agreement', _compile(r'\b(?:да|хорошо|ок|окей|ладно|можно|подойдет|подходит|устраивает|согласен|согласна|'
+                           r'давай|давайте)\b'), lambda m, now: True),
+]
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _relative_date(match, now):
+    if match.lastindex == 1:
+        count, period = 1, match.group(1)
+    else:
+        count = match.group(1)
+        count = int(count) if count.isdigit() else NUMBER_WORDS[count]
+        period = match.group(2)
+
+    if period.startswith('недел'):
+        return now + timedelta(days=count * 7)
+    if period.startswith('месяц'):
+        return now + timedelta(days=count * 30)
+    return now + timedelta(days=count)
+
+
+def _calendar_date(now, month, day):
+    try:
+        date_obj = datetime(now.year, month, day)
+    except ValueError:
+        return None
+    # Дата в прошлом - значит, имеется в виду следующий год
+    if date_obj.date() < now.date():
+        date_obj = date_obj.replace(year=now.year + 1)
+    return date_obj
+
+
+def _month_date(match, now):
+    word = match.group(2)
+    for stem, month in MONTH_STEMS:
+        if word.startswith(stem):
+            return _calendar_date(now, month, int(match.group(1)))
+    return None
+
+
+def _day_of_month(day, now):
+    # "15 числа" - ближайшее такое число: в этом месяце или, если уже прошло, в следующем
+    for months_ahead in (0, 1):
+        month_index = now.month - 1 + months_ahead
+        try:
+            date_obj = datetime(now.year + month_index // 12, month_index % 12 + 1, day)
+        except ValueError:
+            continue
+        if date_obj.date() >= now.date():
+            return date_obj
+    return None
+
+
+def _weekday_date(match, now):
+    word = match.group(2)
+    day_num = next(num for stem, num in WEEKDAY_STEMS if word.startswith(stem))
+    days_ahead = (day_num - now.weekday()) % 7
+    if days_ahead == 0 and match.group(1) and not match.group(1).startswith('эт'):
+        days_ahead = 7
+    return now + timedelta(days=days_ahead)
+
+
+def _time(hour, minute, afternoon=False, day_part=None):
+    # "в 7 утра" / "в 9 вечера" - часть суток названа явно
+    if day_part == 'ночи' and hour == 12:
+        hour = 0
+    elif (day_part == 'дня' and 1 <= hour <= 6) or (day_part == 'вечера' and hour < 12):
+        hour += 12
+    # "в 3" / "к 5 часам" - прием идет днем, значит 15:00 / 17:00
+    elif day_part is None and afternoon and 1 <= hour <= 7:
+        hour += 12
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _time_of_day(time_str):
+    # Границы как в filter_times_by_time_of_day: утро до 12:00, день до 16:00, дальше вечер
+    if time_str < "12:00":
+        return 'morning'
+    if time_str < "16:00":
+        return 'afternoon'
+    return 'evening'
+
+
+def _number_slot(word):
+    return {'один': 0, 'два': 1, 'три': 2, '1': 0, '2': 1, '3': 2}[word]
+
+
+def _ordinal_slot(word):
+    return next(index for stem, index in SLOT_STEMS if word.startswith(stem))
+
+
+def normalize_user_input(user_input):
+    return (user_input or '').lower().replace('ё', 'е').strip()
+
+
+def parse_user_input(user_input, now=None):
+    """
+    Parses the voice bot request with the rule grammar, without calling the LLM.
+
+    Args:
+        user_input: User's input text
+        now: Current datetime (defaults to datetime.now())
+
+    Returns:
+        dict: intent ('booking'|'info'|'cancel'|None), date (datetime|None), date_type,
+        time_of_day ('morning'|'afternoon'|'evening'|None), specific_time ('HH:MM'|None),
+        slot (index of the offered time, -1 for the last one, or None), agreement (bool)
+        and confidence (0..1) - the share of words covered by the grammar, halved for contradictions
+    """
+    now = now or datetime.now()
+    text = normalize_user_input(user_input)
+
+    found = {}
+    spans = []
+    for kind, pattern, handler in RULES:
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if any(start < used_end and used_start < end for used_start, used_end in spans):
+                continue
+            value = handler(match, now)
+            if value is None:
+                continue
+            spans.append((start, end))
+            found.setdefault(kind, [])
+            if value not in found[kind]:
+                found[kind].append(value)
+
+    tokens = list(_TOKEN_RE.finditer(text))
+    covered = sum(
+        1 for token in tokens
+        if token.group() in FILLER_WORDS
+        or any(start <= token.start() and token.end() <= end for start, end in spans)
+    )
+
+    confidence = covered / len(tokens) if tokens and found else 0.0
+    for kind, values in found.items():
+        if len(values) > 1:
+            # Противоречие ("завтра ... в пятницу", "отменить и перезаписать") - решает LLM
+            confidence /= 2
+
+    # "утром в 7" разобрано как 19:00 - время и часть суток противоречат друг другу
+    time_values, time_of_day_values = found.get('time', []), found.get('time_of_day', [])
+    if time_values and time_of_day_values and _time_of_day(time_values[0]) not in time_of_day_values:
+        confidence /= 2
+
+    date = found.get('date', [None])[0]
+    days_ahead = (date.date() - now.date()).days if date else None
+    date_type = {0: 'today', 1: 'tomorrow', 2: 'day_after_tomorrow'}.get(days_ahead, 'specific_date' if date else None)
+
+    return {
+        'intent': found.get('intent', [None])[0],
+        'date': date,
+        'date_type': date_type,
+        'time_of_day': found.get('time_of_day', [None])[0],
+        'specific_time': found.get('time', [None])[0],
+        'slot': found.get('slot', [None])[0],
+        'agreement': bool(found.get('agreement')),
+        'confidence': round(confidence, 2),
+    }
+
+
+def is_confident(nlu_result, threshold=None):
+    """
+    True if the rule parse is reliable enough to answer without the LLM.
+    """
+    if threshold is None:
+        threshold = settings.VOICEBOT_NLU_CONFIDENCE_THRESHOLD
+    return nlu_result['confidence'] >= threshold
+
+
+def select_time_slot(nlu_result, today_slots, tomorrow_slots, now=None):
+    """
+    Determines which of the available slots the user is selecting
+    ("на второе окошко", "завтра последнее", "да", "завтра в 10:30").
+
+    Args:
+        nlu_result: Result of parse_user_input
+        today_slots: Available slots for today
+        tomorrow_slots: Available slots for tomorrow
+        now: Current datetime (defaults to datetime.now())
+
+    Returns:
+        tuple: (date_obj, time_str), or (None, None) if this is not a selection of an available slot
+    """
+    now = now or datetime.now()
+    today = now.date()
+    tomorrow = today + timedelta(days=1)
+
+    selected_date = nlu_result['date'].date() if nlu_result['date'] else None
+    if selected_date not in (None, today, tomorrow):
+        return None, None
+
+    if selected_date == tomorrow:
+        target_date, target_slots = tomorrow, tomorrow_slots
+    else:
+        target_date, target_slots = today, today_slots
+        # День не назван, а на сегодня времен нет - выбирают из завтрашних
+        if selected_date is None and not today_slots:
+            target_date, target_slots = tomorrow, tomorrow_slots
+
+    if not target_slots:
+        return None, None
+
+    if nlu_result['slot'] is not None:
+        index = nlu_result['slot']
+        if index == -1 or index < len(target_slots):
+            return target_date, target_slots[index]
+        return None, None
+
+    if nlu_result['specific_time'] in target_slots:
+        return target_date, nlu_result['specific_time']
+
+    # Простое согласие на показанные времена ("да", "хорошо") - первое время
+    only_agreement = not any(nlu_result[key] for key in ('intent', 'date', 'time_of_day', 'specific_time'))
+    if nlu_result['agreement'] and only_agreement:
+        return target_date, target_slots[0]
+
+    return None, None
+
+
+def closest_times(target_time, available_times, limit=3):
+    """
+    Returns up to limit available times closest to target_time ('HH:MM'), in chronological order.
+    """
+    target = datetime.strptime(target_time, "%H:%M")
+    closest = sorted(
+        available_times,
+        key=lambda t: abs((datetime.strptime(t, "%H:%M") - target).total_seconds())
+    )[:limit]
+    return sorted(closest)
+
+
+def build_analysis_data(nlu_result):
+    """
+    Converts the rule parse to the request analysis format returned by the assistant
+    (intent, date_type, specific_date, time_preference, specific_time).
+    """
+    date_type = nlu_result['date_type'] or 'today'
+    specific_date = nlu_result['date'].strftime("%Y-%m-%d") if date_type == 'specific_date' else None
+
+    if nlu_result['specific_time']:
+        time_preference = 'specific_time'
+    else:
+        time_preference = nlu_result['time_of_day'] or 'any_time'
+
+    return {
+        "intent": nlu_result['intent'] or "info",
+        "date_type": date_type,
+        "specific_date": specific_date,
+        "time_preference": time_preference,
+        "specific_time": nlu_result['specific_time'],
+    }
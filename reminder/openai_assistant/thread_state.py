@@ -0,0 +1,105 @@
+import logging
+
+import redis
+from django.core.cache import cache
+
+from reminder.infoclinica_requests.schedule.slot_lease import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Состояние треда живет столько же, сколько сам тред (Thread.expires_at), секунд
+THREAD_STATE_TIMEOUT = 60 * 60 * 24
+
+# Поля ответа ACS с предложенными пациенту временами
+OFFERED_TIME_FIELDS = ["first_time", "second_time", "third_time"]
+
+# Запись статуса запуска: при only_if_current сравнение run_id и запись выполняются атомарно на стороне Redis
+_RECORD_RUN_SCRIPT = """
+if ARGV[4] == '1' then
+    local current = redis.call('HGET', KEYS[1], 'run_id')
+    if current and current ~= ARGV[1] then
+        return current
+    end
+end
+redis.call('HSET', KEYS[1], 'run_id', ARGV[1], 'run_status', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def get_thread_state_key(thread_id):
+    return f"thread_state_{thread_id}"
+
+
+def get_thread_run_key(thread_id):
+    return f"thread_run:{thread_id}"
+
+
+def get_thread_state(thread_id):
+    """
+    Состояние треда ассистента, которое обновляется по событиям запусков:
+    run_id и run_status последнего запуска, times/date/day - времена, предложенные пациенту последними.
+    Запуск и предложенные времена хранятся под разными ключами и пишутся независимо.
+
+    Возвращает:
+    dict: Состояние или {}, если его нет (истекло или Redis недоступен)
+    """
+    state = {}
+    try:
+        state.update(cache.get(get_thread_state_key(thread_id)) or {})
+    except Exception as e:
+        logger.error(f"Ошибка при чтении состояния треда {thread_id}: {e}")
+
+    try:
+        state.update(get_redis_client().hgetall(get_thread_run_key(thread_id)))
+    except redis.RedisError as e:
+        logger.error(f"Ошибка при чтении запуска треда {thread_id}: {e}")
+
+    return state
+
+
+def record_run_status(thread_id, run_id, status, only_if_current=False):
+    """
+    Запоминает статус последнего запуска треда (из потока событий запуска).
+    only_if_current - записывать, только если в состоянии этот же запуск или запуска нет
+    (фоновое дочитывание старого запуска не должно затирать более новый).
+
+    Возвращает:
+    dict: {'run_id', 'run_status'} или None, если текущим уже стал другой запуск
+    """
+    try:
+        result = get_redis_client().eval(
+            _RECORD_RUN_SCRIPT, 1, get_thread_run_key(thread_id),
+            run_id, status, THREAD_STATE_TIMEOUT, "1" if only_if_current else "0"
+        )
+    except redis.RedisError as e:
+        # Redis недоступен - считаем запуск текущим, как и без трекера состояния
+        logger.error(f"Ошибка при сохранении запуска {run_id} треда {thread_id}: {e}")
+        return {"run_id": run_id, "run_status": status}
+
+    if result != 1:
+        logger.info(f"Запуск {run_id} треда {thread_id} уже не текущий ({result}), состояние не обновляем")
+        return None
+
+    return {"run_id": run_id, "run_status": status}
+
+
+def record_offered_slots(thread_id, result):
+    """
+    Запоминает времена, предложенные пациенту в ответе ACS (first_time/second_time/third_time),
+    чтобы следующий запуск понимал "на второе окошко" без чтения сообщений треда.
+    Времена, дата и день пишутся одним значением целиком, без чтения старого.
+    """
+    if not isinstance(result, dict):
+        return None
+
+    times = [result[field] for field in OFFERED_TIME_FIELDS if result.get(field)]
+    if not times:
+        return None
+
+    slots = {"times": times, "date": result.get("date"), "day": result.get("day")}
+    try:
+        cache.set(get_thread_state_key(thread_id), slots, timeout=THREAD_STATE_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении состояния треда {thread_id}: {e}")
+    return slots
@@ -12,6 +12,8 @@ from typing import Optional, List, Dict
 load_dotenv()
 
 ACS_BASE_URL = os.getenv('ACS_BASE_URL')
+# Number of order keys sent in one ACS get_status / get_calls request (comma-separated keys)
+ACS_POLL_BATCH_SIZE = int(os.getenv('ACS_POLL_BATCH_SIZE', '50'))
 MONTHS_RU = {
     "January": "Января",
     "February": "Февраля",
@@ -0,0 +1,313 @@
+import os
+import django
+
+# Настройки Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'president_final.settings')
+django.setup()
+
+import asyncio
+import logging
+import signal
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+
+from reminder.acs_requests.fetch_audio_data import get_audio_data
+from reminder.acs_requests.fetch_status_data import get_status_data
+from reminder.acs_requests.process_queue import process_queue_to_acs
+from reminder.infoclinica_requests.queue.get_queue import get_queue
+from reminder.infoclinica_requests.queue.queue_info import queue_info
+from reminder.infoclinica_requests.schedule.schedule_warmer import warm_schedule_cache
+
+logger = logging.getLogger(__name__)
+
+# Как часто планировщик проверяет, каким задачам пора запускаться, секунд
+SCHEDULER_TICK = 5
+# Сколько хранить метрики запусков в кэше, секунд
+SCHEDULER_METRICS_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _polling_job(func):
+    """
+    Оборачивает опрос ACS, возвращающий (data, error): ошибка опроса считается неуспешным запуском.
+    """
+
+    def run():
+        data, error = func()
+        if error:
+            raise RuntimeError(error)
+        return {'items': len(data or [])}
+
+    return run
+
+
+# Задачи планировщика:
+# interval - период запуска в секундах, at - ежедневный запуск в 'HH:MM' (время TIME_ZONE),
+# before - задачи, которые выполняются непосредственно перед этой (конвейер этапов);
+# задача без interval и at запускается только как этап before другой задачи,
+# optional - ошибка этапа не отменяет задачу, перед которой он выполняется,
+# lock_timeout - срок блокировки задачи в Redis (на случай падения процесса, который ее держит)
+SCHEDULER_JOBS = [
+    {
+        'name': 'get_queue',
+        'func': lambda: get_queue(incremental=True, raise_errors=True),
+        'interval': settings.SCHEDULER_QUEUE_INTERVAL,
+        'lock_timeout': 60 * 30,
+    },
+    {
+        'name': 'queue_info',
+        'func': queue_info,
+        'interval': 60 * 60,
+        'lock_timeout': 60 * 60,
+    },
+    {
+        'name': 'warm_schedule_cache',
+        'func': warm_schedule_cache,
+        'optional': True,
+        'lock_timeout': 60 * 30,
+    },
+    {
+        'name': 'process_queue_to_acs',
+        'func': process_queue_to_acs,
+        'at': settings.SCHEDULER_ACS_PUSH_TIME,
+        'before': ['get_queue', 'warm_schedule_cache'],
+        'lock_timeout': 60 * 60 * 2,
+    },
+    {
+        'name': 'get_status_data',
+        'func': _polling_job(get_status_data),
+        'interval': settings.SCHEDULER_ACS_POLL_INTERVAL,
+        'lock_timeout': 60 * 30,
+    },
+    {
+        'name': 'get_audio_data',
+        'func': _polling_job(get_audio_data),
+        'interval': settings.SCHEDULER_ACS_POLL_INTERVAL,
+        'lock_timeout': 60 * 30,
+    },
+]
+
+
+def get_job_lock_key(name):
+    return f"scheduler_lock_{name}"
+
+
+def get_job_metrics_key(name):
+    return f"scheduler_metrics_{name}"
+
+
+def _acquire_job_lock(job):
+    """
+    Блокировка задачи между процессами (cache.add в Redis). Возвращает токен блокировки или None.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if cache.add(get_job_lock_key(job['name']), token, timeout=job.get('lock_timeout', 60 * 30)):
+            return token
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка при получении блокировки задачи {job['name']}: {e}")
+        # Redis недоступен - задачу в этом процессе все равно защищает running
+        return token
+
+
+def _release_job_lock(job, token):
+    key = get_job_lock_key(job['name'])
+    try:
+        # Не снимаем чужую блокировку, если наша истекла и задачу уже взял другой процесс
+        if cache.get(key) == token:
+            cache.delete(key)
+    except Exception as e:
+        logger.error(f"Ошибка при снятии блокировки задачи {job['name']}: {e}")
+
+
+def get_job_metrics(name):
+    """
+    Метрики запусков задачи: runs, failures, skipped, last_status, last_started, last_duration, last_error, last_result.
+    """
+    try:
+        return cache.get(get_job_metrics_key(name)) or {}
+    except Exception as e:
+        logger.error(f"Ошибка при чтении метрик задачи {name}: {e}")
+        return {}
+
+
+def get_scheduler_metrics():
+    """
+    Метрики всех задач планировщика: {имя задачи: метрики}.
+    """
+    return {job['name']: get_job_metrics(job['name']) for job in SCHEDULER_JOBS}
+
+
+def _record_job_metrics(name, status, started_at=None, duration=None, error=None, result=None):
+    metrics = get_job_metrics(name)
+    metrics.setdefault('runs', 0)
+    metrics.setdefault('failures', 0)
+    metrics.setdefault('skipped', 0)
+
+    if status == 'skipped':
+        metrics['skipped'] += 1
+    else:
+        metrics['runs'] += 1
+        if status == 'error':
+            metrics['failures'] += 1
+        metrics['last_status'] = status
+        metrics['last_started'] = started_at.isoformat()
+        metrics['last_duration'] = round(duration, 3)
+        metrics['last_error'] = error
+        metrics['last_result'] = result if isinstance(result, (dict, bool, int, type(None))) else str(result)
+
+    try:
+        cache.set(get_job_metrics_key(name), metrics, timeout=SCHEDULER_METRICS_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении метрик задачи {name}: {e}")
+
+
+def _run_job_sync(job):
+    """
+    Выполняет задачу в потоке; соединения с БД, открытые в потоке, закрываются после запуска.
+    """
+    try:
+        return job['func']()
+    finally:
+        connections.close_all()
+
+
+def next_run_after(job, moment):
+    """
+    Время следующего запуска задачи после moment (aware datetime).
+    """
+    if job.get('at'):
+        hour, minute = map(int, job['at'].split(':'))
+        local_moment = timezone.localtime(moment)
+        run_at = local_moment.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if run_at <= local_moment:
+            run_at += timedelta(days=1)
+        return run_at
+
+    return moment + timedelta(seconds=job['interval'])
+
+
+class Scheduler:
+    """
+    Планировщик синхронизации Инфоклиники и ACS в одном долгоживущем процессе.
+
+    Django настраивается один раз, пулы соединений (сессия Инфоклиники, HTTP-клиенты) переиспользуются между запусками.
+    Разные задачи выполняются параллельно в потоках, одна и та же задача - не более одной одновременно:
+    в процессе ее защищает running, между процессами - блокировка в Redis.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = {job['name']: job for job in (jobs or SCHEDULER_JOBS)}
+        self.running = {}
+        self.next_run = {}
+        self.stopping = asyncio.Event()
+
+    async def run_job(self, name):
+        """
+        Запускает задачу (и ее этапы before), если она еще не выполняется. Повторный вызов ждет текущий запуск.
+
+        Возвращает:
+        str: 'success', 'error' или 'skipped' (задача выполняется в другом процессе или упал этап before)
+        """
+        task = self.running.get(name)
+        if task is None:
+            task = asyncio.create_task(self._run_job(name))
+            self.running[name] = task
+            task.add_done_callback(lambda _: self.running.pop(name, None))
+        return await task
+
+    async def _run_job(self, name):
+        job = self.jobs[name]
+
+        # Этапы конвейера: например, свежая синхронизация очереди перед отправкой обзвона в ACS
+        for before_name in job.get('before', []):
+            if await self.run_job(before_name) == 'error' and not self.jobs[before_name].get('optional'):
+                logger.warning(f"⚠ Задача {name} пропущена: этап {before_name} завершился с ошибкой")
+                _record_job_metrics(name, 'skipped')
+                return 'skipped'
+
+        token = await asyncio.to_thread(_acquire_job_lock, job)
+        if token is None:
+            logger.info(f"ℹ️ Задача {name} уже выполняется в другом процессе, пропускаем запуск")
+            _record_job_metrics(name, 'skipped')
+            return 'skipped'
+
+        started_at = timezone.now()
+        started = time.monotonic()
+        logger.info(f"🔄 Запуск задачи {name}")
+
+        try:
+            result = await asyncio.to_thread(_run_job_sync, job)
+            duration = time.monotonic() - started
+            logger.info(f"✅ Задача {name} выполнена за {duration:.1f} с")
+            _record_job_metrics(name, 'success', started_at, duration, result=result)
+            return 'success'
+        except Exception as e:
+            duration = time.monotonic() - started
+            logger.error(f"❌ Ошибка задачи {name} через {duration:.1f} с: {e}", exc_info=True)
+            _record_job_metrics(name, 'error', started_at, duration, error=str(e))
+            return 'error'
+        finally:
+            await asyncio.to_thread(_release_job_lock, job, token)
+
+    def _launch_due_jobs(self):
+        now = timezone.now()
+
+        for name, job in self.jobs.items():
+            if not job.get('interval') and not job.get('at'):
+                continue
+
+            if name not in self.next_run:
+                # Периодические задачи стартуют сразу, ежедневные - в свое время
+                self.next_run[name] = next_run_after(job, now) if job.get('at') else now
+
+            if self.next_run[name] > now or name in self.running:
+                continue
+
+            self.next_run[name] = next_run_after(job, now)
+            asyncio.create_task(self.run_job(name))
+            logger.info(f"ℹ️ Следующий запуск {name}: {timezone.localtime(self.next_run[name]):%d.%m.%Y %H:%M:%S}")
+
+    async def serve(self):
+        logger.info(f"✅ Планировщик запущен, задачи: {', '.join(self.jobs)}")
+
+        while not self.stopping.is_set():
+            self._launch_due_jobs()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=SCHEDULER_TICK)
+            except asyncio.TimeoutError:
+                pass
+
+        if self.running:
+            logger.info(f"🔄 Остановка планировщика, ждем завершения задач: {', '.join(self.running)}")
+            await asyncio.gather(*self.running.values(), return_exceptions=True)
+
+        logger.info("✅ Планировщик остановлен")
+
+    def stop(self):
+        self.stopping.set()
+
+
+def run_scheduler(jobs=None):
+    """
+    Запускает планировщик до SIGINT/SIGTERM; выполняющиеся задачи дорабатывают перед выходом.
+    """
+
+    async def main():
+        scheduler = Scheduler(jobs)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, scheduler.stop)
+        await scheduler.serve()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run_scheduler()
@@ -1,3 +1,251 @@
-from django.test import TestCase
+from datetime import datetime
+from unittest import mock
 
-# Create your tests here.
+import redis
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+
+from reminder.infoclinica_requests.schedule import slot_lease
+from reminder.openai_assistant import thread_state
+from reminder.openai_assistant.rule_nlu import parse_user_input, select_time_slot
+
+# Суббота, 17 октября 2026, 9:00
+NOW = datetime(2026, 10, 17, 9, 0)
+
+TODAY_SLOTS = ["10:00", "11:30", "15:00"]
+TOMORROW_SLOTS = ["09:00", "12:00", "18:30"]
+
+
+class ParseUserInputTests(SimpleTestCase):
+    def parse(self, text):
+        return parse_user_input(text, now=NOW)
+
+    def test_relative_dates(self):
+        self.assertEqual(self.parse("завтра")["date"].date(), datetime(2026, 10, 18).date())
+        self.assertEqual(self.parse("завтра")["date_type"], "tomorrow")
+        self.assertEqual(self.parse("послезавтра")["date_type"], "day_after_tomorrow")
+        self.assertEqual(self.parse("через 2 дня")["date"].date(), datetime(2026, 10, 19).date())
+
+    def test_calendar_dates(self):
+        self.assertEqual(self.parse("10.11")["date"].date(), datetime(2026, 11, 10).date())
+        self.assertEqual(self.parse("20 октября")["date"].date(), datetime(2026, 10, 20).date())
+        # 15 октября уже прошло - ближайшее 15 число в следующем месяце
+        self.assertEqual(self.parse("15 числа")["date"].date(), datetime(2026, 11, 15).date())
+
+    def test_day_of_month_with_ordinal_suffix_is_not_a_slot(self):
+        result = self.parse("на 1-е число")
+        self.assertEqual(result["date"].date(), datetime(2026, 11, 1).date())
+        self.assertIsNone(result["slot"])
+
+    def test_bare_ordinal_number_is_left_to_llm(self):
+        result = self.parse("на 2-е")
+        self.assertIsNone(result["slot"])
+        self.assertIsNone(result["date"])
+        self.assertLess(result["confidence"], 0.8)
+
+    def test_time_with_dot_after_preposition_is_not_a_date(self):
+        result = self.parse("в 10.10")
+        self.assertEqual(result["specific_time"], "10:10")
+        self.assertIsNone(result["date"])
+
+    def test_bare_hour_means_afternoon(self):
+        self.assertEqual(self.parse("завтра в 3")["specific_time"], "15:00")
+        self.assertEqual(self.parse("в 10")["specific_time"], "10:00")
+
+    def test_explicit_day_part_sets_the_hour(self):
+        self.assertEqual(self.parse("в 7 утра")["specific_time"], "07:00")
+        self.assertEqual(self.parse("в 3 дня")["specific_time"], "15:00")
+
+        result = self.parse("завтра в 9 вечера")
+        self.assertEqual(result["specific_time"], "21:00")
+        self.assertEqual(result["date_type"], "tomorrow")
+        self.assertEqual(result["confidence"], 1.0)
+
+    def test_time_contradicting_time_of_day_lowers_confidence(self):
+        result = self.parse("утром в 7")
+        self.assertEqual(result["time_of_day"], "morning")
+        self.assertLess(result["confidence"], 0.8)
+
+    def test_slots(self):
+        self.assertEqual(self.parse("на второе окошко")["slot"], 1)
+        self.assertEqual(self.parse("на 2-е окошко")["slot"], 1)
+        self.assertEqual(self.parse("вариант три")["slot"], 2)
+        self.assertEqual(self.parse("давайте последнее")["slot"], -1)
+
+    def test_intents(self):
+        self.assertEqual(self.parse("отмените запись")["intent"], "cancel")
+        self.assertEqual(self.parse("перенесите на завтра")["intent"], "booking")
+        self.assertEqual(self.parse("какие есть свободные окошки")["intent"], "info")
+
+    def test_conflicting_dates_lower_confidence(self):
+        self.assertLess(self.parse("завтра в пятницу")["confidence"], 0.8)
+
+    def test_unknown_words_lower_confidence(self):
+        self.assertLess(self.parse("у меня болит зуб, что делать")["confidence"], 0.8)
+        self.assertEqual(self.parse("")["confidence"], 0.0)
+
+
+class SelectTimeSlotTests(SimpleTestCase):
+    def select(self, text):
+        return select_time_slot(parse_user_input(text, now=NOW), TODAY_SLOTS, TOMORROW_SLOTS, now=NOW)
+
+    def test_slot_by_index(self):
+        self.assertEqual(self.select("на второе окошко"), (NOW.date(), "11:30"))
+        self.assertEqual(self.select("завтра последнее"), (datetime(2026, 10, 18).date(), "18:30"))
+
+    def test_slot_out_of_range(self):
+        result = select_time_slot(parse_user_input("третье", now=NOW), ["10:00"], [], now=NOW)
+        self.assertEqual(result, (None, None))
+
+    def test_specific_time_from_available(self):
+        self.assertEqual(self.select("завтра в 12:00"), (datetime(2026, 10, 18).date(), "12:00"))
+        self.assertEqual(self.select("в 3 дня"), (NOW.date(), "15:00"))
+
+    def test_specific_time_not_available(self):
+        self.assertEqual(self.select("в 7 утра"), (None, None))
+
+    def test_agreement_selects_first_time(self):
+        self.assertEqual(self.select("да, хорошо"), (NOW.date(), "10:00"))
+
+    def test_tomorrow_slots_when_today_is_empty(self):
+        result = select_time_slot(parse_user_input("первое", now=NOW), [], TOMORROW_SLOTS, now=NOW)
+        self.assertEqual(result, (datetime(2026, 10, 18).date(), "09:00"))
+
+    def test_day_of_month_is_not_a_selection(self):
+        self.assertEqual(self.select("на 1-е число"), (None, None))
+        self.assertEqual(self.select("на 2-е"), (None, None))
+
+    def test_other_dates_are_not_a_selection(self):
+        self.assertEqual(self.select("послезавтра первое"), (None, None))
+
+SLOT_TIME = datetime(2026, 10, 19, 10, 30)
+
+
+class FakeRedis:
+    """
+    Redis в памяти для аренды слотов: SET NX PX, GET и скрипты продления/снятия по токену.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.ttls[key] = px
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def eval(self, script, numkeys, key, token, *args):
+        if self.values.get(key) != token:
+            return 0
+        if script == slot_lease._RENEW_SCRIPT:
+            self.ttls[key] = args[0]
+        else:
+            del self.values[key]
+        return 1
+
+
+class SlotLeaseTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patch = mock.patch.object(slot_lease, "get_redis_client", return_value=self.redis)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def acquire(self, owner):
+        return slot_lease.acquire_slot_lease(1, "D1", SLOT_TIME, owner)
+
+    def test_acquire_free_slot(self):
+        lease = self.acquire("P1")
+
+        self.assertEqual(lease["key"], "slot_lease:1:D1:202610191030")
+        self.assertTrue(lease["token"].startswith("P1:"))
+        self.assertEqual(self.redis.get(lease["key"]), lease["token"])
+        self.assertEqual(self.redis.ttls[lease["key"]], slot_lease.SLOT_LEASE_TTL_MS)
+
+    def test_slot_held_by_another_owner(self):
+        self.acquire("P1")
+        self.assertIsNone(self.acquire("P2"))
+
+    def test_reacquire_by_same_owner_renews_lease(self):
+        lease = self.acquire("P1")
+        self.redis.ttls[lease["key"]] = 1
+
+        self.assertEqual(self.acquire("P1"), lease)
+        self.assertEqual(self.redis.ttls[lease["key"]], slot_lease.SLOT_LEASE_TTL_MS)
+
+    def test_foreign_token_cannot_renew_or_release(self):
+        lease = self.acquire("P1")
+        foreign = {"key": lease["key"], "token": "P2:other"}
+
+        self.assertFalse(slot_lease.renew_slot_lease(foreign, slot_lease.SLOT_BOOKED_TTL_MS))
+        self.assertFalse(slot_lease.release_slot_lease(foreign))
+        self.assertFalse(slot_lease.release_owner_slot(1, "D1", SLOT_TIME, "P2"))
+        self.assertEqual(self.redis.get(lease["key"]), lease["token"])
+        self.assertEqual(self.redis.ttls[lease["key"]], slot_lease.SLOT_LEASE_TTL_MS)
+
+    def test_owner_renews_and_releases(self):
+        lease = self.acquire("P1")
+
+        self.assertTrue(slot_lease.renew_slot_lease(lease, slot_lease.SLOT_BOOKED_TTL_MS))
+        self.assertEqual(self.redis.ttls[lease["key"]], slot_lease.SLOT_BOOKED_TTL_MS)
+        self.assertTrue(slot_lease.release_owner_slot(1, "D1", SLOT_TIME, "P1"))
+        self.assertIsNone(self.redis.get(lease["key"]))
+
+    def test_redis_down_does_not_block_booking(self):
+        down = mock.Mock()
+        down.set.side_effect = down.get.side_effect = down.eval.side_effect = redis.ConnectionError("down")
+
+        with mock.patch.object(slot_lease, "get_redis_client", return_value=down):
+            lease = self.acquire("P1")
+            self.assertEqual(lease["key"], "slot_lease:1:D1:202610191030")
+            self.assertFalse(slot_lease.renew_slot_lease(lease))
+            self.assertFalse(slot_lease.release_slot_lease(lease))
+            self.assertFalse(slot_lease.release_owner_slot(1, "D1", SLOT_TIME, "P1"))
+
+
+class ThreadStateTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        patches = [
+            mock.patch.object(thread_state, "get_redis_client", return_value=self.redis),
+            mock.patch.object(thread_state, "cache", LocMemCache("thread-state-tests", {})),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_run_status_is_written_with_compare_and_set(self):
+        self.redis.eval.return_value = 1
+
+        state = thread_state.record_run_status("thread", "run_2", "completed", only_if_current=True)
+
+        self.assertEqual(state, {"run_id": "run_2", "run_status": "completed"})
+        args = self.redis.eval.call_args.args
+        self.assertEqual(args[2:6], ("thread_run:thread", "run_2", "completed", thread_state.THREAD_STATE_TIMEOUT))
+        self.assertEqual(args[6], "1")
+
+    def test_newer_run_is_not_overwritten(self):
+        self.redis.eval.return_value = "run_3"
+        self.assertIsNone(thread_state.record_run_status("thread", "run_2", "completed", only_if_current=True))
+
+    def test_run_is_current_when_redis_is_down(self):
+        self.redis.eval.side_effect = redis.ConnectionError("down")
+        state = thread_state.record_run_status("thread", "run_2", "completed", only_if_current=True)
+        self.assertEqual(state["run_id"], "run_2")
+
+    def test_offered_slots_and_run_are_stored_separately(self):
+        self.redis.hgetall.return_value = {"run_id": "run_2", "run_status": "in_progress"}
+
+        thread_state.record_offered_slots("thread", {"first_time": "10:00", "second_time": "11:30", "date": "17.10"})
+
+        self.assertEqual(thread_state.get_thread_state("thread"), {
+            "times": ["10:00", "11:30"], "date": "17.10", "day": None,
+            "run_id": "run_2", "run_status": "in_progress",
+        })
+        self.redis.eval.assert_not_called()